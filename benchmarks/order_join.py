@@ -0,0 +1,80 @@
+"""
+    Бенчмарк стадии сопоставления заказов с продажами и статусами.
+    Сравнивает время и пиковую память вариантов из wildberries.joins
+    и исходной построчной реализации.
+
+    Построчная реализация по умолчанию прогоняется на том же объеме,
+    что и остальные (на 100000 позиций это занимает несколько минут).
+
+    Запуск из корня проекта:
+        python -m benchmarks.order_join --items 100000
+"""
+import argparse
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from wildberries import joins
+from wildberries.tests.factories import legacy_join_order_items, make_join_input
+
+
+def measure(make_sales_index, join, order_items, sales, orders_statuses):
+    """
+        Время и пиковая память считаются в разных прогонах:
+        tracemalloc заметно замедляет выполнение.
+    """
+    started_at = time.perf_counter()
+    orders_count = sum(1 for _ in join(order_items, make_sales_index(sales), orders_statuses))
+    elapsed = time.perf_counter() - started_at
+
+    tracemalloc.start()
+    for _ in join(order_items, make_sales_index(sales), orders_statuses):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return orders_count, elapsed, peak
+
+
+def measure_import(module):
+    output = subprocess.check_output([
+        sys.executable, '-c',
+        'import time; t = time.perf_counter(); import {}; '
+        'print(time.perf_counter() - t)'.format(module)
+    ])
+    return float(output)
+
+
+def report(name, items_count, orders_count, elapsed, peak):
+    print('{:<8} {:>9} позиций {:>9} заказов {:>8.2f} с {:>10.0f} позиций/с {:>8.1f} МБ'.format(
+        name, items_count, orders_count, elapsed, items_count / elapsed, peak / 2 ** 20))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=100000,
+                        help='Количество позиций заказов')
+    parser.add_argument('--legacy-items', type=int, default=None,
+                        help='Количество позиций для построчной реализации, '
+                             'по умолчанию как --items, 0 - не запускать')
+    args = parser.parse_args()
+    if args.legacy_items is None:
+        args.legacy_items = args.items
+
+    print('импорт pandas: {:.2f} с'.format(measure_import('pandas')))
+
+    order_items, sales, orders_statuses = make_join_input(args.items)
+    for backend, (make_sales_index, join) in joins.JOIN_BACKENDS.items():
+        report(backend, len(order_items),
+               *measure(make_sales_index, join, order_items, sales, orders_statuses))
+
+    if args.legacy_items:
+        if args.legacy_items != args.items:
+            order_items, sales, orders_statuses = make_join_input(args.legacy_items)
+        report('legacy', len(order_items),
+               *measure(joins.pandas_sales_index, legacy_join_order_items,
+                        order_items, sales, orders_statuses))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+    Бенчмарк определения последних статусов сборочных заданий.
+
+    Запуск из корня проекта:
+        python -m benchmarks.order_statuses --orders 100000
+"""
+import argparse
+import time
+
+import dateutil.parser
+
+from wildberries.api import resolve_order_statuses
+from wildberries.tests.factories import make_order_payloads
+
+
+def legacy_resolve_order_statuses(orders):
+    """
+        Исходная реализация: вложенный цикл с повторным
+        разбором дат при каждом сравнении.
+    """
+    order_statuses = []
+    for order in orders:
+        last_status = order['items'][0]
+        for order_status in order['items']:
+            if (dateutil.parser.parse(order_status['date'])
+                        > dateutil.parser.parse(last_status['date'])
+                    ):
+                last_status = order_status
+        order_statuses.append({
+            'order_id': int(order['order_id']),
+            'status': last_status['status'],
+        })
+    return order_statuses
+
+
+def measure(name, resolve, orders):
+    started_at = time.perf_counter()
+    result = resolve(orders)
+    elapsed = time.perf_counter() - started_at
+    print('{:<14} {:>8} заданий {:>8.2f} с {:>10.0f} заданий/с'.format(
+        name, len(orders), elapsed, len(orders) / elapsed))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=100000,
+                        help='Примерное количество сборочных заданий')
+    args = parser.parse_args()
+
+    # В среднем 1.6 позиции на заказ, статус есть у 80% заказов
+    _, _, orders = make_order_payloads(args.orders * 2)
+
+    expected = measure('legacy', legacy_resolve_order_statuses, orders)
+    result = measure('single pass', resolve_order_statuses, orders)
+    measure('with history', lambda orders: resolve_order_statuses(orders, with_history=True), orders)
+    assert result == expected, "результаты реализаций должны совпадать"
+
+
+if __name__ == '__main__':
+    main()
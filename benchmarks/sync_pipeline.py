@@ -0,0 +1,100 @@
+"""
+    Сквозной бенчмарк синхронизации: команды make_products и make_orders
+    загружают данные с локального стенда API (wildberries.tests.fake_api)
+    в базу данных.
+
+    Перед каждым прогоном карточки и заказы магазина "benchmark" удаляются,
+    поэтому бенчмарк работает только с отдельной базой, имя которой
+    передается явно и содержит "bench":
+        DB_NAME=wb_bench python manage.py migrate
+        python -m benchmarks.sync_pipeline --database wb_bench --sizes 10000 100000 1000000
+"""
+import argparse
+import datetime
+import os
+import time
+
+import django
+
+
+# Обязательная часть имени базы, на которой можно запускать бенчмарк
+BENCH_DATABASE_MARKER = 'bench'
+
+
+def run_command(name, **options):
+    from django.core.management import call_command
+
+    started_at = time.perf_counter()
+    call_command(name, **options)
+    return time.perf_counter() - started_at
+
+
+def report(name, size, rows_count, elapsed):
+    print('{:<14} {:>9} записей API {:>9} строк в базе {:>9.1f} с {:>9.0f} строк/с'.format(
+        name, size, rows_count, elapsed, rows_count / elapsed if elapsed else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', required=True,
+                        help='Имя отдельной базы для бенчмарка, должно содержать "bench". '
+                             'Данные магазина "benchmark" в ней удаляются')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000],
+                        help='Количество карточек и позиций заказов на стенде')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Задержка каждого ответа стенда в секундах')
+    parser.add_argument('--throttle-rate', type=float, default=0,
+                        help='Доля запросов, на которые стенд отвечает 429')
+    parser.add_argument('--window-days', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    if BENCH_DATABASE_MARKER not in args.database:
+        parser.error('база {!r} не похожа на базу для бенчмарка: '
+                     'имя должно содержать {!r}'.format(args.database, BENCH_DATABASE_MARKER))
+    os.environ['DB_NAME'] = args.database
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+    django.setup()
+
+    from django.db import connection
+
+    # Настройки могли взять имя базы не из DB_NAME
+    database = connection.settings_dict['NAME']
+    if database != args.database:
+        parser.error('подключение настроено на базу {!r}, а не {!r}'.format(
+            database, args.database))
+
+    from wildberries import deletion, transport
+    from wildberries.models import Order, OrderItem, ProductCard, Store
+    from wildberries.tests.fake_api import FakeWildberriesAPI
+
+    store, _ = Store.objects.get_or_create(name='benchmark')
+
+    for size in args.sizes:
+        deletion.delete_orders(Order.objects.filter(store=store))
+        deletion.delete_product_cards(ProductCard.objects.filter(store=store))
+
+        fake_api = FakeWildberriesAPI(
+            cards=size, order_items=size,
+            latency=args.latency, throttle_rate=args.throttle_rate)
+        with fake_api:
+            fake_api.point_api()
+            # Стенд отвечает за все API сразу, ограничение частоты
+            # запросов к нему не нужно
+            transport.set_rate_limit(fake_api.url, None)
+
+            elapsed = run_command('make_products', store=store.id)
+            report('make_products', size,
+                   ProductCard.objects.filter(store=store).count(), elapsed)
+
+            date_from = fake_api.from_datetime.replace(tzinfo=datetime.timezone.utc)
+            elapsed = run_command('make_orders', store=store.id,
+                                  date_from=date_from,
+                                  date_to=date_from + datetime.timedelta(days=fake_api.days),
+                                  window_days=args.window_days, workers=args.workers)
+            report('make_orders', size,
+                   OrderItem.objects.filter(order__store=store).count(), elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,81 @@
+import codecs
 import datetime
-import math
+import heapq
+import itertools
+import json
+import os
+import pickle
+import re
+import tempfile
+import time
 import uuid
-from urllib.parse import urljoin
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from http import HTTPStatus
 
-import requests
-import pandas as pd
-import simplejson
-import dateutil.parser
-from pytz import timezone
+from . import cache, transport
+from .joins import JOIN_BACKENDS, SALES_COLUMNS, order_key
 
 
-FBS_ORDERS_BASE_API = 'https://suppliers-orders.wildberries.ru'
-FBS_ORDERS_STATUSES_BASE_API = 'https://marketplace-remotewh.wildberries.ru'
-STATISTICS_BASE_API = 'https://suppliers-stats.wildberries.ru'
-CONTENT_BASE_API = 'https://suppliers-api.wildberries.ru'
+# Базовые адреса можно переопределить переменными окружения,
+# например, чтобы направить запросы на локальный стенд
+# (python -m wildberries.tests.fake_api).
+FBS_ORDERS_BASE_API = os.environ.get(
+    'WB_FBS_ORDERS_BASE_API', 'https://suppliers-orders.wildberries.ru')
+FBS_ORDERS_STATUSES_BASE_API = os.environ.get(
+    'WB_FBS_ORDERS_STATUSES_BASE_API', 'https://marketplace-remotewh.wildberries.ru')
+STATISTICS_BASE_API = os.environ.get(
+    'WB_STATISTICS_BASE_API', 'https://suppliers-stats.wildberries.ru')
+CONTENT_BASE_API = os.environ.get(
+    'WB_CONTENT_BASE_API', 'https://suppliers-api.wildberries.ru')
 
+# Через сколько после конца периода заказы и статусы за него считаются
+# окончательными, и ответ API за этот период хранится в кэше без срока
+# годности. Статусы заказов меняются, пока заказ доставляется.
+CLOSED_WINDOW_DELAY = datetime.timedelta(days=30)
 
-def _get_session_for_content_api(authorization_token):
+# Сколько секунд ждать ответов всех эндпоинтов при проверке подключения
+PROBE_DEADLINE = 10
+
+
+class WildberriesAPIError(Exception):
+    """
+        Ошибка при обращении к API Wildberries.
+    """
+
+
+class ProductPageError(WildberriesAPIError):
+    """
+        Не удалось получить страницу карточек товаров Content API.
+    """
+
+    def __init__(self, offset, limit, reason):
+        self.offset = offset
+        self.limit = limit
+        self.reason = reason
+        super().__init__(
+            'Не удалось получить карточки товаров (offset={}, limit={}): {}'.format(
+                offset, limit, reason)
+        )
+
+
+def _get_content_api_headers(authorization_token):
     """
-        Возвращает обьект сессии для работы с Content API.
+        Возвращает заголовки запросов к Content API.
     """
-    session = requests.Session()
-    session.headers.update({
+    return {
         'Authorization': authorization_token,
         'Content-Type': 'application/json',
-    })
-    return session
+    }
 
 
-def _get_product_list_request_data(supplier_id, offset, limit):
+def _get_product_list_request_data(supplier_id, offset, limit, order=None):
     """
         Формирование начальных данных
         для получения карточек товаров Content API.
+        order - сортировка в формате {"column": ..., "order": "asc"|"desc"}.
     """
-    return {
+    request_data = {
         'jsonrpc': '2.0',
         'id': str(uuid.uuid4()),
         'params': {
@@ -44,189 +86,511 @@ def _get_product_list_request_data(supplier_id, offset, limit):
             }
         }
     }
+    if order:
+        request_data['params']['filter'] = {'order': order}
+    return request_data
 
 
-def check_connection(access):
+def _get_check_connection_requests(access):
+    """
+        Запросы для проверки подключения к API: список
+        (название, метод, базовый адрес, путь, параметры запроса).
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    orders_params = {
+        'date_start': (now - datetime.timedelta(days=1)).isoformat(),
+        'date_end': now.isoformat()
+    }
+    return [
+        ('content', 'POST', CONTENT_BASE_API, '/card/list', {
+            'json': _get_product_list_request_data(
+                supplier_id=access['SUPPLIER_ID'], offset=0, limit=1),
+            'headers': _get_content_api_headers(access['CONTENT_API_AUTHORIZATION_TOKEN']),
+        }),
+        ('fbs_orders', 'GET', FBS_ORDERS_BASE_API, '/api/v1/orders', {
+            'params': orders_params,
+            'headers': {'X-Auth-Token': access['ORDERS_API_TOKEN']},
+        }),
+        ('fbs_orders_statuses', 'GET', FBS_ORDERS_STATUSES_BASE_API, '/api/public/v1/supply_tasks/status', {
+            'params': orders_params,
+            'headers': {'X-Auth-Token': access['ORDERS_API_TOKEN']},
+        }),
+        ('statistics', 'GET', STATISTICS_BASE_API, '/api/v1/supplier/reportDetailByPeriod', {
+            'params': {
+                'key': access['STATISTICS_API_KEY'],
+                'dateFrom': datetime.datetime.now().isoformat(),
+                'dateTo': datetime.datetime.now().isoformat()
+            },
+        }),
+    ]
+
+
+def _probe_endpoint(name, method, base_url, path, kwargs, deadline):
+    import requests
+
+    started_at = time.monotonic()
+    result = {
+        'name': name,
+        'url': base_url + path,
+        'status_code': None,
+        'latency': None,
+        'error': None,
+        'ok': False,
+    }
+    try:
+        # Тело ответа не загружается: для проверки достаточно статуса
+        response = transport.request(
+            method, base_url, path,
+            timeout=(min(transport.CONNECT_TIMEOUT, deadline), deadline),
+            max_retries=0, cache_ttl=0, stream=True, **kwargs)
+        response.close()
+    except requests.RequestException as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    else:
+        result['status_code'] = response.status_code
+        result['ok'] = response.status_code == HTTPStatus.OK
+        if not result['ok']:
+            result['error'] = 'HTTP {}'.format(response.status_code)
+    result['latency'] = time.monotonic() - started_at
+    return result
+
+
+def probe_connection(access, deadline=PROBE_DEADLINE):
+    """
+        Одновременная проверка всех эндпоинтов API с общим сроком deadline.
+        Запросы не повторяются и не берутся из кэша.
+            Аргументы:
+                access (dict): Словарь с данными для авторизации в API.
+                deadline (float): Сколько секунд ждать ответов.
+            Возвращает:
+                report (list): Для каждого эндпоинта словарь с name, url,
+                               status_code, latency (секунды), error и ok.
+    """
+    probes = _get_check_connection_requests(access)
+    executor = ThreadPoolExecutor(max_workers=len(probes))
+    try:
+        futures = [
+            executor.submit(_probe_endpoint, *request, deadline=deadline)
+            for request in probes
+        ]
+        done, _ = wait(futures, timeout=deadline)
+    finally:
+        # Не дожидаемся зависших запросов, их ограничивает таймаут чтения
+        executor.shutdown(wait=False)
+
+    report = []
+    for (name, method, base_url, path, _), future in zip(probes, futures):
+        if future in done:
+            report.append(future.result())
+        else:
+            report.append({
+                'name': name,
+                'url': base_url + path,
+                'status_code': None,
+                'latency': deadline,
+                'error': 'Нет ответа за {} с'.format(deadline),
+                'ok': False,
+            })
+    return report
+
+
+def check_connection(access, deadline=PROBE_DEADLINE):
     """
         Проверка работы
         /card/list/ API-эндпоинта suppliers-api.wildberries.ru и,
         /api/v1/supplier/orders API-эндпоинта suppliers-stats.wildberries.ru и,
         /api/v1/supplier/reportDetailByPeriod API-эндпоинта https://suppliers-orders.wildberries.ru и
         /api/public/v1/supply_tasks/status API-эндпоинта https://marketplace-remotewh.wildberries.ru.
+        Подробный отчет по каждому эндпоинту возвращает probe_connection().
     """
-    tz = timezone('UTC')
-    session = _get_session_for_content_api(
-        authorization_token=access['CONTENT_API_AUTHORIZATION_TOKEN']
-    )
-    content_api_response = session.post(
-        url=urljoin(CONTENT_BASE_API, '/card/list'),
-        json=_get_product_list_request_data(
-            supplier_id=access['SUPPLIER_ID'], offset=0, limit=1)
-    )
-    fbs_orders_api_response = requests.get(
-        url=urljoin(FBS_ORDERS_BASE_API, '/api/v1/orders'),
-        params={
-            'date_start': tz.localize(
-                datetime.datetime.now() - datetime.timedelta(days=1)
-            ).isoformat(),
-            'date_end': tz.localize(datetime.datetime.now()).isoformat()
-        },
-        headers={'X-Auth-Token': access['ORDERS_API_TOKEN']}
-    )
-    fbs_orders_statuses_api_response = requests.get(
-        url=urljoin(FBS_ORDERS_STATUSES_BASE_API, '/api/public/v1/supply_tasks/status'),
-        params={
-            'date_start': tz.localize(
-                datetime.datetime.now() - datetime.timedelta(days=1)
-            ).isoformat(),
-            'date_end': tz.localize(datetime.datetime.now()).isoformat()
-        },
-        headers={'X-Auth-Token': access['ORDERS_API_TOKEN']}
-    )
-    sales_api_response = requests.get(
-        url=urljoin(STATISTICS_BASE_API, '/api/v1/supplier/reportDetailByPeriod'),
-        params={
-            'key': access['STATISTICS_API_KEY'],
-            'dateFrom': datetime.datetime.now().isoformat(),
-            'dateTo': datetime.datetime.now().isoformat()
-        }
-    )
+    return all(result['ok'] for result in probe_connection(access, deadline=deadline))
+
+
+def _fetch_product_page(access, offset, limit, order=None):
+    """
+        Получение одной страницы карточек товаров Content API.
+        При ошибке выбрасывает ProductPageError.
+    """
+    import requests
+
+    request_data = _get_product_list_request_data(
+        supplier_id=access['SUPPLIER_ID'], offset=offset, limit=limit, order=order)
+    try:
+        response = transport.post(
+            CONTENT_BASE_API, '/card/list',
+            json=request_data,
+            headers=_get_content_api_headers(access['CONTENT_API_AUTHORIZATION_TOKEN']),
+            # id JSON-RPC запроса случайный и в ключ кэша не входит
+            cache_params=request_data['params']
+        )
+    except requests.RequestException as e:
+        raise ProductPageError(offset, limit, e) from e
 
-    return (content_api_response.status_code == requests.codes.ok
-            and fbs_orders_api_response.status_code == requests.codes.ok
-            and fbs_orders_statuses_api_response.status_code == requests.codes.ok
-            and sales_api_response.status_code == requests.codes.ok)
+    if response.status_code != HTTPStatus.OK:
+        raise ProductPageError(
+            offset, limit, 'HTTP {}'.format(response.status_code))
 
+    return _get_product_page_result(offset, limit, response.json())
 
-def product_list(access, page_size=50):
+
+def _get_product_page_result(offset, limit, response_data):
+    """
+        Результат из ответа /card/list. Если результата нет,
+        выбрасывает ProductPageError с ошибкой из ответа.
+    """
+    if 'result' not in response_data:
+        raise ProductPageError(
+            offset, limit, response_data.get('error', 'нет поля result'))
+
+    return response_data['result']
+
+
+def _updated_product_list(access, updated_since, page_size, offset=0):
+    """
+        Получение карточек товаров, измененных после updated_since.
+        Content API не умеет фильтровать по дате, поэтому карточки
+        запрашиваются отсортированными по updatedAt по убыванию,
+        и выгрузка останавливается на первой карточке не новее updated_since.
+    """
+    import dateutil.parser
+
+    order = {'column': 'updatedAt', 'order': 'desc'}
+    while True:
+        cards = _fetch_product_page(access, offset, page_size, order=order)['cards']
+        for card in cards:
+            if dateutil.parser.isoparse(card['updatedAt']) <= updated_since:
+                return
+            yield card
+        if len(cards) < page_size:
+            return
+        offset += page_size
+
+
+def product_list(access, page_size=50, max_workers=None, updated_since=None, offset=0):
     """
         Получение генератора с "сырыми" данными товаров в формате JSON.
         Каждый вызов функции next() возвращает 1 объект.
+        Карточки возвращаются в порядке offset.
             Аргументы:
                 access (dict): Словарь с данными для авторизации в API.
                 page_size (int): Максимальное количество карточек товаров,
                                  которые надо вывести.
+                max_workers (int): Количество потоков для параллельной
+                                   загрузки страниц. По умолчанию страницы
+                                   загружаются последовательно.
+                updated_since (datetime): Вернуть только карточки, измененные
+                                          после этой даты (с часовым поясом).
+                                          Страницы при этом загружаются
+                                          последовательно, от новых к старым.
+                offset (int): Сколько первых карточек пропустить,
+                              например, уже сохраненных до перезапуска.
             Возвращает:
                 product (json): Генератор.
+            Исключения:
+                ProductPageError: Не удалось получить страницу карточек.
+    """
+    if updated_since is not None:
+        yield from _updated_product_list(access, updated_since, page_size, offset=offset)
+        return
+
+    result = _fetch_product_page(access, offset=0, limit=1)
+    total_products = result['cursor']['total']
+    offsets = range(offset, total_products, page_size)
+
+    if not max_workers or max_workers < 2:
+        for offset in offsets:
+            result = _fetch_product_page(access, offset, page_size)
+            yield from result['cards']
+        return
+
+    # Одновременно загружается не больше 2 * max_workers страниц,
+    # чтобы медленный потребитель не накапливал в памяти весь каталог.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        offsets = iter(offsets)
+        try:
+            for offset in offsets:
+                pending.append(executor.submit(
+                    _fetch_product_page, access, offset, page_size))
+                if len(pending) < 2 * max_workers:
+                    continue
+                yield from pending.popleft().result()['cards']
+            while pending:
+                yield from pending.popleft().result()['cards']
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+_JSON_WHITESPACE = re.compile(r'[ \t\r\n]*')
+_JSON_SEPARATORS = re.compile(r'[ \t\r\n,]*')
+
+
+class _JSONArrayParser(object):
+    """
+        Потоковый разбор JSON-массива: feed() принимает очередной блок
+        тела ответа и возвращает элементы массива, которые пришли целиком.
+        Ответ null (так API статистики отвечает при отсутствии данных)
+        считается пустым массивом.
     """
-    session = _get_session_for_content_api(
-        authorization_token=access['CONTENT_API_AUTHORIZATION_TOKEN']
-    )
-
-    response = session.post(
-        url=urljoin(CONTENT_BASE_API, '/card/list'),
-        json=_get_product_list_request_data(supplier_id=access['SUPPLIER_ID'], offset=0, limit=1)
-    )
-
-    if response.status_code != requests.codes.ok:
-        yield from ()
-
-    response_data = response.json()
-
-    if not 'result' in response_data:
-        yield from ()
-
-    total_products = response_data['result']['cursor']['total']
 
-    for page in range(0, math.ceil(total_products / page_size)):
+    def __init__(self):
+        self.finished = False
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._position = 0
+        self._started = False
+        self._not_array = False
+
+    def feed(self, chunk):
+        buffer = self._buffer[self._position:] + self._text_decoder.decode(chunk)
+        self._buffer = buffer
+        position = 0
+        items = []
+
+        while not self._not_array and not self.finished:
+            # Пропускаем пробелы и разделители между элементами
+            position = _JSON_SEPARATORS.match(buffer, position).end()
+            if position >= len(buffer):
+                break
+
+            if not self._started:
+                if buffer[position] != '[':
+                    # Тело ответа не является массивом, оно проверяется в close()
+                    self._not_array = True
+                    break
+                self._started = True
+                position += 1
+                continue
+
+            if buffer[position] == ']':
+                self.finished = True
+                break
+
+            try:
+                item, end = self._decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Элемент пришел не полностью, нужен следующий блок
+                break
+            # Элемент принимается, только если за ним уже пришел
+            # разделитель, иначе число могло быть разрезано границей блока.
+            delimiter = _JSON_WHITESPACE.match(buffer, end).end()
+            if delimiter >= len(buffer) or buffer[delimiter] not in ',]':
+                break
+            position = end
+            items.append(item)
+
+        self._position = position
+        return items
+
+    def close(self):
+        """
+            Проверка после последнего блока: массив должен быть закрыт,
+            а тело, которое не является массивом, допускается только null.
+        """
+        if self.finished:
+            return
+        if not self._not_array:
+            raise ValueError('Неожиданный конец JSON-массива в ответе API')
+        rest = self._buffer[self._position:] + self._text_decoder.decode(b'', final=True)
+        if self._decoder.decode(rest) is not None:
+            raise ValueError('Ответ API не является JSON-массивом')
 
-        response_data = session.post(
-            url=urljoin(CONTENT_BASE_API, '/card/list'),
-            json=_get_product_list_request_data(
-                supplier_id=access['SUPPLIER_ID'],
-                offset=page * page_size, limit=page_size)
-        ).json()
 
-        if not 'result' in response_data:
+def _iter_json_array(response, chunk_size=64 * 1024):
+    """
+        Потоковый разбор JSON-массива из тела ответа.
+        Элементы массива возвращаются по одному по мере чтения,
+        поэтому тело ответа целиком в памяти не хранится.
+    """
+    parser = _JSONArrayParser()
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        yield from parser.feed(chunk)
+        if parser.finished:
             return
-
-        products = response_data['result']['cards']
-        for product in products:
-            yield product
+    parser.close()
 
 
-def statistics_sales_list(access, from_datetime):
+def statistics_sales_list(access, from_datetime, columns=None):
     """
         Получение генератора с "сырыми" данными продаж в формате JSON.
         Каждый вызов функции next() возвращает 1 объект.
         Выгружает продажи с переданной даты по сегодняшний день.
+        Ответ разбирается потоково, строка за строкой.
             Параметры:
                 access (dict): Словарь с данными для авторизации в API.
                 from_datetime (datetime): Конкретная дата с которой выгружать продажи.
+                columns (list): Оставить в строках только эти колонки.
+                                По умолчанию строки возвращаются целиком.
             Возвращает:
                 order (json): Генератор.
     """
-    response = requests.get(
-        url=urljoin(STATISTICS_BASE_API, '/api/v1/supplier/reportDetailByPeriod'),
+    response = transport.get(
+        STATISTICS_BASE_API, '/api/v1/supplier/reportDetailByPeriod',
         params={
             'key': access['STATISTICS_API_KEY'],
             'dateFrom': from_datetime.isoformat(),
             'dateTo': datetime.datetime.now().isoformat()
-        }
+        },
+        # Ключ кэша не зависит от текущего момента в dateTo:
+        # в течение срока годности записи повторная выгрузка
+        # с той же даты берется из кэша
+        cache_params={'dateFrom': from_datetime.isoformat()},
+        stream=True
     )
 
-    if response.status_code != requests.codes.ok:
-        return []
+    with response:
+        if response.status_code != HTTPStatus.OK:
+            return
 
-    return response.json()
+        for sale in _iter_json_array(response):
+            if columns is None:
+                yield sale
+            else:
+                yield {column: sale.get(column) for column in columns}
 
 
-def fbs_orders_statuses_list(access, from_datetime, to_datetime):
-    response = requests.get(
-        url=urljoin(FBS_ORDERS_STATUSES_BASE_API, '/api/public/v1/supply_tasks/status'),
-        params={
-            'date_start': from_datetime.isoformat(),
-            'date_end': to_datetime.isoformat()
-        },
-        headers={'X-Auth-Token': access['ORDERS_API_TOKEN']}
-    )
+def statistics_sales_columns(access, from_datetime, columns=SALES_COLUMNS):
+    """
+        Выгрузка продаж в колоночный буфер: словарь
+        {колонка: список значений}. Занимает заметно меньше памяти,
+        чем список словарей, и напрямую передается в pandas.DataFrame.
+            Параметры:
+                access (dict): Словарь с данными для авторизации в API.
+                from_datetime (datetime): Конкретная дата с которой выгружать продажи.
+                columns (list): Колонки, которые нужно сохранить.
+            Возвращает:
+                sales (dict): Колоночный буфер.
+    """
+    sales = {column: [] for column in columns}
+    appends = [(column, sales[column].append) for column in columns]
+    for sale in statistics_sales_list(access, from_datetime):
+        for column, append in appends:
+            append(sale.get(column))
+    return sales
 
-    if response.status_code != requests.codes.ok:
-        return []
 
+def _get_datetime_parser():
+    """
+        Возвращает функцию разбора даты: быстрый разбор ISO 8601
+        с откатом на универсальный dateutil.parser.parse.
+    """
+    import dateutil.parser
+
+    def parse(value):
+        try:
+            return dateutil.parser.isoparse(value)
+        except ValueError:
+            return dateutil.parser.parse(value)
+    return parse
+
+
+def resolve_order_statuses(orders, with_history=False):
+    """
+        Определение последнего статуса каждого сборочного задания.
+        Каждая дата разбирается один раз, последний статус выбирается
+        за один проход (при равных датах - первый из них).
+            Параметры:
+                orders (list): Ответ /api/public/v1/supply_tasks/status.
+                with_history (bool): Добавить историю статусов
+                                     в порядке возрастания даты в виде
+                                     списка пар (date, status).
+            Возвращает:
+                order_statuses (list): Список словарей с order_id и status.
+    """
+    parse = _get_datetime_parser()
     order_statuses = []
-    for order in response.json():
-        last_status = order['items'][0]
-        for order_status in order['items']:
-            if (dateutil.parser.parse(order_status['date'])
-                        > dateutil.parser.parse(last_status['date'])
-                    ):
-                last_status = order_status
-        order_statuses.append({
+    for order in orders:
+        dated_statuses = [
+            (parse(order_status['date']), order_status)
+            for order_status in order['items']
+        ]
+        _, last_status = max(dated_statuses, key=lambda dated: dated[0])
+        order_status = {
             'order_id': int(order['order_id']),
             'status': last_status['status'],
-        })
+        }
+        if with_history:
+            dated_statuses.sort(key=lambda dated: dated[0])
+            order_status['history'] = [
+                (status['date'], status['status']) for _, status in dated_statuses
+            ]
+        order_statuses.append(order_status)
     return order_statuses
 
 
-def fbs_order_list(access, from_datetime, to_datetime):
+def _window_cache_ttl(to_datetime):
     """
-        Получение генератора с "сырыми" данными заказов,
-        сопоставленных с продажими и статусами заказов в формате JSON.
-        Каждый вызов функции next() возвращает 1 объект.
+        Срок годности в кэше для ответа за период, заканчивающийся в to_datetime:
+        закрытые исторические периоды хранятся без срока годности,
+        остальные - со сроком кэша по умолчанию.
+    """
+    now = datetime.datetime.now(to_datetime.tzinfo)
+    if to_datetime + CLOSED_WINDOW_DELAY < now:
+        return cache.FOREVER
+    return None
+
+
+def fbs_orders_statuses_list(access, from_datetime, to_datetime, with_history=False):
+    """
+        Получение последних статусов сборочных заданий за период.
             Параметры:
                 access (dict): Словарь с данными для авторизации в API.
-                from_datetime (datetime): Конкретная дата с которой выгружать продажи.
-                to_datetime (datetime): Конкретная дата по которую выгружать заказы.
+                from_datetime (datetime): Конкретная дата с которой выгружать статусы.
+                to_datetime (datetime): Конкретная дата по которую выгружать статусы.
+                with_history (bool): Добавить историю статусов каждого задания.
             Возвращает:
-                order (json): Генератор.
+                order_statuses (list): Список словарей с order_id и status.
     """
-    response = requests.get(
-        url=urljoin(FBS_ORDERS_BASE_API, '/api/v1/orders'),
+    response = transport.get(
+        FBS_ORDERS_STATUSES_BASE_API, '/api/public/v1/supply_tasks/status',
         params={
             'date_start': from_datetime.isoformat(),
             'date_end': to_datetime.isoformat()
         },
-        headers={'X-Auth-Token': access['ORDERS_API_TOKEN']}
+        headers={'X-Auth-Token': access['ORDERS_API_TOKEN']},
+        cache_ttl=_window_cache_ttl(to_datetime)
     )
 
-    if response.status_code != requests.codes.ok:
+    if response.status_code != HTTPStatus.OK:
         return []
 
-    response_data = response.json()
+    return resolve_order_statuses(response.json(), with_history=with_history)
 
+
+def _fbs_order_items(access, from_datetime, to_datetime):
+    """
+        Получение позиций сборочных заказов за период
+        в виде плоского списка словарей.
+    """
+    response = transport.get(
+        FBS_ORDERS_BASE_API, '/api/v1/orders',
+        params={
+            'date_start': from_datetime.isoformat(),
+            'date_end': to_datetime.isoformat()
+        },
+        headers={'X-Auth-Token': access['ORDERS_API_TOKEN']},
+        cache_ttl=_window_cache_ttl(to_datetime)
+    )
+
+    if response.status_code != HTTPStatus.OK:
+        raise WildberriesAPIError(
+            'Не удалось получить заказы за период {} - {}: HTTP {}'.format(
+                from_datetime.isoformat(), to_datetime.isoformat(),
+                response.status_code)
+        )
+
+    return _flatten_order_items(response.json())
+
+
+def _flatten_order_items(orders):
+    """
+        Позиции сборочных заказов из ответа /api/v1/orders
+        в виде плоского списка словарей.
+    """
     order_items = []
-    for order in response_data:
+    for order in orders:
         for order_item in order['items']:
             order_items.append({
                 'date_created': order['date_created'],
@@ -237,95 +601,183 @@ def fbs_order_list(access, from_datetime, to_datetime):
                 'rid': int(order_item['rid']),
                 'total_price': order_item['total_price'],
             })
-    sales_df = pd.DataFrame.from_records(
-        data=statistics_sales_list(
-            access=access,
-            from_datetime=from_datetime
-        ),
-        index='rid',
-        exclude=[
-            'realizationreport_id',
-            'suppliercontract_code',
-            'rrd_id',
-            'gi_id',
-            'subject_name',
-            'brand_name',
-            'sa_name',
-            'barcode', # ?
-            'doc_type_name',
-            'supplier_oper_name',
-            'order_dt', 'sale_dt', 'rr_dt',
-            'shk_id',
-            'office_name',
-            'gi_box_type_name',
-        ]
-    )
-    orders_statuses_df = pd.DataFrame.from_records(
-        data=fbs_orders_statuses_list(
-            access=access,
-            from_datetime=from_datetime,
-            to_datetime=to_datetime,
-        ),
-    )
+    return order_items
 
-    pd.set_option('display.max_columns', None)
-
-    order_items_df = pd.DataFrame.from_records(order_items, index='rid') \
-        .merge(sales_df, on='rid', how='left') \
-        .merge(orders_statuses_df, on='order_id', how='left')
-    order_items_df['total_price'] = order_items_df['total_price'].apply(lambda x: x / 100)
-    order_items_df['status_x'] = order_items_df['status_x'].fillna(0)
-    order_items_df['status_y'] = order_items_df['status_y'].fillna(0)
-    order_items_df['status'] = order_items_df \
-        .apply(lambda x: '%s%s' % (int(x['status_x']), int(x['status_y'])), axis=1)
-    order_items_df = order_items_df.drop(columns=[
-        'status_x', 'status_y',
-    ])
-
-    order_item_financial_columns = [
-        'nds',
-        'cost_amount',
-        'retail_price',
-        'retail_amount',
-        'retail_commission',
-        'sale_percent',
-        'commission_percent',
-        'customer_reward',
-        'supplier_reward',
-        'retail_price_withdisc_rub',
-        'for_pay',
-        'for_pay_nds',
-        'delivery_amount',
-        'return_amount',
-        'delivery_rub',
-        'product_discount_for_report',
-        'supplier_promo',
-        'supplier_spp',
-    ]
-    order_item_group_columns = [
-        'chrt_id',
-        'wb_wh_id',
-        'total_price',
-        'nm_id',
-        'ts_name',
-        'quantity',
-    ]
-    order_group_columns = [
-        'order_id',
-        'date_created',
-        'status',
-    ]
-    for order, order_items in order_items_df.groupby(by=order_group_columns):
-        order_items = order_items.drop(columns=order_group_columns)
-
-        order_items = order_items \
-            .groupby(by=order_item_group_columns, dropna=False) \
-            .agg({c: 'sum' for c in order_item_financial_columns}) \
-            .reset_index()
-
-        yield simplejson.loads(simplejson.dumps({
-            'order_id': int(order[0]),
-            'date_created': order[1],
-            'status': order[2],
-            'items': order_items.to_dict(orient='records')
-        } , ignore_nan=True))
+
+def _date_windows(from_datetime, to_datetime, window):
+    """
+        Разбиение периода на последовательные окна длиной window.
+    """
+    if not window:
+        yield from_datetime, to_datetime
+        return
+
+    window_start = from_datetime
+    while window_start < to_datetime:
+        window_end = min(window_start + window, to_datetime)
+        yield window_start, window_end
+        window_start = window_end
+
+
+def fbs_order_windows(access, from_datetime, to_datetime,
+                      window=None, max_workers=None, join_backend='pandas'):
+    """
+        Получение генератора с заказами, сопоставленными с продажами
+        и статусами, по окнам периода. Окна возвращаются по порядку,
+        загружается одновременно до max_workers окон.
+        Заказ на границе окон может попасть в оба окна.
+        Продажи загружаются один раз за весь период и общие для всех окон.
+            Параметры:
+                access (dict): Словарь с данными для авторизации в API.
+                from_datetime (datetime): Начало периода.
+                to_datetime (datetime): Конец периода.
+                window (timedelta): Длина окна. По умолчанию период
+                                    загружается одним запросом.
+                max_workers (int): Сколько окон загружать одновременно.
+                join_backend (str): Вариант сопоставления заказов с продажами:
+                                    'pandas' или 'python' (без pandas).
+            Возвращает:
+                (window_start, window_end, orders): Генератор, orders -
+                                                    список заказов окна.
+            Исключения:
+                WildberriesAPIError: Не удалось получить заказы окна.
+    """
+    make_sales_index, join = JOIN_BACKENDS[join_backend]
+
+    # Продажи по заказу могут появиться в любой момент после его создания,
+    # поэтому отчет загружается один раз за весь период.
+    sales_index = make_sales_index(statistics_sales_columns(
+        access=access,
+        from_datetime=from_datetime
+    ))
+
+    def load_window(window_start, window_end):
+        return window_start, window_end, list(join(
+            _fbs_order_items(access, window_start, window_end),
+            sales_index,
+            fbs_orders_statuses_list(
+                access=access,
+                from_datetime=window_start,
+                to_datetime=window_end,
+            ),
+        ))
+
+    windows = _date_windows(from_datetime, to_datetime, window)
+    max_workers = max_workers or 1
+
+    # Одновременно загружается не больше 2 * max_workers окон.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        try:
+            for window_start, window_end in windows:
+                pending.append(executor.submit(load_window, window_start, window_end))
+                if len(pending) < 2 * max_workers:
+                    continue
+                yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def fbs_order_list(access, from_datetime, to_datetime,
+                   window=None, max_workers=None, ordered=True,
+                   join_backend='pandas'):
+    """
+        Получение генератора с "сырыми" данными заказов,
+        сопоставленных с продажими и статусами заказов в формате JSON.
+        Каждый вызов функции next() возвращает 1 объект.
+        Длинный период можно разбить на окна: заказы и статусы каждого окна
+        загружаются и сопоставляются отдельно. Отчет о продажах загружается
+        один раз за весь период, и его индекс в памяти растет вместе
+        с периодом, а не с окном.
+            Параметры:
+                access (dict): Словарь с данными для авторизации в API.
+                from_datetime (datetime): Конкретная дата с которой выгружать продажи.
+                to_datetime (datetime): Конкретная дата по которую выгружать заказы.
+                window (timedelta): Длина окна. По умолчанию период
+                                    загружается одним запросом.
+                max_workers (int): Сколько окон загружать одновременно.
+                ordered (bool): Возвращать заказы по возрастанию order_id,
+                                как при загрузке одним запросом. Заказы
+                                загруженных окон сохраняются во временные
+                                файлы и сливаются после загрузки всех окон.
+                                Если False, заказы окна возвращаются после
+                                загрузки следующего окна, чтобы убрать
+                                повторы заказов на границе окон.
+                join_backend (str): Вариант сопоставления заказов с продажами:
+                                    'pandas' или 'python' (без pandas).
+            Возвращает:
+                order (json): Генератор.
+            Исключения:
+                WildberriesAPIError: Не удалось получить заказы окна.
+    """
+    windows = fbs_order_windows(access, from_datetime, to_datetime, window=window,
+                                max_workers=max_workers, join_backend=join_backend)
+
+    if ordered and window:
+        # Меньший order_id может оказаться в любом следующем окне,
+        # поэтому окна сливаются только после загрузки всех,
+        # а до этого хранятся на диске
+        spills = [_spill_orders(orders) for _, _, orders in windows]
+        yield from _merge_spilled_windows(spills)
+        return
+
+    previous = []
+    for _, _, orders in windows:
+        yield from _skip_duplicate_orders(previous, orders)
+        previous = orders
+    yield from previous
+
+
+def _spill_orders(orders):
+    """
+        Сохраняет заказы окна во временный файл.
+        Возвращает файл, открытый на чтение с начала.
+    """
+    spill = tempfile.TemporaryFile()
+    for order in orders:
+        pickle.dump(order, spill, pickle.HIGHEST_PROTOCOL)
+    spill.seek(0)
+    return spill
+
+
+def _read_spilled_orders(spill):
+    """
+        Читает заказы из файла _spill_orders() по одному и закрывает файл.
+    """
+    with spill:
+        while True:
+            try:
+                yield pickle.load(spill)
+            except EOFError:
+                return
+
+
+def _skip_duplicate_orders(orders, next_orders):
+    """
+        Заказ на границе окон попадает в оба соседних окна.
+        Возвращает заказы окна без тех, что есть в следующем окне:
+        остаются записи из более позднего окна.
+    """
+    next_keys = {order_key(order) for order in next_orders}
+    return [order for order in orders if order_key(order) not in next_keys]
+
+
+def _merge_spilled_windows(spills):
+    """
+        Сливает заказы окон из файлов _spill_orders() по возрастанию
+        order_id. Из записей заказа, попавшего в несколько окон,
+        остаются записи из самого позднего окна.
+    """
+    orders = heapq.merge(
+        *(zip(itertools.repeat(index), _read_spilled_orders(spill))
+          for index, spill in enumerate(spills)),
+        key=lambda item: (order_key(item[1]), item[0]))
+    for _, records in itertools.groupby(orders, key=lambda item: order_key(item[1])):
+        records = list(records)
+        latest = records[-1][0]
+        for index, order in records:
+            if index == latest:
+                yield order
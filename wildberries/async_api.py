@@ -0,0 +1,405 @@
+"""
+    Асинхронные варианты функций wildberries.api на asyncio и aiohttp.
+
+    Все запросы идут через AsyncClient: один пул соединений на все хосты,
+    ограничение количества одновременных запросов, ограничение частоты
+    запросов к хосту и повторы ответов 429 и 5xx с теми же настройками,
+    что и в transport. Один клиент можно использовать для синхронизации
+    нескольких магазинов в одном цикле событий.
+
+    Функции возвращают те же данные, что и синхронные варианты.
+    Дисковый кэш ответов transport здесь не используется.
+
+    Пример:
+        async with AsyncClient(max_concurrency=16) as client:
+            async for card in product_list(client, access, concurrency=4):
+                ...
+"""
+import asyncio
+import contextlib
+import datetime
+import itertools
+import math
+import time
+from collections import deque
+from http import HTTPStatus
+from urllib.parse import urljoin
+
+from . import api, transport
+from .joins import JOIN_BACKENDS, SALES_COLUMNS
+
+
+CHUNK_SIZE = 64 * 1024
+
+# Сколько заказов окон сливается в пуле потоков за один раз
+MERGE_CHUNK_SIZE = 1000
+
+
+class AsyncTokenBucket(object):
+    """
+        Token bucket для одного цикла событий.
+        acquire() ждет, пока не появится свободный токен.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AsyncClient(object):
+    """
+        Асинхронный HTTP-клиент API Wildberries.
+            Аргументы:
+                max_concurrency (int): Сколько запросов выполняется одновременно.
+                pool_size (int): Максимальное количество открытых соединений.
+    """
+
+    def __init__(self, max_concurrency=16, pool_size=transport.POOL_SIZE):
+        self.max_concurrency = max_concurrency
+        self.pool_size = pool_size
+        self._session = None
+        self._semaphore = None
+        self._buckets = {}
+
+    async def __aenter__(self):
+        import aiohttp
+
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=transport.CONNECT_TIMEOUT,
+                sock_read=transport.READ_TIMEOUT),
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_bucket(self, base_url):
+        host = transport._host(base_url)
+        if host not in self._buckets:
+            rate_limit = transport.RATE_LIMITS.get(host, transport.DEFAULT_RATE_LIMIT)
+            self._buckets[host] = AsyncTokenBucket(*rate_limit) if rate_limit else None
+        return self._buckets[host]
+
+    async def _send(self, method, base_url, path, **kwargs):
+        import aiohttp
+
+        bucket = self._get_bucket(base_url)
+        url = urljoin(base_url, path)
+
+        attempt = 0
+        while True:
+            if bucket is not None:
+                await bucket.acquire()
+
+            try:
+                response = await self._session.request(method, url, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= transport.MAX_RETRIES:
+                    raise
+                await asyncio.sleep(transport._get_retry_delay(None, attempt))
+                attempt += 1
+                continue
+
+            if (response.status not in transport.RETRY_STATUS_CODES
+                    or attempt >= transport.MAX_RETRIES):
+                return response
+
+            response.release()
+            await asyncio.sleep(transport._get_retry_delay(response, attempt))
+            attempt += 1
+
+    @contextlib.asynccontextmanager
+    async def request(self, method, base_url, path, **kwargs):
+        """
+            Выполняет HTTP-запрос с повторами, как transport.request.
+            Соединение возвращается в пул при выходе из блока async with.
+            До выхода из блока запрос занимает место в max_concurrency:
+            тело ответа читается внутри блока, и паузы между повторами
+            тоже входят в это время.
+                Аргументы:
+                    **kwargs: Параметры aiohttp.ClientSession.request
+                              (params, json, headers).
+        """
+        async with self._semaphore:
+            response = await self._send(method, base_url, path, **kwargs)
+            try:
+                yield response
+            finally:
+                response.release()
+
+
+async def check_connection(client, access):
+    """
+        Асинхронный вариант api.check_connection:
+        все эндпоинты проверяются одновременно.
+    """
+    async def check(name, method, base_url, path, kwargs):
+        async with client.request(method, base_url, path, **kwargs) as response:
+            return response.status == HTTPStatus.OK
+
+    results = await asyncio.gather(*(
+        check(*request) for request in api._get_check_connection_requests(access)
+    ))
+    return all(results)
+
+
+async def _fetch_product_page(client, access, offset, limit, order=None):
+    import aiohttp
+
+    request_data = api._get_product_list_request_data(
+        supplier_id=access['SUPPLIER_ID'], offset=offset, limit=limit, order=order)
+    try:
+        async with client.request(
+                'POST', api.CONTENT_BASE_API, '/card/list',
+                json=request_data,
+                headers=api._get_content_api_headers(
+                    access['CONTENT_API_AUTHORIZATION_TOKEN'])) as response:
+            if response.status != HTTPStatus.OK:
+                raise api.ProductPageError(
+                    offset, limit, 'HTTP {}'.format(response.status))
+            response_data = await response.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise api.ProductPageError(offset, limit, e) from e
+
+    return api._get_product_page_result(offset, limit, response_data)
+
+
+async def _updated_product_list(client, access, updated_since, page_size):
+    import dateutil.parser
+
+    order = {'column': 'updatedAt', 'order': 'desc'}
+    offset = 0
+    while True:
+        cards = (await _fetch_product_page(
+            client, access, offset, page_size, order=order))['cards']
+        for card in cards:
+            if dateutil.parser.isoparse(card['updatedAt']) <= updated_since:
+                return
+            yield card
+        if len(cards) < page_size:
+            return
+        offset += page_size
+
+
+async def product_list(client, access, page_size=50, concurrency=None, updated_since=None):
+    """
+        Асинхронный вариант api.product_list.
+        Карточки возвращаются в порядке offset.
+            Аргументы:
+                client (AsyncClient): Клиент API.
+                access (dict): Словарь с данными для авторизации в API.
+                page_size (int): Количество карточек на странице.
+                concurrency (int): Сколько страниц загружать одновременно.
+                updated_since (datetime): Вернуть только карточки, измененные
+                                          после этой даты (с часовым поясом).
+            Возвращает:
+                product (json): Асинхронный генератор.
+            Исключения:
+                ProductPageError: Не удалось получить страницу карточек.
+    """
+    if updated_since is not None:
+        async for card in _updated_product_list(client, access, updated_since, page_size):
+            yield card
+        return
+
+    result = await _fetch_product_page(client, access, offset=0, limit=1)
+    total_products = result['cursor']['total']
+    offsets = range(0, math.ceil(total_products / page_size) * page_size, page_size)
+    concurrency = concurrency or 1
+
+    # Одновременно загружается не больше concurrency страниц:
+    # следующая страница запрашивается, когда отдана самая старая
+    pending = deque()
+    try:
+        for offset in offsets:
+            pending.append(asyncio.ensure_future(
+                _fetch_product_page(client, access, offset, page_size)))
+            if len(pending) < concurrency:
+                continue
+            for card in (await pending.popleft())['cards']:
+                yield card
+        while pending:
+            for card in (await pending.popleft())['cards']:
+                yield card
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def statistics_sales_list(client, access, from_datetime, columns=None):
+    """
+        Асинхронный вариант api.statistics_sales_list.
+        Ответ разбирается потоково, строка за строкой.
+    """
+    async with client.request(
+            'GET', api.STATISTICS_BASE_API, '/api/v1/supplier/reportDetailByPeriod',
+            params={
+                'key': access['STATISTICS_API_KEY'],
+                'dateFrom': from_datetime.isoformat(),
+                'dateTo': datetime.datetime.now().isoformat()
+            }) as response:
+        if response.status != HTTPStatus.OK:
+            return
+
+        parser = api._JSONArrayParser()
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            for sale in parser.feed(chunk):
+                if columns is None:
+                    yield sale
+                else:
+                    yield {column: sale.get(column) for column in columns}
+            if parser.finished:
+                return
+        parser.close()
+
+
+async def statistics_sales_columns(client, access, from_datetime, columns=SALES_COLUMNS):
+    """
+        Асинхронный вариант api.statistics_sales_columns.
+    """
+    sales = {column: [] for column in columns}
+    appends = [(column, sales[column].append) for column in columns]
+    async for sale in statistics_sales_list(client, access, from_datetime):
+        for column, append in appends:
+            append(sale.get(column))
+    return sales
+
+
+async def fbs_orders_statuses_list(client, access, from_datetime, to_datetime,
+                                   with_history=False):
+    """
+        Асинхронный вариант api.fbs_orders_statuses_list.
+    """
+    async with client.request(
+            'GET', api.FBS_ORDERS_STATUSES_BASE_API, '/api/public/v1/supply_tasks/status',
+            params={
+                'date_start': from_datetime.isoformat(),
+                'date_end': to_datetime.isoformat()
+            },
+            headers={'X-Auth-Token': access['ORDERS_API_TOKEN']}) as response:
+        if response.status != HTTPStatus.OK:
+            return []
+        orders = await response.json(content_type=None)
+
+    return api.resolve_order_statuses(orders, with_history=with_history)
+
+
+async def _fbs_order_items(client, access, from_datetime, to_datetime):
+    async with client.request(
+            'GET', api.FBS_ORDERS_BASE_API, '/api/v1/orders',
+            params={
+                'date_start': from_datetime.isoformat(),
+                'date_end': to_datetime.isoformat()
+            },
+            headers={'X-Auth-Token': access['ORDERS_API_TOKEN']}) as response:
+        if response.status != HTTPStatus.OK:
+            raise api.WildberriesAPIError(
+                'Не удалось получить заказы за период {} - {}: HTTP {}'.format(
+                    from_datetime.isoformat(), to_datetime.isoformat(),
+                    response.status)
+            )
+        orders = await response.json(content_type=None)
+
+    return api._flatten_order_items(orders)
+
+
+async def fbs_order_list(client, access, from_datetime, to_datetime,
+                         window=None, concurrency=None, ordered=True,
+                         join_backend='pandas'):
+    """
+        Асинхронный вариант api.fbs_order_list.
+        Заказы и статусы окна загружаются одновременно, сопоставление
+        с продажами выполняется в пуле потоков, чтобы не блокировать
+        цикл событий.
+            Параметры:
+                client (AsyncClient): Клиент API.
+                window (timedelta): Длина окна. По умолчанию период
+                                    загружается одним запросом.
+                concurrency (int): Сколько окон загружать одновременно.
+                Остальные параметры - как у api.fbs_order_list.
+            Возвращает:
+                order (json): Асинхронный генератор.
+            Исключения:
+                WildberriesAPIError: Не удалось получить заказы окна.
+    """
+    make_sales_index, join = JOIN_BACKENDS[join_backend]
+    loop = asyncio.get_running_loop()
+
+    sales = await statistics_sales_columns(client, access, from_datetime)
+    sales_index = await loop.run_in_executor(None, make_sales_index, sales)
+
+    async def load_window(window_start, window_end):
+        order_items, orders_statuses = await asyncio.gather(
+            _fbs_order_items(client, access, window_start, window_end),
+            fbs_orders_statuses_list(client, access, window_start, window_end),
+        )
+        return await loop.run_in_executor(
+            None, lambda: list(join(order_items, sales_index, orders_statuses)))
+
+    windows = api._date_windows(from_datetime, to_datetime, window)
+    concurrency = concurrency or 1
+
+    async def load_windows():
+        # Одновременно загружается не больше concurrency окон
+        pending = deque()
+        try:
+            for window_start, window_end in windows:
+                pending.append(asyncio.ensure_future(load_window(window_start, window_end)))
+                if len(pending) < concurrency:
+                    continue
+                yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    if ordered and window:
+        # Как в api.fbs_order_list: до слияния окна хранятся на диске
+        spills = [
+            await loop.run_in_executor(None, api._spill_orders, orders)
+            async for orders in load_windows()
+        ]
+        # Слияние читает файлы и распаковывает заказы, поэтому идет
+        # в пуле потоков частями, не блокируя цикл событий
+        orders = api._merge_spilled_windows(spills)
+        while True:
+            chunk = await loop.run_in_executor(
+                None, lambda: list(itertools.islice(orders, MERGE_CHUNK_SIZE)))
+            if not chunk:
+                return
+            for order in chunk:
+                yield order
+
+    previous = []
+    async for orders in load_windows():
+        for order in api._skip_duplicate_orders(previous, orders):
+            yield order
+        previous = orders
+    for order in previous:
+        yield order
@@ -0,0 +1,330 @@
+"""
+    Первичная загрузка истории заказов через PostgreSQL COPY.
+
+    Заказы из fbs_order_list потоком копируются во временные таблицы
+    (COPY ... FROM STDIN), затем переносятся в wildberries_order и
+    wildberries_orderitem несколькими запросами INSERT ... SELECT
+    ... ON CONFLICT. Сжатые "сырые" данные копируются в архив
+    wildberries_rawpayload вместе с версиями записанных строк.
+    Позиции привязываются к карточкам товаров по wildberries_character_id,
+    недостающие карточки создаются заглушками, как при обычной загрузке
+    (utils.make_fbs_orders).
+
+    Повторный запуск на тех же данных ничего не меняет: заказы и позиции
+    перезаписываются, только если изменилась их контрольная сумма.
+"""
+import csv
+import io
+import itertools
+import tempfile
+import time
+
+import dateutil.parser
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Order, get_payload_checksum, pack_payload
+
+
+# Сколько строк CSV собирать в один блок для COPY
+COPY_CHUNK_ROWS = 1000
+
+# Как часто сообщать о ходе копирования, в заказах
+PROGRESS_EVERY = 10000
+
+CREATE_STAGING_SQL = '''
+    CREATE TEMPORARY TABLE staging_order (
+        seq bigint NOT NULL,
+        number varchar(64) NOT NULL,
+        created_at timestamptz,
+        status varchar(32) NOT NULL,
+        raw_data_checksum varchar(32) NOT NULL
+    ) ON COMMIT DROP;
+    CREATE TEMPORARY TABLE staging_orderitem (
+        seq bigint NOT NULL,
+        number varchar(64) NOT NULL,
+        created_at timestamptz,
+        chrt_id integer NOT NULL,
+        nm_id integer NOT NULL,
+        quantity integer NOT NULL,
+        price numeric(10, 2) NOT NULL,
+        commission numeric(10, 2),
+        delivery_cost numeric(10, 2),
+        raw_product_data_checksum varchar(32) NOT NULL
+    ) ON COMMIT DROP;
+    CREATE TEMPORARY TABLE staging_payload (
+        checksum varchar(32) NOT NULL,
+        data bytea NOT NULL,
+        size integer NOT NULL
+    ) ON COMMIT DROP;
+'''
+
+# Сжатые "сырые" данные, которых еще нет в архиве
+ARCHIVE_PAYLOADS_SQL = '''
+    INSERT INTO wildberries_rawpayload (checksum, data, size, created_at)
+    SELECT checksum, data, size, %(now)s
+    FROM staging_payload
+    ON CONFLICT (checksum) DO NOTHING
+'''
+
+# Заказ встречается в fbs_order_list по разу на каждый статус позиций:
+# в raw_data сохраняется последняя запись, позиции собираются из всех.
+# Для каждой записанной строки в архив добавляется версия "сырых" данных.
+MERGE_ORDERS_SQL = '''
+    WITH merged AS (
+        INSERT INTO wildberries_order (
+            identifier, created_at, updated_at, in_process_at, number,
+            posting_type, posting_number, status,
+            fixed_expenses_of_store, other_expenses_of_store,
+            store_id, raw_data_checksum
+        )
+        SELECT DISTINCT ON (number)
+            '', created_at, %(now)s, created_at, number,
+            %(posting_type)s, '', status,
+            0, 0,
+            %(store_id)s, raw_data_checksum
+        FROM staging_order
+        ORDER BY number, seq DESC
+        ON CONFLICT (store_id, number) DO UPDATE SET
+            updated_at = EXCLUDED.updated_at,
+            status = EXCLUDED.status,
+            raw_data_checksum = EXCLUDED.raw_data_checksum
+        WHERE wildberries_order.raw_data_checksum <> EXCLUDED.raw_data_checksum
+        RETURNING id, raw_data_checksum
+    ), versions AS (
+        INSERT INTO wildberries_rawpayloadversion (model, object_id, field, checksum, recorded_at)
+        SELECT 'order', id, 'raw_data', raw_data_checksum, %(now)s FROM merged
+    )
+    SELECT count(*) FROM merged
+'''
+
+CREATE_PRODUCT_CARDS_SQL = '''
+    WITH created AS (
+        INSERT INTO wildberries_productcard (
+            identifier, created_at, updated_at, sku, name, price, description, status,
+            ozon_fbs_sku, ozon_fbo_sku, ozon_product_id, ozon_category_id,
+            wildberries_fbs_sku, wildberries_product_id, wildberries_category_id,
+            wildberries_character_id, store_id, raw_data_checksum
+        )
+        SELECT DISTINCT ON (item.chrt_id)
+            '', item.created_at, %(now)s, '#####', '#####', item.price, '', '',
+            '', '', 0, 0,
+            item.nm_id, '', 0,
+            item.chrt_id, %(store_id)s, item.raw_product_data_checksum
+        FROM staging_orderitem AS item
+        ORDER BY item.chrt_id, item.seq
+        ON CONFLICT (store_id, wildberries_character_id) DO NOTHING
+        RETURNING id, raw_data_checksum
+    ), versions AS (
+        INSERT INTO wildberries_rawpayloadversion (model, object_id, field, checksum, recorded_at)
+        SELECT 'productcard', id, 'raw_data', raw_data_checksum, %(now)s FROM created
+    )
+    SELECT count(*) FROM created
+'''
+
+# Позиция также перезаписывается, чтобы привязать ее к карточке,
+# версия данных при этом добавляется, только если данные изменились
+MERGE_ORDER_ITEMS_SQL = '''
+    WITH merged AS (
+        INSERT INTO wildberries_orderitem (
+            updated_at, quantity, price, commission, delivery_cost,
+            product_card_id, order_id,
+            ozon_fbs_sku, ozon_fbo_sku, wildberries_fbs_sku, wildberries_character_id,
+            raw_product_data_checksum, raw_financial_data_checksum
+        )
+        SELECT DISTINCT ON (o.id, item.chrt_id)
+            %(now)s, item.quantity, item.price, item.commission, item.delivery_cost,
+            card.id, o.id,
+            '', '', 0, item.chrt_id,
+            item.raw_product_data_checksum, ''
+        FROM staging_orderitem AS item
+        JOIN wildberries_order AS o
+          ON o.store_id = %(store_id)s AND o.number = item.number
+        LEFT JOIN wildberries_productcard AS card
+          ON card.store_id = %(store_id)s AND card.wildberries_character_id = item.chrt_id
+        ORDER BY o.id, item.chrt_id, item.seq DESC
+        ON CONFLICT (order_id, wildberries_character_id) DO UPDATE SET
+            updated_at = EXCLUDED.updated_at,
+            quantity = EXCLUDED.quantity,
+            raw_product_data_checksum = EXCLUDED.raw_product_data_checksum,
+            product_card_id = COALESCE(wildberries_orderitem.product_card_id,
+                                       EXCLUDED.product_card_id)
+        WHERE wildberries_orderitem.raw_product_data_checksum
+                  <> EXCLUDED.raw_product_data_checksum
+           OR wildberries_orderitem.product_card_id IS NULL
+        RETURNING id, raw_product_data_checksum
+    ), versions AS (
+        INSERT INTO wildberries_rawpayloadversion (model, object_id, field, checksum, recorded_at)
+        SELECT 'orderitem', merged.id, 'raw_product_data', merged.raw_product_data_checksum,
+               %(now)s
+        FROM merged
+        WHERE NOT EXISTS (
+            SELECT 1 FROM wildberries_rawpayloadversion AS version
+            WHERE version.model = 'orderitem'
+              AND version.object_id = merged.id
+              AND version.field = 'raw_product_data'
+              AND version.checksum = merged.raw_product_data_checksum
+        )
+    )
+    SELECT count(*) FROM merged
+'''
+
+
+class _ChunkReader(object):
+    """
+        Файлоподобный объект для copy_expert: read() отдает
+        текст из итератора блоков по мере чтения.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buffer = ''
+
+    def read(self, size=-1):
+        parts = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                break
+            parts.append(chunk)
+            length += len(chunk)
+        data = ''.join(parts)
+        if size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def _iter_csv_chunks(rows):
+    """
+        Строки CSV для COPY ... WITH (FORMAT csv) блоками
+        по COPY_CHUNK_ROWS строк. None записывается как NULL.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count >= COPY_CHUNK_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    if count:
+        yield buffer.getvalue()
+
+
+def _iter_staging_rows(orders, items_file, payloads_file, progress=None):
+    """
+        Строки staging_order для COPY. Строки staging_orderitem
+        и сжатые "сырые" данные для staging_payload тем временем
+        пишутся в items_file и payloads_file в формате CSV,
+        чтобы не держать их в памяти.
+    """
+    items_writer = csv.writer(items_file)
+    payloads_writer = csv.writer(payloads_file)
+    staged_checksums = set()
+
+    def stage_payload(raw_data):
+        checksum = get_payload_checksum(raw_data)
+        if checksum not in staged_checksums:
+            staged_checksums.add(checksum)
+            _, data, size = pack_payload(raw_data)
+            payloads_writer.writerow([checksum, '\\x' + data.hex(), size])
+        return checksum
+
+    started_at = time.monotonic()
+    seq = 0
+    # Порядковые номера записей и позиций: при повторе ключа
+    # побеждает последняя, как при загрузке пачками
+    item_seq = itertools.count(1)
+    for seq, _order in enumerate(orders, 1):
+        number = str(_order['order_id'])
+        created_at = dateutil.parser.parse(_order['date_created'])
+        for _product_data in _order['items']:
+            items_writer.writerow([
+                next(item_seq), number, created_at.isoformat(), _product_data['chrt_id'],
+                # После сопоставления через pandas целые числа бывают float
+                int(_product_data['nm_id'] or 0),
+                int(_product_data['quantity'] or 1),
+                _product_data['total_price'],
+                _product_data['retail_commission'],
+                _product_data['delivery_rub'],
+                stage_payload(_product_data),
+            ])
+        yield [
+            seq, number, created_at.isoformat(),
+            Order.parse_status(_order['status'], 'wildberries'),
+            stage_payload(_order),
+        ]
+        if progress and seq % PROGRESS_EVERY == 0:
+            progress('copy', seq, time.monotonic() - started_at)
+    if progress:
+        progress('copy', seq, time.monotonic() - started_at)
+
+
+def backfill_orders(store, orders, progress=None):
+    """
+        Загружает заказы из fbs_order_list в базу через временные
+        таблицы и COPY в одной транзакции. "Сырые" данные заказов
+        и позиций записываются в архив RawPayload.
+            Аргументы:
+                store (Store): Магазин.
+                orders (iterable): Заказы из fbs_order_list.
+                progress (callable): Вызывается с (этап, количество строк,
+                                     секунд с начала этапа).
+            Возвращает:
+                dict: Количество скопированных записей заказов (staged) и
+                      позиций (staged_items), добавленных в архив данных
+                      (payloads), созданных карточек-заглушек
+                      (product_cards), записанных заказов (orders) и
+                      позиций (order_items).
+    """
+    result = {}
+    params = {
+        'now': timezone.now(),
+        'store_id': store.id,
+        'posting_type': Order.WILDBERRIES_FBS,
+    }
+    with transaction.atomic(), connection.cursor() as cursor, \
+            tempfile.TemporaryFile('w+', newline='') as items_file, \
+            tempfile.TemporaryFile('w+', newline='') as payloads_file:
+        cursor.execute(CREATE_STAGING_SQL)
+
+        cursor.copy_expert(
+            'COPY staging_order FROM STDIN WITH (FORMAT csv)',
+            _ChunkReader(_iter_csv_chunks(
+                _iter_staging_rows(orders, items_file, payloads_file, progress))))
+        cursor.execute('SELECT count(*) FROM staging_order')
+        result['staged'] = cursor.fetchone()[0]
+
+        items_file.seek(0)
+        cursor.copy_expert('COPY staging_orderitem FROM STDIN WITH (FORMAT csv)', items_file)
+        cursor.execute('SELECT count(*) FROM staging_orderitem')
+        result['staged_items'] = cursor.fetchone()[0]
+        payloads_file.seek(0)
+        cursor.copy_expert('COPY staging_payload FROM STDIN WITH (FORMAT csv)', payloads_file)
+        cursor.execute('ANALYZE staging_order; ANALYZE staging_orderitem')
+
+        started_at = time.monotonic()
+        cursor.execute(ARCHIVE_PAYLOADS_SQL, params)
+        result['payloads'] = cursor.rowcount
+        if progress:
+            progress('payloads', cursor.rowcount, time.monotonic() - started_at)
+
+        for step, sql in (('orders', MERGE_ORDERS_SQL),
+                          ('product_cards', CREATE_PRODUCT_CARDS_SQL),
+                          ('order_items', MERGE_ORDER_ITEMS_SQL)):
+            started_at = time.monotonic()
+            cursor.execute(sql, params)
+            result[step] = cursor.fetchone()[0]
+            if progress:
+                progress(step, result[step], time.monotonic() - started_at)
+
+        # ON COMMIT DROP не срабатывает, если загрузка идет внутри
+        # внешней транзакции
+        cursor.execute('DROP TABLE staging_order, staging_orderitem, staging_payload')
+    return result
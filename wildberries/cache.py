@@ -0,0 +1,195 @@
+"""
+    Дисковый кэш ответов API Wildberries.
+
+    Каждая запись - два файла в каталоге кэша: <key>.body с телом ответа
+    и <key>.json с кодом ответа, заголовками и сроком годности.
+    Ключ строится из метода, адреса эндпоинта, параметров запроса и
+    учетных данных аккаунта. Размер кэша ограничен, при превышении
+    удаляются записи, которые дольше всех не читались (LRU по mtime).
+
+    В режиме replay_only запросы в сеть не отправляются: все ответы
+    берутся из кэша независимо от срока годности, а отсутствие записи
+    приводит к CacheMissError.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+# Запись без срока годности, например ответ за закрытый исторический период
+FOREVER = float('inf')
+
+DEFAULT_TTL = 60 * 60
+DEFAULT_MAX_SIZE = 1024 ** 3
+
+# Заголовки, которые сохраняются вместе с ответом.
+# Тело хранится уже распакованным, поэтому Content-Encoding не сохраняется.
+STORED_HEADERS = ('Content-Type',)
+
+
+class CacheMissError(Exception):
+    """
+        Ответа нет в кэше, а запросы в сеть запрещены (replay_only).
+    """
+
+
+def make_key(method, url, params=None, json_data=None, account=None):
+    """
+        Ключ записи кэша: sha256 от метода, адреса,
+        параметров, тела запроса и учетных данных.
+    """
+    data = json.dumps(
+        [method.upper(), url, params, json_data, account],
+        sort_keys=True, default=str, ensure_ascii=False
+    )
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class ResponseCache(object):
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE,
+                 default_ttl=DEFAULT_TTL, replay_only=False):
+        self.directory = directory
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.replay_only = replay_only
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, _, size in self._entries())
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, key + suffix)
+
+    def _entries(self):
+        """
+            Записи кэша: (ключ, время последнего чтения, размер).
+        """
+        for name in os.listdir(self.directory):
+            if not name.endswith('.body'):
+                continue
+            key = name[:-len('.body')]
+            try:
+                stat = os.stat(self._path(key, '.body'))
+                meta_size = os.path.getsize(self._path(key, '.json'))
+            except OSError:
+                continue
+            yield key, stat.st_mtime, stat.st_size + meta_size
+
+    def get(self, key):
+        """
+            Возвращает (метаданные, путь к телу ответа) или None.
+            Просроченные записи не возвращаются, кроме режима replay_only.
+        """
+        try:
+            with open(self._path(key, '.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        expires_at = meta['expires_at']
+        if not self.replay_only and expires_at is not None and expires_at < time.time():
+            return None
+
+        body_path = self._path(key, '.body')
+        try:
+            # Время последнего чтения для вытеснения LRU
+            os.utime(body_path)
+        except OSError:
+            return None
+        return meta, body_path
+
+    def put(self, key, status_code, headers, chunks, ttl=None):
+        """
+            Сохраняет ответ. chunks - итератор блоков тела ответа,
+            тело пишется на диск по мере чтения.
+            Возвращает (метаданные, путь к телу ответа), как get().
+        """
+        ttl = self.default_ttl if ttl is None else ttl
+        meta = {
+            'status_code': status_code,
+            'headers': {
+                name: headers[name] for name in STORED_HEADERS if name in headers
+            },
+            'expires_at': None if ttl == FOREVER else time.time() + ttl,
+        }
+
+        body_path = self._path(key, '.body')
+        meta_path = self._path(key, '.json')
+        size = 0
+        # Тело и метаданные пишутся во временные файлы и переименовываются,
+        # чтобы параллельные читатели не увидели запись наполовину
+        body_fd, tmp_body_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        meta_fd, tmp_meta_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(body_fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+            with os.fdopen(meta_fd, 'w') as f:
+                json.dump(meta, f)
+                size += f.tell()
+            os.replace(tmp_body_path, body_path)
+            os.replace(tmp_meta_path, meta_path)
+        except BaseException:
+            for path in (tmp_body_path, tmp_meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+        with self._lock:
+            self._size += size
+            if self._size > self.max_size:
+                self._evict(keep=key)
+        return meta, body_path
+
+    def _evict(self, keep=None):
+        """
+            Удаляет записи, которые дольше всех не читались,
+            пока размер кэша не станет меньше max_size.
+            Запись keep, только что сохраненная, не удаляется.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self._size = sum(size for _, _, size in entries)
+        for key, _, size in entries:
+            if self._size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            for suffix in ('.json', '.body'):
+                try:
+                    os.remove(self._path(key, suffix))
+                except OSError:
+                    pass
+            self._size -= size
+
+    def clear(self):
+        with self._lock:
+            for key, _, _ in list(self._entries()):
+                for suffix in ('.json', '.body'):
+                    try:
+                        os.remove(self._path(key, suffix))
+                    except OSError:
+                        pass
+            self._size = 0
+
+
+def from_env(environ=os.environ):
+    """
+        Создает кэш по переменным окружения или возвращает None:
+            WB_API_CACHE_DIR - каталог кэша, без него кэш выключен;
+            WB_API_CACHE_MAX_SIZE - максимальный размер в байтах;
+            WB_API_CACHE_TTL - срок годности записей в секундах;
+            WB_API_CACHE_REPLAY - 1, чтобы отвечать только из кэша.
+    """
+    directory = environ.get('WB_API_CACHE_DIR')
+    if not directory:
+        return None
+    return ResponseCache(
+        directory=directory,
+        max_size=int(environ.get('WB_API_CACHE_MAX_SIZE', DEFAULT_MAX_SIZE)),
+        default_ttl=float(environ.get('WB_API_CACHE_TTL', DEFAULT_TTL)),
+        replay_only=environ.get('WB_API_CACHE_REPLAY') == '1',
+    )
@@ -0,0 +1,141 @@
+"""
+    Массовое удаление заказов и карточек товаров.
+
+    Записи удаляются пачками по id, каждая пачка - несколькими запросами
+    DELETE/UPDATE ... WHERE id = ANY(...) в своей транзакции, поэтому
+    блокировки держатся недолго, а прерванное удаление можно просто
+    запустить снова. Каскады Django (CASCADE и SET_NULL) выполняются
+    теми же запросами, записи в память не загружаются. Версии "сырых"
+    данных в архиве не удаляются.
+"""
+import time
+
+from django.db import connection, transaction
+
+from .models import OrderItem, ProductCard, ProductCardImage
+
+
+# Сколько заказов или карточек удалять в одной транзакции
+DELETE_BATCH_SIZE = 5000
+
+# Запросы удаления пачки заказов, %(ids)s - id заказов
+DELETE_ORDERS_SQL = [
+    ('order_items', 'DELETE FROM wildberries_orderitem WHERE order_id = ANY(%(ids)s)'),
+    ('orders', 'DELETE FROM wildberries_order WHERE id = ANY(%(ids)s)'),
+]
+
+# Запросы удаления пачки карточек товаров, %(ids)s - id карточек
+DELETE_PRODUCT_CARDS_SQL = [
+    # OrderItem.product_card: SET_NULL
+    ('order_items', '''
+        UPDATE wildberries_orderitem SET product_card_id = NULL
+        WHERE product_card_id = ANY(%(ids)s)
+    '''),
+    # ProductCard.image других карточек: SET_NULL
+    ('main_images', '''
+        UPDATE wildberries_productcard AS card SET image_id = NULL
+        FROM wildberries_productcardimage AS image
+        WHERE card.image_id = image.id
+          AND image.product_card_id = ANY(%(ids)s)
+          AND NOT card.id = ANY(%(ids)s)
+    '''),
+    # ProductCardImage.product_card: CASCADE
+    ('images', 'DELETE FROM wildberries_productcardimage WHERE product_card_id = ANY(%(ids)s)'),
+    ('product_cards', 'DELETE FROM wildberries_productcard WHERE id = ANY(%(ids)s)'),
+]
+
+
+def filter_by_store_and_date(queryset, store=None, date_from=None, date_to=None):
+    """
+        Заказы или карточки товаров магазина, созданные
+        в полуинтервале [date_from, date_to). Не заданные
+        условия не проверяются.
+    """
+    if store is not None:
+        queryset = queryset.filter(store=store)
+    if date_from is not None:
+        queryset = queryset.filter(created_at__gte=date_from)
+    if date_to is not None:
+        queryset = queryset.filter(created_at__lt=date_to)
+    return queryset
+
+
+def count_orders(queryset):
+    """
+        Сколько записей удалит delete_orders.
+    """
+    return {
+        'orders': queryset.count(),
+        'order_items': OrderItem.objects.filter(order__in=queryset.values('id')).count(),
+    }
+
+
+def count_product_cards(queryset):
+    """
+        Сколько записей удалит или изменит delete_product_cards.
+    """
+    ids = queryset.values('id')
+    return {
+        'product_cards': queryset.count(),
+        'images': ProductCardImage.objects.filter(product_card__in=ids).count(),
+        'order_items': OrderItem.objects.filter(product_card__in=ids).count(),
+        'main_images': ProductCard.objects
+                       .filter(image__product_card__in=ids)
+                       .exclude(id__in=ids)
+                       .count(),
+    }
+
+
+def _delete_in_batches(queryset, statements, batch_size, progress):
+    result = dict.fromkeys([name for name, _ in statements], 0)
+    queryset = queryset.order_by('id').values_list('id', flat=True)
+    started_at = time.monotonic()
+    deleted = 0
+    last_id = 0
+    while True:
+        ids = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not ids:
+            return result
+        with transaction.atomic(), connection.cursor() as cursor:
+            for name, sql in statements:
+                cursor.execute(sql, {'ids': ids})
+                result[name] += cursor.rowcount
+        last_id = ids[-1]
+        deleted += len(ids)
+        if progress:
+            progress(deleted, time.monotonic() - started_at)
+
+
+def delete_orders(queryset, batch_size=DELETE_BATCH_SIZE, progress=None):
+    """
+        Удаляет заказы вместе с их позициями пачками.
+            Аргументы:
+                queryset (QuerySet): Удаляемые заказы.
+                batch_size (int): Сколько заказов удалять в одной транзакции.
+                progress (callable): Вызывается после каждой пачки
+                                     с (удалено заказов, секунд с начала).
+            Возвращает:
+                dict: Количество удаленных заказов (orders)
+                      и позиций (order_items).
+    """
+    return _delete_in_batches(queryset, DELETE_ORDERS_SQL, batch_size, progress)
+
+
+def delete_product_cards(queryset, batch_size=DELETE_BATCH_SIZE, progress=None):
+    """
+        Удаляет карточки товаров вместе с их изображениями пачками.
+        Позиции заказов отвязываются от удаленных карточек, у других
+        карточек сбрасывается основное изображение, если оно было
+        изображением удаленной карточки.
+            Аргументы:
+                queryset (QuerySet): Удаляемые карточки товаров.
+                batch_size (int): Сколько карточек удалять в одной транзакции.
+                progress (callable): Вызывается после каждой пачки
+                                     с (удалено карточек, секунд с начала).
+            Возвращает:
+                dict: Количество удаленных карточек (product_cards)
+                      и изображений (images), отвязанных позиций заказов
+                      (order_items) и карточек без основного изображения
+                      (main_images).
+    """
+    return _delete_in_batches(queryset, DELETE_PRODUCT_CARDS_SQL, batch_size, progress)
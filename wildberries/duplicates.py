@@ -0,0 +1,135 @@
+"""
+    Объединение дубликатов карточек товаров.
+
+    До ограничения уникальности (store, wildberries_character_id) у магазина
+    могли появиться несколько карточек с одним chrt_id. Дубликаты находятся
+    оконной функцией за один проход по таблице, остается карточка с
+    наименьшим id. Позиции заказов и изображения дубликатов переносятся
+    на оставленные карточки несколькими запросами UPDATE ... FROM,
+    после чего дубликаты удаляются одним DELETE ... USING.
+"""
+import time
+
+from django.db import connection, transaction
+
+
+FIND_PRODUCT_CARD_DUPLICATES_SQL = '''
+    CREATE TEMPORARY TABLE product_card_duplicate ON COMMIT DROP AS
+    SELECT id AS duplicate_id, kept_id
+    FROM (
+        SELECT id, first_value(id) OVER (
+            PARTITION BY store_id, wildberries_character_id ORDER BY id
+        ) AS kept_id
+        FROM wildberries_productcard
+        WHERE store_id IS NOT NULL
+    ) AS ranked
+    WHERE id <> kept_id
+'''
+
+RELINK_ORDER_ITEMS_SQL = '''
+    UPDATE wildberries_orderitem AS item
+    SET product_card_id = duplicate.kept_id
+    FROM product_card_duplicate AS duplicate
+    WHERE item.product_card_id = duplicate.duplicate_id
+'''
+
+# Оставленная карточка без основного изображения получает
+# изображение самого раннего дубликата
+ADOPT_MAIN_IMAGES_SQL = '''
+    UPDATE wildberries_productcard AS kept
+    SET image_id = adopted.image_id
+    FROM (
+        SELECT DISTINCT ON (duplicate.kept_id) duplicate.kept_id, card.image_id
+        FROM product_card_duplicate AS duplicate
+        JOIN wildberries_productcard AS card ON card.id = duplicate.duplicate_id
+        WHERE card.image_id IS NOT NULL
+        ORDER BY duplicate.kept_id, duplicate.duplicate_id
+    ) AS adopted
+    WHERE kept.id = adopted.kept_id AND kept.image_id IS NULL
+'''
+
+RELINK_IMAGES_SQL = '''
+    UPDATE wildberries_productcardimage AS image
+    SET product_card_id = duplicate.kept_id
+    FROM product_card_duplicate AS duplicate
+    WHERE image.product_card_id = duplicate.duplicate_id
+'''
+
+# После переноса у оставленной карточки могут оказаться
+# изображения с одинаковым адресом
+FIND_IMAGE_DUPLICATES_SQL = '''
+    CREATE TEMPORARY TABLE product_card_image_duplicate ON COMMIT DROP AS
+    SELECT id AS duplicate_id, kept_id
+    FROM (
+        SELECT id, first_value(id) OVER (
+            PARTITION BY product_card_id, remote_file_url ORDER BY id
+        ) AS kept_id
+        FROM wildberries_productcardimage
+        WHERE product_card_id IN (SELECT kept_id FROM product_card_duplicate)
+    ) AS ranked
+    WHERE id <> kept_id
+'''
+
+RELINK_MAIN_IMAGES_SQL = '''
+    UPDATE wildberries_productcard AS card
+    SET image_id = duplicate.kept_id
+    FROM product_card_image_duplicate AS duplicate
+    WHERE card.image_id = duplicate.duplicate_id
+'''
+
+DELETE_IMAGE_DUPLICATES_SQL = '''
+    DELETE FROM wildberries_productcardimage AS image
+    USING product_card_image_duplicate AS duplicate
+    WHERE image.id = duplicate.duplicate_id
+'''
+
+DELETE_PRODUCT_CARD_DUPLICATES_SQL = '''
+    DELETE FROM wildberries_productcard AS card
+    USING product_card_duplicate AS duplicate
+    WHERE card.id = duplicate.duplicate_id
+'''
+
+# Шаги объединения: имя шага для отчета и запрос
+MERGE_STEPS = [
+    ('order_items', RELINK_ORDER_ITEMS_SQL),
+    ('main_images', ADOPT_MAIN_IMAGES_SQL),
+    ('images', RELINK_IMAGES_SQL),
+    (None, FIND_IMAGE_DUPLICATES_SQL),
+    ('main_images', RELINK_MAIN_IMAGES_SQL),
+    ('duplicate_images', DELETE_IMAGE_DUPLICATES_SQL),
+    ('product_cards', DELETE_PRODUCT_CARD_DUPLICATES_SQL),
+]
+
+
+def merge_duplicate_product_cards(progress=None):
+    """
+        Объединяет карточки товаров магазинов с одинаковым
+        wildberries_character_id в одной транзакции.
+            Аргументы:
+                progress (callable): Вызывается с (этап, количество строк,
+                                     секунд с начала этапа).
+            Возвращает:
+                dict: Количество перенесенных позиций заказов (order_items)
+                      и изображений (images), карточек с новым основным
+                      изображением (main_images), удаленных одинаковых
+                      изображений (duplicate_images) и удаленных
+                      дубликатов карточек (product_cards).
+    """
+    result = dict.fromkeys(
+        ['order_items', 'images', 'main_images', 'duplicate_images', 'product_cards'], 0)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(FIND_PRODUCT_CARD_DUPLICATES_SQL)
+        if cursor.rowcount:
+            for step, sql in MERGE_STEPS:
+                started_at = time.monotonic()
+                cursor.execute(sql)
+                if step is None:
+                    continue
+                result[step] += cursor.rowcount
+                if progress:
+                    progress(step, cursor.rowcount, time.monotonic() - started_at)
+        # ON COMMIT DROP не срабатывает, если объединение идет внутри
+        # внешней транзакции
+        cursor.execute('DROP TABLE IF EXISTS product_card_duplicate, '
+                       'product_card_image_duplicate')
+    return result
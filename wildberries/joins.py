@@ -0,0 +1,251 @@
+"""
+    Сопоставление позиций сборочных заказов с продажами и статусами.
+
+    Есть два взаимозаменяемых варианта, которые возвращают одинаковые заказы:
+    pandas - агрегация через DataFrame,
+    python - потоковый hash join на чистом Python без импорта pandas.
+
+    Каждый вариант состоит из двух функций: построение индекса продаж
+    по колоночному буферу из api.statistics_sales_columns (один раз на
+    весь период) и сопоставление позиций заказов окна с этим индексом.
+"""
+import itertools
+from array import array
+from collections import defaultdict
+
+# Финансовые показатели позиции заказа из отчета reportDetailByPeriod,
+# которые суммируются по позиции.
+ORDER_ITEM_FINANCIAL_COLUMNS = [
+    'nds',
+    'cost_amount',
+    'retail_price',
+    'retail_amount',
+    'retail_commission',
+    'sale_percent',
+    'commission_percent',
+    'customer_reward',
+    'supplier_reward',
+    'retail_price_withdisc_rub',
+    'for_pay',
+    'for_pay_nds',
+    'delivery_amount',
+    'return_amount',
+    'delivery_rub',
+    'product_discount_for_report',
+    'supplier_promo',
+    'supplier_spp',
+]
+ORDER_ITEM_GROUP_COLUMNS = [
+    'chrt_id',
+    'wb_wh_id',
+    'total_price',
+    'nm_id',
+    'ts_name',
+    'quantity',
+]
+ORDER_GROUP_COLUMNS = [
+    'order_id',
+    'date_created',
+    'status',
+]
+# Колонки отчета reportDetailByPeriod, нужные для сопоставления с заказами.
+SALES_COLUMNS = ['rid', 'nm_id', 'ts_name', 'quantity'] + ORDER_ITEM_FINANCIAL_COLUMNS
+ORDER_ITEM_COLUMNS = ORDER_ITEM_GROUP_COLUMNS + ORDER_ITEM_FINANCIAL_COLUMNS
+
+
+def order_sort_key(order):
+    return order['order_id'], order['date_created'], order['status']
+
+
+def order_key(order):
+    """
+        Ключ заказа без статуса: у записей одного заказа
+        с позициями в разных статусах он общий.
+    """
+    return order['order_id'], order['date_created']
+
+
+def pandas_sales_index(sales):
+    """
+        DataFrame продаж с индексом по rid.
+    """
+    import pandas as pd
+
+    return pd.DataFrame(data=sales, columns=SALES_COLUMNS).set_index('rid')
+
+
+def pandas_join(order_items, sales_df, orders_statuses):
+    """
+        Сопоставление позиций заказов с продажами и статусами через pandas.
+        Возвращает генератор заказов, отсортированных по
+        (order_id, date_created, status).
+        Все позиции агрегируются одним groupby, NaN заменяются
+        на None по колонкам.
+    """
+    import pandas as pd
+
+    if not order_items:
+        return
+
+    orders_statuses_df = pd.DataFrame.from_records(
+        data=orders_statuses,
+        columns=['order_id', 'status'],
+    )
+
+    order_items_df = pd.DataFrame.from_records(order_items, index='rid') \
+        .merge(sales_df, on='rid', how='left') \
+        .merge(orders_statuses_df, on='order_id', how='left')
+    order_items_df['total_price'] = order_items_df['total_price'] / 100
+    order_items_df['status'] = (
+        order_items_df['status_x'].fillna(0).astype('int64').astype(str)
+        + order_items_df['status_y'].fillna(0).astype('int64').astype(str)
+    )
+
+    order_items_df = order_items_df \
+        .groupby(by=ORDER_GROUP_COLUMNS + ORDER_ITEM_GROUP_COLUMNS, dropna=False) \
+        [ORDER_ITEM_FINANCIAL_COLUMNS] \
+        .sum() \
+        .reset_index()
+    order_items_df = order_items_df \
+        .astype(object) \
+        .where(order_items_df.notna(), None)
+
+    records = order_items_df.to_dict(orient='records')
+    for order, order_items in itertools.groupby(records, key=order_sort_key):
+        yield {
+            'order_id': int(order[0]),
+            'date_created': order[1],
+            'status': order[2],
+            'items': [
+                {column: order_item[column] for column in ORDER_ITEM_COLUMNS}
+                for order_item in order_items
+            ]
+        }
+
+
+def python_sales_index(sales):
+    """
+        Hash-индекс продаж: rid -> номера строк колоночного буфера.
+        Значения остаются в колонках буфера и не копируются.
+        Вместе с индексом запоминается, в каких колонках есть
+        дробные значения, чтобы типы совпадали с вариантом pandas.
+    """
+    index = defaultdict(list)
+    for row, rid in enumerate(sales['rid']):
+        index[rid].append(row)
+
+    float_columns = {
+        column for column in SALES_COLUMNS[1:]
+        if any(value is None or isinstance(value, float) for value in sales[column])
+    }
+    return dict(index), sales, float_columns
+
+
+def _none_last(value):
+    return value is None, value
+
+
+def python_join(order_items, sales_index, orders_statuses):
+    """
+        Сопоставление позиций заказов с продажами и статусами
+        на чистом Python. Позиции заказов проходят через hash-индексы
+        продаж (по rid) и статусов (по order_id), финансовые показатели
+        суммируются по ключу позиции так же, как это делает pandas
+        (суммирование Кэхэна в порядке строк).
+        Возвращает те же заказы и в том же порядке, что и pandas_join.
+    """
+    if not order_items:
+        return
+
+    rows_by_rid, sales, float_columns = sales_index
+    nm_ids = sales['nm_id']
+    ts_names = sales['ts_name']
+    quantities = sales['quantity']
+    financial_columns = [sales[column] for column in ORDER_ITEM_FINANCIAL_COLUMNS]
+    financial_count = len(financial_columns)
+
+    statuses_by_order_id = defaultdict(list)
+    for order_status in orders_statuses:
+        statuses_by_order_id[order_status['order_id']].append(order_status['status'] or 0)
+
+    # Колонки, которые pandas превратит в float после left join:
+    # продажи найдены не для всех позиций - появляются NaN.
+    float_columns = set(float_columns)
+    if any(order_item['rid'] not in rows_by_rid for order_item in order_items):
+        float_columns.update(SALES_COLUMNS[1:])
+
+    def as_key(column, value):
+        if value is not None and column in float_columns:
+            return float(value)
+        return value
+
+    # Для каждой позиции хранится массив из сумм и поправок Кэхэна
+    groups = {}
+    missing_sale = [None]
+    missing_status = [0]
+    for order_item in order_items:
+        total_price = order_item['total_price'] / 100
+        item_status = int(order_item['status'] or 0)
+        rows = rows_by_rid.get(order_item['rid'], missing_sale)
+        statuses = statuses_by_order_id.get(order_item['order_id'], missing_status)
+        for row in rows:
+            if row is None:
+                nm_id = ts_name = quantity = None
+                values = ()
+            else:
+                nm_id = as_key('nm_id', nm_ids[row])
+                ts_name = ts_names[row]
+                quantity = as_key('quantity', quantities[row])
+                values = [column[row] for column in financial_columns]
+            for order_status in statuses:
+                key = (
+                    order_item['order_id'],
+                    order_item['date_created'],
+                    '%s%s' % (item_status, int(order_status)),
+                    order_item['chrt_id'],
+                    order_item['wb_wh_id'],
+                    total_price,
+                    nm_id,
+                    ts_name,
+                    quantity,
+                )
+                sums = groups.get(key)
+                if sums is None:
+                    sums = groups[key] = array('d', bytes(16 * financial_count))
+                for i, value in enumerate(values):
+                    if value is None:
+                        continue
+                    y = value - sums[financial_count + i]
+                    t = sums[i] + y
+                    sums[financial_count + i] = t - sums[i] - y
+                    sums[i] = t
+
+    int_columns = [
+        i for i, column in enumerate(ORDER_ITEM_FINANCIAL_COLUMNS)
+        if column not in float_columns
+    ]
+    order_items = sorted(
+        groups.items(),
+        key=lambda group: tuple(_none_last(value) for value in group[0])
+    )
+    for order, order_items in itertools.groupby(order_items, key=lambda group: group[0][:3]):
+        items = []
+        for key, sums in order_items:
+            sums = sums.tolist()[:financial_count]
+            for i in int_columns:
+                sums[i] = int(sums[i])
+            item = dict(zip(ORDER_ITEM_GROUP_COLUMNS, key[3:]))
+            item.update(zip(ORDER_ITEM_FINANCIAL_COLUMNS, sums))
+            items.append(item)
+        yield {
+            'order_id': order[0],
+            'date_created': order[1],
+            'status': order[2],
+            'items': items,
+        }
+
+
+JOIN_BACKENDS = {
+    'pandas': (pandas_sales_index, pandas_join),
+    'python': (python_sales_index, python_join),
+}
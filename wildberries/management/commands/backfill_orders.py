@@ -0,0 +1,74 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+
+from pytz import timezone
+
+from wildberries import api
+from wildberries import backfill
+from wildberries.models import Store
+
+
+tz = timezone('UTC')
+
+STEP_NAMES = {
+    'copy': 'скопировано заказов',
+    'payloads': 'добавлено в архив данных',
+    'orders': 'записано заказов',
+    'product_cards': 'создано карточек',
+    'order_items': 'записано позиций',
+}
+
+
+def parse_date(value):
+    return tz.localize(datetime.datetime.strptime(value, '%Y-%m-%d'))
+
+
+class Command(BaseCommand):
+    help = 'Первичная загрузка истории заказов через COPY во временные таблицы'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--store', type=int, required=True,
+            help='ID магазина')
+        parser.add_argument(
+            '--date-from', type=parse_date, default=parse_date('2021-04-01'),
+            help='Начало периода, ГГГГ-ММ-ДД')
+        parser.add_argument(
+            '--date-to', type=parse_date, default=parse_date('2021-05-01'),
+            help='Конец периода, ГГГГ-ММ-ДД')
+        parser.add_argument(
+            '--window-days', type=int, default=7,
+            help='Загружать период окнами по указанному количеству дней')
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Сколько окон загружать одновременно')
+        parser.add_argument(
+            '--join-backend', choices=['pandas', 'python'], default='pandas',
+            help='Вариант сопоставления заказов с продажами и статусами')
+
+    def progress(self, step, rows_count, elapsed):
+        self.stdout.write('{}: {} за {:.1f} с, {:.0f} строк/с'.format(
+            STEP_NAMES[step], rows_count, elapsed, rows_count / elapsed if elapsed else 0))
+
+    def handle(self, *args, **options):
+        store = Store.objects.get(pk=options['store'])
+        window = None
+        if options['window_days']:
+            window = datetime.timedelta(days=options['window_days'])
+        orders = api.fbs_order_list(store.wildberries_access,
+                                    options['date_from'], options['date_to'],
+                                    window=window,
+                                    max_workers=options['workers'],
+                                    join_backend=options['join_backend'])
+
+        started_at = time.monotonic()
+        result = backfill.backfill_orders(store, orders, progress=self.progress)
+        elapsed = time.monotonic() - started_at
+        self.stdout.write(
+            'Готово: {staged_items} позиций из {staged} записей заказов за {elapsed:.1f} с, '
+            '{rate:.0f} позиций/с'.format(
+                elapsed=elapsed,
+                rate=result['staged_items'] / elapsed if elapsed else 0,
+                **result))
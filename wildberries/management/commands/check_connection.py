@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wildberries import api
+from wildberries.models import Store
+
+
+class Command(BaseCommand):
+    help = 'Проверка доступности API Wildberries. ' \
+           'Завершается с ошибкой, если хотя бы один эндпоинт недоступен.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--store', type=int, required=True,
+            help='ID магазина')
+        parser.add_argument(
+            '--deadline', type=float, default=api.PROBE_DEADLINE,
+            help='Сколько секунд ждать ответов всех эндпоинтов')
+        parser.add_argument(
+            '--json', action='store_true',
+            help='Вывести отчет в формате JSON')
+
+    def handle(self, *args, **options):
+        store = Store.objects.get(pk=options['store'])
+        report = api.probe_connection(store.wildberries_access, deadline=options['deadline'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, ensure_ascii=False))
+        else:
+            for result in report:
+                self.stdout.write('{:<20} {:<4} {:>4} {:>8.0f} мс {}'.format(
+                    result['name'],
+                    'OK' if result['ok'] else 'FAIL',
+                    result['status_code'] or '-',
+                    result['latency'] * 1000,
+                    result['error'] or '',
+                ))
+
+        failed = [result['name'] for result in report if not result['ok']]
+        if failed:
+            raise CommandError('Недоступны эндпоинты: {}'.format(', '.join(failed)))
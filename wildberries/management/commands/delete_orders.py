@@ -1,11 +1,56 @@
+import datetime
+
 from django.core.management.base import BaseCommand
 
+from pytz import timezone
+
+from wildberries import deletion
+from wildberries.models import Order, Store
+
+
+tz = timezone('UTC')
+
 
-from wildberries.models import Order
+def parse_date(value):
+    return tz.localize(datetime.datetime.strptime(value, '%Y-%m-%d'))
 
 
 class Command(BaseCommand):
+    help = 'Удаление заказов с позициями пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--store', type=int, default=None,
+            help='ID магазина. По умолчанию удаляются заказы всех магазинов')
+        parser.add_argument(
+            '--date-from', type=parse_date, default=None,
+            help='Удалить заказы, созданные начиная с этой даты, ГГГГ-ММ-ДД')
+        parser.add_argument(
+            '--date-to', type=parse_date, default=None,
+            help='Удалить заказы, созданные до этой даты (не включая ее), ГГГГ-ММ-ДД')
+        parser.add_argument(
+            '--batch-size', type=int, default=deletion.DELETE_BATCH_SIZE,
+            help='Сколько заказов удалять в одной транзакции')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать заказы и позиции, которые будут удалены')
+
+    def progress(self, rows_count, elapsed):
+        self.stdout.write('удалено заказов: {} за {:.1f} с, {:.0f} заказов/с'.format(
+            rows_count, elapsed, rows_count / elapsed if elapsed else 0))
 
     def handle(self, *args, **options):
-        for product in Order.objects.all():
-            product.delete()
\ No newline at end of file
+        store = None
+        if options['store'] is not None:
+            store = Store.objects.get(pk=options['store'])
+        orders = deletion.filter_by_store_and_date(
+            Order.objects.all(), store, options['date_from'], options['date_to'])
+
+        if options['dry_run']:
+            self.stdout.write('Будет удалено заказов: {orders}, позиций: {order_items}'.format_map(
+                deletion.count_orders(orders)))
+            return
+
+        result = deletion.delete_orders(orders, batch_size=options['batch_size'],
+                                        progress=self.progress)
+        self.stdout.write('Удалено заказов: {orders}, позиций: {order_items}'.format_map(result))
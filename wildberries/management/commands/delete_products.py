@@ -1,11 +1,62 @@
+import datetime
+
 from django.core.management.base import BaseCommand
 
+from pytz import timezone
+
+from wildberries import deletion
+from wildberries.models import ProductCard, Store
+
+
+tz = timezone('UTC')
+
 
-from wildberries.models import ProductCard
+def parse_date(value):
+    return tz.localize(datetime.datetime.strptime(value, '%Y-%m-%d'))
 
 
 class Command(BaseCommand):
+    help = 'Удаление карточек товаров с изображениями пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--store', type=int, default=None,
+            help='ID магазина. По умолчанию удаляются карточки всех магазинов')
+        parser.add_argument(
+            '--date-from', type=parse_date, default=None,
+            help='Удалить карточки, созданные начиная с этой даты, ГГГГ-ММ-ДД')
+        parser.add_argument(
+            '--date-to', type=parse_date, default=None,
+            help='Удалить карточки, созданные до этой даты (не включая ее), ГГГГ-ММ-ДД')
+        parser.add_argument(
+            '--batch-size', type=int, default=deletion.DELETE_BATCH_SIZE,
+            help='Сколько карточек удалять в одной транзакции')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать записи, которые будут удалены или изменены')
+
+    def progress(self, rows_count, elapsed):
+        self.stdout.write('удалено карточек: {} за {:.1f} с, {:.0f} карточек/с'.format(
+            rows_count, elapsed, rows_count / elapsed if elapsed else 0))
 
     def handle(self, *args, **options):
-        for product in ProductCard.objects.all():
-            product.delete()
\ No newline at end of file
+        store = None
+        if options['store'] is not None:
+            store = Store.objects.get(pk=options['store'])
+        product_cards = deletion.filter_by_store_and_date(
+            ProductCard.objects.all(), store, options['date_from'], options['date_to'])
+
+        if options['dry_run']:
+            self.stdout.write(
+                'Будет удалено карточек: {product_cards}, изображений: {images}; '
+                'будут отвязаны позиции заказов: {order_items}, '
+                'основные изображения других карточек: {main_images}'.format_map(
+                    deletion.count_product_cards(product_cards)))
+            return
+
+        result = deletion.delete_product_cards(product_cards, batch_size=options['batch_size'],
+                                               progress=self.progress)
+        self.stdout.write(
+            'Удалено карточек: {product_cards}, изображений: {images}; '
+            'отвязано позиций заказов: {order_items}, '
+            'основных изображений других карточек: {main_images}'.format_map(result))
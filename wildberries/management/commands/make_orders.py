@@ -1,33 +1,122 @@
+import collections
 import datetime
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
 from pytz import timezone
 
-from wildberries.consts import (
-    CONTENT_API_AUTHORIZATION_TOKEN, SUPPLIER_ID,
-    STATISTICS_API_KEY, ORDERS_API_TOKEN
-)
 from wildberries import api
 from wildberries import utils
-from wildberries.models import Store
+from wildberries.models import Store, SyncCheckpoint
 
 
-ACCESS = {
-    "CONTENT_API_AUTHORIZATION_TOKEN": CONTENT_API_AUTHORIZATION_TOKEN,
-    "SUPPLIER_ID": SUPPLIER_ID,
-    "STATISTICS_API_KEY": STATISTICS_API_KEY,
-    "ORDERS_API_TOKEN": ORDERS_API_TOKEN
-}
 tz = timezone('UTC')
 
 
-from_datetime = tz.localize(datetime.datetime(year=2021, month=4, day=1))
-to_datetime = tz.localize(datetime.datetime(year=2021, month=5, day=1))
+def parse_date(value):
+    return tz.localize(datetime.datetime.strptime(value, '%Y-%m-%d'))
+
+
+def get_default_date_from(store):
+    """
+        Начало периода по умолчанию: последняя загрузка заказов минус
+        api.CLOSED_WINDOW_DELAY, пока статусы заказов еще меняются.
+        Если заказы еще не загружались - дата открытия магазина.
+    """
+    if store.last_download_wildberries_fbs_orders:
+        return store.last_download_wildberries_fbs_orders - api.CLOSED_WINDOW_DELAY
+    if store.opening_date:
+        return tz.localize(datetime.datetime.combine(store.opening_date, datetime.time()))
+    return None
+
 
 class Command(BaseCommand):
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--store', type=int, required=True,
+            help='ID магазина')
+        parser.add_argument(
+            '--date-from', type=parse_date, default=None,
+            help='Загрузить заказы начиная с этой даты, ГГГГ-ММ-ДД. По умолчанию - '
+                 'за {} дней до последней загрузки или с даты открытия магазина'.format(
+                     api.CLOSED_WINDOW_DELAY.days))
+        parser.add_argument(
+            '--date-to', type=parse_date, default=None,
+            help='Загрузить заказы до этой даты (не включая ее), ГГГГ-ММ-ДД. '
+                 'По умолчанию - до начала синхронизации')
+        parser.add_argument(
+            '--window-days', type=int, default=None,
+            help='Загружать период окнами по указанному количеству дней')
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Сколько окон загружать одновременно')
+        parser.add_argument(
+            '--join-backend', choices=['pandas', 'python'], default='pandas',
+            help='Вариант сопоставления заказов с продажами и статусами')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько заказов сохранять за один раз')
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Продолжить прерванную синхронизацию с окна, '
+                 'следующего за последним сохраненным')
+
     def handle(self, *args, **options):
-        store = Store.objects.get(pk=1)
-        for _posting in api.fbs_order_list(ACCESS, from_datetime, to_datetime):
-            order = utils.make_fbs_order(store, _posting)
\ No newline at end of file
+        store = Store.objects.get(pk=options['store'])
+        window = None
+        if options['window_days']:
+            window = datetime.timedelta(days=options['window_days'])
+
+        from_datetime = options['date_from'] or get_default_date_from(store)
+        if from_datetime is None:
+            raise CommandError('Заказы магазина еще не загружались и не задана дата '
+                               'открытия магазина: укажите --date-from')
+
+        checkpoint = utils.get_sync_checkpoint(store, SyncCheckpoint.ORDERS,
+                                               resume=options['resume'])
+        # При продолжении период заканчивается там же,
+        # где у прерванной синхронизации
+        to_datetime = options['date_to'] or checkpoint.started_at
+        windows = api.fbs_order_windows(store.wildberries_access,
+                                        checkpoint.position or from_datetime, to_datetime,
+                                        window=window,
+                                        max_workers=options['workers'],
+                                        join_backend=options['join_backend'])
+        # Каждая пачка сохраняется в своей транзакции. Заказы и позиции
+        # записываются через ON CONFLICT, поэтому повторное сохранение
+        # пачек недогруженного окна после перезапуска безопасно.
+        # Карточки товаров позиций ищутся через общую для пачек карту
+        product_card_map = utils.ProductCardMap(store)
+        counts = collections.Counter()
+        changed_fields = collections.Counter()
+        changed_item_fields = collections.Counter()
+        for _, window_end, orders in windows:
+            for _postings in utils.iter_chunks(orders, options['batch_size']):
+                result = utils.make_fbs_orders(store, _postings, product_card_map=product_card_map)
+                counts.update({
+                    name: len(result[name])
+                    for name in ('created', 'updated', 'unchanged', 'created_items', 'updated_items')
+                })
+                changed_fields.update(result['changed_fields'])
+                changed_item_fields.update(result['changed_item_fields'])
+            checkpoint.position = window_end
+            checkpoint.save(update_fields=['position', 'updated_at'])
+
+        with transaction.atomic():
+            # Отметка сдвигается, только если загружено все от прежней
+            # отметки (или от даты открытия магазина) до to_datetime
+            loaded_from = store.last_download_wildberries_fbs_orders or get_default_date_from(store)
+            if loaded_from is None or from_datetime <= loaded_from < to_datetime:
+                store.last_download_wildberries_fbs_orders = to_datetime
+                store.save(update_fields=['last_download_wildberries_fbs_orders'])
+            checkpoint.delete()
+
+        self.stdout.write(
+            'Заказы: создано {created}, изменено {updated}, без изменений {unchanged}; '
+            'позиции: создано {created_items}, изменено {updated_items}'.format_map(counts))
+        self.stdout.write('Изменено полей заказов: {}'.format(
+            utils.format_changed_fields(changed_fields)))
+        self.stdout.write('Изменено полей позиций: {}'.format(
+            utils.format_changed_fields(changed_item_fields)))
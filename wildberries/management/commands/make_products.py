@@ -1,24 +1,71 @@
-from django.core.management.base import BaseCommand
+import collections
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
-from wildberries.consts import (
-    CONTENT_API_AUTHORIZATION_TOKEN, SUPPLIER_ID,
-    STATISTICS_API_KEY, ORDERS_API_TOKEN
-)
 from wildberries import api
 from wildberries import utils
-from wildberries.models import Store
-
+from wildberries.models import Store, SyncCheckpoint
 
-ACCESS = {
-    "CONTENT_API_AUTHORIZATION_TOKEN": CONTENT_API_AUTHORIZATION_TOKEN,
-    "SUPPLIER_ID": SUPPLIER_ID,
-    "STATISTICS_API_KEY": STATISTICS_API_KEY,
-    "ORDERS_API_TOKEN": ORDERS_API_TOKEN
-}
 
 class Command(BaseCommand):
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--store', type=int, required=True,
+            help='ID магазина')
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help='Загрузить только карточки, измененные '
+                 'после последней успешной синхронизации')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько карточек API сохранять за один раз')
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Продолжить прерванную синхронизацию с последней сохраненной '
+                 'пачки. Запускать с теми же параметрами, что и прерванную. '
+                 'Нельзя вместе с --incremental')
+
     def handle(self, *args, **options):
-        store = Store.objects.get(pk=1)
-        for _posting in api.product_list(ACCESS):
-            product_card = utils.make_product_card(store, _posting)
\ No newline at end of file
+        # Инкрементальная выгрузка идет от новых карточек к старым:
+        # карточки, измененные после обрыва, сдвигают сохраненный offset,
+        # и часть карточек была бы пропущена. Прерванная инкрементальная
+        # синхронизация запускается заново, отметка магазина при обрыве
+        # не сдвигается.
+        if options['incremental'] and options['resume']:
+            raise CommandError('--resume нельзя использовать вместе с --incremental')
+
+        store = Store.objects.get(pk=options['store'])
+
+        # Отметка берется до начала выгрузки, чтобы карточки,
+        # измененные во время синхронизации, попали в следующую.
+        # При продолжении используется отметка прерванной синхронизации.
+        checkpoint = utils.get_sync_checkpoint(store, SyncCheckpoint.PRODUCTS,
+                                               resume=options['resume'])
+        updated_since = None
+        if options['incremental']:
+            updated_since = store.last_download_products
+
+        cards = api.product_list(store.wildberries_access, updated_since=updated_since,
+                                 offset=checkpoint.offset)
+        counts = collections.Counter()
+        changed_fields = collections.Counter()
+        # Пачка и сдвиг точки продолжения сохраняются в одной транзакции
+        for _postings in utils.iter_chunks(cards, options['batch_size']):
+            with transaction.atomic():
+                result = utils.make_product_cards(store, _postings)
+                checkpoint.offset += len(_postings)
+                checkpoint.save(update_fields=['offset', 'updated_at'])
+            counts.update({name: len(result[name]) for name in ('created', 'updated', 'unchanged')})
+            changed_fields.update(result['changed_fields'])
+
+        with transaction.atomic():
+            store.last_download_products = checkpoint.started_at
+            store.save(update_fields=['last_download_products'])
+            checkpoint.delete()
+
+        self.stdout.write(
+            'Карточки товаров: создано {created}, изменено {updated}, '
+            'без изменений {unchanged}'.format_map(counts))
+        self.stdout.write('Изменено полей: {}'.format(utils.format_changed_fields(changed_fields)))
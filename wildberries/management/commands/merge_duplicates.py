@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from wildberries import duplicates
+
+
+STEP_NAMES = {
+    'order_items': 'перенесено позиций заказов',
+    'main_images': 'обновлено основных изображений',
+    'images': 'перенесено изображений',
+    'duplicate_images': 'удалено одинаковых изображений',
+    'product_cards': 'удалено дубликатов карточек',
+}
+
+
+class Command(BaseCommand):
+    help = 'Объединение карточек товаров с одинаковым chrt_id в магазине'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать изменения и откатить их')
+
+    def progress(self, step, rows_count, elapsed):
+        self.stdout.write('{}: {} за {:.1f} с'.format(STEP_NAMES[step], rows_count, elapsed))
+
+    def handle(self, *args, **options):
+        started_at = time.monotonic()
+        with transaction.atomic():
+            result = duplicates.merge_duplicate_product_cards(progress=self.progress)
+            if options['dry_run']:
+                transaction.set_rollback(True)
+        self.stdout.write(
+            '{}: удалено {product_cards} дубликатов карточек за {elapsed:.1f} с'.format(
+                'Проверка' if options['dry_run'] else 'Готово',
+                elapsed=time.monotonic() - started_at, **result))
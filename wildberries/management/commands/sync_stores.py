@@ -0,0 +1,119 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from wildberries import transport
+from wildberries import utils
+from wildberries.models import Store
+
+
+def get_enabled_stores():
+    """
+        Магазины, которые нужно синхронизировать: не отключенные
+        и с ключами API Wildberries.
+    """
+    return (Store.objects
+            .filter(disabled_at__isnull=True, disabled_reason='')
+            .exclude(wildberries_supplier_id='')
+            .order_by('id'))
+
+
+def init_worker():
+    """
+        Подготовка дочернего процесса: соединения с базой открываются
+        заново при первом запросе, сессии HTTP и ограничители частоты
+        запросов не разделяются с родительским процессом.
+    """
+    django.setup()
+    transport.reset()
+
+
+def sync_store(store_id, options):
+    """
+        Синхронизирует карточки товаров и заказы магазина
+        под блокировкой магазина.
+            Возвращает:
+                dict: id магазина (store), результат (status: 'ok',
+                      'locked' или 'failed'), текст ошибки (error)
+                      и длительность в секундах (elapsed).
+    """
+    started_at = time.monotonic()
+    result = {'store': store_id, 'status': 'ok', 'error': ''}
+    try:
+        # Магазин мог быть удален после получения списка
+        store = Store.objects.get(pk=store_id)
+        with utils.store_sync_lock(store) as locked:
+            if not locked:
+                result['status'] = 'locked'
+            else:
+                # Инкрементальная выгрузка карточек не продолжается
+                # с точки обрыва, а запускается заново
+                call_command('make_products', store=store_id,
+                             incremental=options['incremental'],
+                             resume=options['resume'] and not options['incremental'])
+                call_command('make_orders', store=store_id,
+                             window_days=options['window_days'],
+                             resume=options['resume'])
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    result['elapsed'] = time.monotonic() - started_at
+    return result
+
+
+class Command(BaseCommand):
+    help = 'Синхронизация карточек товаров и заказов всех включенных магазинов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Сколько магазинов синхронизировать одновременно, '
+                 'каждый в своем процессе. При 1 магазины синхронизируются '
+                 'по очереди в текущем процессе')
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help='Загрузить только карточки, измененные '
+                 'после последней успешной синхронизации')
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Продолжить прерванные синхронизации с сохраненных точек. '
+                 'С --incremental карточки товаров загружаются заново')
+        parser.add_argument(
+            '--window-days', type=int, default=None,
+            help='Загружать заказы окнами по указанному количеству дней')
+
+    def handle(self, *args, **options):
+        store_ids = list(get_enabled_stores().values_list('id', flat=True))
+        self.stdout.write('Магазинов к синхронизации: {}'.format(len(store_ids)))
+
+        sync_options = {name: options[name] for name in ('incremental', 'resume', 'window_days')}
+        if options['workers'] <= 1:
+            results = (sync_store(store_id, sync_options) for store_id in store_ids)
+            failed = self.report(results)
+        else:
+            # Дочерние процессы не должны унаследовать открытое соединение
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'],
+                                     mp_context=multiprocessing.get_context('fork'),
+                                     initializer=init_worker) as executor:
+                results = executor.map(sync_store, store_ids,
+                                       [sync_options] * len(store_ids))
+                failed = self.report(results)
+
+        if failed:
+            raise CommandError('Не удалось синхронизировать магазины: {}'.format(
+                ', '.join(map(str, failed))))
+
+    def report(self, results):
+        failed = []
+        for result in results:
+            self.stdout.write('магазин {store}: {status} за {elapsed:.1f} с {error}'.format(
+                **result).rstrip())
+            if result['status'] == 'failed':
+                failed.append(result['store'])
+        return failed
@@ -0,0 +1,64 @@
+from django.db import migrations, models
+
+
+# Дубликаты, которые раньше приводили к MultipleObjectsReturned при загрузке.
+# Из заказов с одним номером остается заказ с наименьшим id, позиции
+# остальных переносятся на него. Из позиций с одним chrt_id в заказе
+# остается позиция с самыми свежими данными (updated_at, затем id).
+MERGE_DUPLICATES_SQL = [
+    '''
+    CREATE TEMPORARY TABLE order_duplicate ON COMMIT DROP AS
+    SELECT id AS duplicate_id, kept_id
+    FROM (
+        SELECT id, first_value(id) OVER (
+            PARTITION BY store_id, number ORDER BY id
+        ) AS kept_id
+        FROM wildberries_order
+        WHERE store_id IS NOT NULL
+    ) AS ranked
+    WHERE id <> kept_id
+    ''',
+    '''
+    UPDATE wildberries_orderitem AS item
+    SET order_id = duplicate.kept_id
+    FROM order_duplicate AS duplicate
+    WHERE item.order_id = duplicate.duplicate_id
+    ''',
+    '''
+    DELETE FROM wildberries_order AS ord
+    USING order_duplicate AS duplicate
+    WHERE ord.id = duplicate.duplicate_id
+    ''',
+    '''
+    DELETE FROM wildberries_orderitem AS item
+    USING (
+        SELECT id, row_number() OVER (
+            PARTITION BY order_id, wildberries_character_id
+            ORDER BY updated_at DESC NULLS LAST, id DESC
+        ) AS position
+        FROM wildberries_orderitem
+        WHERE order_id IS NOT NULL
+    ) AS ranked
+    WHERE item.id = ranked.id AND ranked.position > 1
+    ''',
+    'DROP TABLE order_duplicate',
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wildberries', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunSQL(MERGE_DUPLICATES_SQL, migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(fields=('store', 'number'), name='wildberries_order_store_number_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'wildberries_character_id'), name='wildberries_orderitem_order_chrt_id_uniq'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+BACKFILL_BATCH_SIZE = 1000
+
+# Модель, поле с "сырыми" данными, поле с контрольной суммой
+CHECKSUM_FIELDS = [
+    ('ProductCard', 'raw_data', 'raw_data_checksum'),
+    ('Order', 'raw_data', 'raw_data_checksum'),
+    ('OrderItem', 'raw_product_data', 'raw_product_data_checksum'),
+]
+
+
+def get_payload_checksum(raw_data):
+    # md5 от JSON с отсортированными ключами, как в моделях на момент миграции
+    return hashlib.md5(json.dumps(raw_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def backfill_checksums(apps, schema_editor):
+    for model_name, data_field, checksum_field in CHECKSUM_FIELDS:
+        model = apps.get_model('wildberries', model_name)
+        last_id = 0
+        while True:
+            batch = list(model.objects
+                         .filter(id__gt=last_id)
+                         .order_by('id')
+                         .only('id', data_field)[:BACKFILL_BATCH_SIZE])
+            if not batch:
+                break
+            for obj in batch:
+                setattr(obj, checksum_field, get_payload_checksum(getattr(obj, data_field)))
+            model.objects.bulk_update(batch, [checksum_field])
+            last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wildberries', '0002_order_unique_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='raw_data_checksum',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='raw_product_data_checksum',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='productcard',
+            name='raw_data_checksum',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=32),
+        ),
+        migrations.RunPython(backfill_checksums, migrations.RunPython.noop),
+    ]
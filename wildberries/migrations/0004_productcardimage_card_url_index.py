@@ -0,0 +1,20 @@
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wildberries', '0003_payload_checksums'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='productcardimage',
+            name='wildberries_remote__1c9c3b_idx',
+        ),
+        migrations.AddIndex(
+            model_name='productcardimage',
+            index=models.Index(fields=['product_card', 'remote_file_url'], name='wildberries_product_c01436_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wildberries', '0004_productcardimage_card_url_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sync_type', models.CharField(choices=[('products', 'карточки товаров'), ('orders', 'заказы')], max_length=32, verbose_name='тип синхронизации')),
+                ('offset', models.PositiveIntegerField(default=0, verbose_name='сохранено записей')),
+                ('position', models.DateTimeField(blank=True, null=True, verbose_name='загружено по')),
+                ('started_at', models.DateTimeField(verbose_name='начало синхронизации')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='обновлено')),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_checkpoints', to='wildberries.Store')),
+            ],
+            options={
+                'verbose_name': 'точка продолжения синхронизации',
+                'verbose_name_plural': 'точки продолжения синхронизации',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='synccheckpoint',
+            constraint=models.UniqueConstraint(fields=('store', 'sync_type'), name='wildberries_synccheckpoint_store_type_uniq'),
+        ),
+    ]
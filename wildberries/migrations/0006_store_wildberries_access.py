@@ -0,0 +1,74 @@
+import importlib
+import os
+
+from django.db import migrations, models
+
+
+# Магазин, для которого команды раньше брали ключи из wildberries.consts
+LEGACY_STORE_ID = 1
+
+# Поле магазина, переменная окружения и имя в wildberries.consts.
+# Переменная окружения важнее consts: модуль может быть изменен
+# или удален после миграции.
+LEGACY_ACCESS_FIELDS = [
+    ('wildberries_supplier_id', 'WB_SUPPLIER_ID', 'SUPPLIER_ID'),
+    ('wildberries_content_api_token', 'WB_CONTENT_API_TOKEN',
+     'CONTENT_API_AUTHORIZATION_TOKEN'),
+    ('wildberries_statistics_api_key', 'WB_STATISTICS_API_KEY', 'STATISTICS_API_KEY'),
+    ('wildberries_orders_api_token', 'WB_ORDERS_API_TOKEN', 'ORDERS_API_TOKEN'),
+]
+
+
+def get_legacy_access():
+    try:
+        consts = importlib.import_module('wildberries.consts')
+    except ImportError:
+        consts = None
+    return {field: os.environ.get(env_name, getattr(consts, const_name, ''))
+            for field, env_name, const_name in LEGACY_ACCESS_FIELDS}
+
+
+def copy_legacy_access(apps, schema_editor):
+    """
+        Копирует ключи из переменных окружения или wildberries.consts
+        в магазин LEGACY_STORE_ID. Если магазина нет, ключи ни к чему
+        не привязаны и копирование пропускается.
+    """
+    Store = apps.get_model('wildberries', 'Store')
+    if not Store.objects.filter(pk=LEGACY_STORE_ID).exists():
+        return
+    access = get_legacy_access()
+    if not any(access.values()):
+        return
+    Store.objects.filter(pk=LEGACY_STORE_ID, wildberries_supplier_id='').update(**access)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wildberries', '0005_sync_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='wildberries_content_api_token',
+            field=models.CharField(blank=True, default='', max_length=512, verbose_name='токен Content API'),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='wildberries_orders_api_token',
+            field=models.CharField(blank=True, default='', max_length=256, verbose_name='токен API заказов'),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='wildberries_statistics_api_key',
+            field=models.CharField(blank=True, default='', max_length=256, verbose_name='ключ API статистики'),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='wildberries_supplier_id',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='ID поставщика Wildberries'),
+        ),
+        migrations.RunPython(copy_legacy_access, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import zlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+ARCHIVE_BATCH_SIZE = 1000
+
+SET_CONSTRAINTS_IMMEDIATE = 'SET CONSTRAINTS ALL IMMEDIATE'
+
+# Модель, поле с "сырыми" данными, поле с контрольной суммой
+ARCHIVED_FIELDS = [
+    ('ProductCard', 'raw_data', 'raw_data_checksum'),
+    ('Order', 'raw_data', 'raw_data_checksum'),
+    ('OrderItem', 'raw_product_data', 'raw_product_data_checksum'),
+    ('OrderItem', 'raw_financial_data', 'raw_financial_data_checksum'),
+]
+
+
+# Формат архива зафиксирован на момент миграции, а не берется из
+# wildberries.models: модели могут измениться после нее
+def pack_payload(raw_data):
+    dumped = json.dumps(raw_data, sort_keys=True).encode('utf-8')
+    return hashlib.md5(dumped).hexdigest(), zlib.compress(dumped), len(dumped)
+
+
+def unpack_payload(data):
+    return json.loads(zlib.decompress(bytes(data)).decode('utf-8'))
+
+
+def _iter_batches(model, fields):
+    last_id = 0
+    while True:
+        batch = list(model.objects
+                     .filter(id__gt=last_id)
+                     .order_by('id')
+                     .only('id', *fields)[:ARCHIVE_BATCH_SIZE])
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1].id
+
+
+def archive_raw_payloads(apps, schema_editor):
+    """
+        Переносит "сырые" данные в архив: каждое уникальное содержимое
+        записывается один раз, для каждой записи добавляется версия.
+        Пустые данные не архивируются, контрольная сумма у них пустая.
+    """
+    RawPayload = apps.get_model('wildberries', 'RawPayload')
+    RawPayloadVersion = apps.get_model('wildberries', 'RawPayloadVersion')
+    for model_name, data_field, checksum_field in ARCHIVED_FIELDS:
+        model = apps.get_model('wildberries', model_name)
+        for batch in _iter_batches(model, [data_field, checksum_field]):
+            payloads = {}
+            versions = []
+            for obj in batch:
+                raw_data = getattr(obj, data_field)
+                checksum = ''
+                if raw_data:
+                    checksum, data, size = pack_payload(raw_data)
+                    payloads[checksum] = RawPayload(checksum=checksum, data=data, size=size)
+                    versions.append(RawPayloadVersion(
+                        model=model._meta.model_name, object_id=obj.id,
+                        field=data_field, payload_id=checksum))
+                setattr(obj, checksum_field, checksum)
+            archived = set(RawPayload.objects
+                           .filter(checksum__in=list(payloads))
+                           .values_list('checksum', flat=True))
+            RawPayload.objects.bulk_create(
+                [payload for checksum, payload in payloads.items() if checksum not in archived])
+            RawPayloadVersion.objects.bulk_create(versions)
+            model.objects.bulk_update(batch, [checksum_field])
+
+
+def restore_raw_payloads(apps, schema_editor):
+    RawPayload = apps.get_model('wildberries', 'RawPayload')
+    for model_name, data_field, checksum_field in ARCHIVED_FIELDS:
+        model = apps.get_model('wildberries', model_name)
+        for batch in _iter_batches(model, [checksum_field]):
+            payloads = dict(RawPayload.objects
+                            .filter(checksum__in={getattr(obj, checksum_field) for obj in batch})
+                            .values_list('checksum', 'data'))
+            for obj in batch:
+                data = payloads.get(getattr(obj, checksum_field))
+                setattr(obj, data_field, unpack_payload(data) if data is not None else {})
+            model.objects.bulk_update(batch, [data_field])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wildberries', '0006_store_wildberries_access'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RawPayload',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checksum', models.CharField(max_length=32, unique=True, verbose_name='контрольная сумма')),
+                ('data', models.BinaryField(verbose_name='сжатый JSON')),
+                ('size', models.PositiveIntegerField(verbose_name='размер без сжатия')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='добавлено')),
+            ],
+            options={
+                'verbose_name': '"сырые" данные',
+                'verbose_name_plural': '"сырые" данные',
+            },
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='raw_financial_data_checksum',
+            field=models.CharField(blank=True, default='', editable=False, max_length=32),
+        ),
+        migrations.CreateModel(
+            name='RawPayloadVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=64, verbose_name='модель')),
+                ('object_id', models.IntegerField(verbose_name='id записи')),
+                ('field', models.CharField(max_length=64, verbose_name='поле')),
+                ('recorded_at', models.DateTimeField(auto_now_add=True, verbose_name='записано')),
+                ('payload', models.ForeignKey(db_column='checksum', on_delete=django.db.models.deletion.PROTECT, related_name='versions', to='wildberries.RawPayload', to_field='checksum')),
+            ],
+            options={
+                'verbose_name': 'версия "сырых" данных',
+                'verbose_name_plural': 'версии "сырых" данных',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='rawpayloadversion',
+            index=models.Index(fields=['model', 'object_id', 'field', 'recorded_at'], name='wildberries_model_d9881d_idx'),
+        ),
+        # Отложенные проверки внешних ключей после массовой записи
+        # выполняются сразу, иначе ALTER TABLE в той же транзакции
+        # завершается ошибкой
+        migrations.RunSQL(SET_CONSTRAINTS_IMMEDIATE, SET_CONSTRAINTS_IMMEDIATE),
+        migrations.RunPython(archive_raw_payloads, restore_raw_payloads),
+        migrations.RunSQL(SET_CONSTRAINTS_IMMEDIATE, SET_CONSTRAINTS_IMMEDIATE),
+        migrations.RemoveField(
+            model_name='order',
+            name='raw_data',
+        ),
+        migrations.RemoveField(
+            model_name='orderitem',
+            name='raw_financial_data',
+        ),
+        migrations.RemoveField(
+            model_name='orderitem',
+            name='raw_product_data',
+        ),
+        migrations.RemoveField(
+            model_name='productcard',
+            name='raw_data',
+        ),
+    ]
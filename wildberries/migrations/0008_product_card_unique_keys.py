@@ -0,0 +1,101 @@
+from django.db import migrations, models
+
+
+# Копия запросов из wildberries.duplicates на момент миграции:
+# остается карточка с наименьшим id, позиции заказов и изображения
+# дубликатов переносятся на нее, одинаковые изображения удаляются
+MERGE_PRODUCT_CARD_DUPLICATES_SQL = [
+    '''
+    CREATE TEMPORARY TABLE product_card_duplicate ON COMMIT DROP AS
+    SELECT id AS duplicate_id, kept_id
+    FROM (
+        SELECT id, first_value(id) OVER (
+            PARTITION BY store_id, wildberries_character_id ORDER BY id
+        ) AS kept_id
+        FROM wildberries_productcard
+        WHERE store_id IS NOT NULL
+    ) AS ranked
+    WHERE id <> kept_id
+    ''',
+    '''
+    UPDATE wildberries_orderitem AS item
+    SET product_card_id = duplicate.kept_id
+    FROM product_card_duplicate AS duplicate
+    WHERE item.product_card_id = duplicate.duplicate_id
+    ''',
+    '''
+    UPDATE wildberries_productcard AS kept
+    SET image_id = adopted.image_id
+    FROM (
+        SELECT DISTINCT ON (duplicate.kept_id) duplicate.kept_id, card.image_id
+        FROM product_card_duplicate AS duplicate
+        JOIN wildberries_productcard AS card ON card.id = duplicate.duplicate_id
+        WHERE card.image_id IS NOT NULL
+        ORDER BY duplicate.kept_id, duplicate.duplicate_id
+    ) AS adopted
+    WHERE kept.id = adopted.kept_id AND kept.image_id IS NULL
+    ''',
+    '''
+    UPDATE wildberries_productcardimage AS image
+    SET product_card_id = duplicate.kept_id
+    FROM product_card_duplicate AS duplicate
+    WHERE image.product_card_id = duplicate.duplicate_id
+    ''',
+    '''
+    CREATE TEMPORARY TABLE product_card_image_duplicate ON COMMIT DROP AS
+    SELECT id AS duplicate_id, kept_id
+    FROM (
+        SELECT id, first_value(id) OVER (
+            PARTITION BY product_card_id, remote_file_url ORDER BY id
+        ) AS kept_id
+        FROM wildberries_productcardimage
+        WHERE product_card_id IN (SELECT kept_id FROM product_card_duplicate)
+    ) AS ranked
+    WHERE id <> kept_id
+    ''',
+    '''
+    UPDATE wildberries_productcard AS card
+    SET image_id = duplicate.kept_id
+    FROM product_card_image_duplicate AS duplicate
+    WHERE card.image_id = duplicate.duplicate_id
+    ''',
+    '''
+    DELETE FROM wildberries_productcardimage AS image
+    USING product_card_image_duplicate AS duplicate
+    WHERE image.id = duplicate.duplicate_id
+    ''',
+    '''
+    DELETE FROM wildberries_productcard AS card
+    USING product_card_duplicate AS duplicate
+    WHERE card.id = duplicate.duplicate_id
+    ''',
+    'DROP TABLE product_card_duplicate, product_card_image_duplicate',
+]
+
+SET_CONSTRAINTS_IMMEDIATE = 'SET CONSTRAINTS ALL IMMEDIATE'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wildberries', '0007_raw_payload_archive'),
+    ]
+
+    operations = [
+        # Дубликаты, которые раньше удалялись при загрузке карточек.
+        # Отложенные проверки внешних ключей нужно выполнить до ALTER TABLE.
+        migrations.RunSQL(MERGE_PRODUCT_CARD_DUPLICATES_SQL, migrations.RunSQL.noop),
+        migrations.RunSQL(SET_CONSTRAINTS_IMMEDIATE, migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='productcard',
+            constraint=models.UniqueConstraint(fields=('store', 'wildberries_character_id'), name='wildberries_productcard_store_chrt_id_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['store', 'created_at'], name='wildberries_store_i_dd26bc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['store', 'created_at'], name='wildberries_store_i_2666e9_idx'),
+        ),
+    ]
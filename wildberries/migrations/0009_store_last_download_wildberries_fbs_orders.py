@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wildberries', '0008_product_card_unique_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='last_download_wildberries_fbs_orders',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,15 +1,186 @@
 import decimal
 import hashlib
 import json
+import zlib
 
-from django.db import models
-from django.contrib.postgres.fields import JSONField
+from django.db import models, transaction
+
+
+# Размер одного INSERT при записи "сырых" данных в архив
+ARCHIVE_BATCH_SIZE = 500
 
 
 def raw_data_default():
     return {}
 
 
+def _dump_payload(raw_data):
+    return json.dumps(raw_data, sort_keys=True).encode('utf-8')
+
+
+def get_payload_checksum(raw_data):
+    """
+        Контрольная сумма "сырых" данных API: md5 от JSON
+        с отсортированными ключами.
+    """
+    return hashlib.md5(_dump_payload(raw_data)).hexdigest()
+
+
+def pack_payload(raw_data):
+    """
+        "Сырые" данные API для архива.
+            Возвращает:
+                (checksum, data, size): Контрольная сумма, сжатый JSON
+                                        и его размер без сжатия.
+    """
+    dumped = _dump_payload(raw_data)
+    return hashlib.md5(dumped).hexdigest(), zlib.compress(dumped), len(dumped)
+
+
+def unpack_payload(data):
+    return json.loads(zlib.decompress(bytes(data)).decode('utf-8'))
+
+
+class ArchivedPayload(object):
+    """
+        "Сырые" данные записи, которые хранятся в архиве RawPayload,
+        а в таблице записи остается только их контрольная сумма.
+        Данные загружаются из архива при первом обращении.
+        Присваивание задает контрольную сумму, а новые данные
+        записываются в архив при save() или через archive_payloads().
+    """
+
+    def __init__(self, checksum_field):
+        self.checksum_field = checksum_field
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def _get_state(self, instance):
+        return instance.__dict__.setdefault('_archived_payloads', {})
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        checksum = getattr(instance, self.checksum_field)
+        state = self._get_state(instance)
+        if self.name not in state or state[self.name][0] != checksum:
+            if checksum:
+                raw_data = RawPayload.objects.get(checksum=checksum).payload
+            else:
+                raw_data = raw_data_default()
+            state[self.name] = (checksum, raw_data, False)
+        return state[self.name][1]
+
+    def __set__(self, instance, raw_data):
+        checksum = get_payload_checksum(raw_data)
+        setattr(instance, self.checksum_field, checksum)
+        self._get_state(instance)[self.name] = (checksum, raw_data, True)
+
+
+def archive_payloads(instances):
+    """
+        Записывает в архив новые "сырые" данные сохраненных записей:
+        данные, которых еще нет в архиве, сжимаются и добавляются
+        в RawPayload, для каждой записи добавляется версия в
+        RawPayloadVersion. Записи без новых данных пропускаются.
+            Аргументы:
+                instances (iterable): Сохраненные записи моделей
+                                      с полями ArchivedPayload.
+    """
+    payloads = {}
+    versions = []
+    for instance in instances:
+        state = instance.__dict__.get('_archived_payloads')
+        if not state:
+            continue
+        for name, (checksum, raw_data, changed) in list(state.items()):
+            if not changed:
+                continue
+            payloads[checksum] = raw_data
+            versions.append(RawPayloadVersion(
+                model=instance._meta.model_name,
+                object_id=instance.pk,
+                field=name,
+                payload_id=checksum,
+            ))
+            state[name] = (checksum, raw_data, False)
+    if not versions:
+        return
+
+    archived = set(RawPayload.objects
+                   .filter(checksum__in=list(payloads))
+                   .values_list('checksum', flat=True))
+    new_payloads = []
+    for checksum, raw_data in payloads.items():
+        if checksum in archived:
+            continue
+        checksum, data, size = pack_payload(raw_data)
+        new_payloads.append(RawPayload(checksum=checksum, data=data, size=size))
+    # Одинаковые данные могли одновременно записать в архив
+    # при загрузке другого магазина
+    RawPayload.objects.bulk_create(new_payloads, batch_size=ARCHIVE_BATCH_SIZE,
+                                   ignore_conflicts=True)
+    RawPayloadVersion.objects.bulk_create(versions, batch_size=ARCHIVE_BATCH_SIZE)
+
+
+class ArchivedPayloadMixin(models.Model):
+    """
+        Записывает новые "сырые" данные в архив при save().
+    """
+
+    class Meta(object):
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            archive_payloads([self])
+
+
+class RawPayload(models.Model):
+    """
+        "Сырые" данные API в сжатом виде, по одной записи
+        на каждое уникальное содержимое.
+    """
+    checksum = models.CharField('контрольная сумма', max_length=32, unique=True)
+    data = models.BinaryField('сжатый JSON')
+    size = models.PositiveIntegerField('размер без сжатия')
+    created_at = models.DateTimeField('добавлено', auto_now_add=True)
+
+    class Meta(object):
+        verbose_name = '"сырые" данные'
+        verbose_name_plural = '"сырые" данные'
+
+    @property
+    def payload(self):
+        return unpack_payload(self.data)
+
+    def __str__(self):
+        return self.checksum
+
+
+class RawPayloadVersion(models.Model):
+    """
+        Версия "сырых" данных поля записи. Версии не удаляются
+        при изменении данных и остаются для аудита.
+    """
+    model = models.CharField('модель', max_length=64)
+    object_id = models.IntegerField('id записи')
+    field = models.CharField('поле', max_length=64)
+    payload = models.ForeignKey('RawPayload', on_delete=models.PROTECT, to_field='checksum',
+                                db_column='checksum', related_name='versions')
+    recorded_at = models.DateTimeField('записано', auto_now_add=True)
+
+    class Meta(object):
+        verbose_name = 'версия "сырых" данных'
+        verbose_name_plural = 'версии "сырых" данных'
+        indexes = [
+            models.Index(fields=['model', 'object_id', 'field', 'recorded_at']),
+        ]
+
+
 class IdentifierMixin(models.Model):
     identifier = models.CharField('идентификатор', max_length=256, blank=True,
                                   db_index=True, default='', editable=False)
@@ -26,7 +197,7 @@ class ProductCardImage(models.Model):
 
     class Meta(object):
         indexes = [
-            models.Index(fields=['remote_file_url', ]),
+            models.Index(fields=['product_card', 'remote_file_url']),
         ]
 
     def _get_file(self):
@@ -49,18 +220,41 @@ class Store(IdentifierMixin):
     last_download_products = models.DateTimeField(null=True, blank=True)
     last_download_ozon_fbo_postings = models.DateTimeField(null=True, blank=True)
     last_download_ozon_fbs_postings = models.DateTimeField(null=True, blank=True)
+    last_download_wildberries_fbs_orders = models.DateTimeField(null=True, blank=True)
     last_update_ozon_orders = models.DateTimeField(null=True, blank=True)
 
     disabled_reason = models.CharField('причина отключения', max_length=256,
                                        default='', blank=True, choices=DISABLED_REASON_CHOICES)
 
+    wildberries_supplier_id = models.CharField('ID поставщика Wildberries', max_length=64,
+                                               default='', blank=True)
+    wildberries_content_api_token = models.CharField('токен Content API', max_length=512,
+                                                     default='', blank=True)
+    wildberries_statistics_api_key = models.CharField('ключ API статистики', max_length=256,
+                                                      default='', blank=True)
+    wildberries_orders_api_token = models.CharField('токен API заказов', max_length=256,
+                                                    default='', blank=True)
+
     class Meta(object):
         verbose_name = 'магазин'
         verbose_name_plural = 'магазины'
         ordering = ('-id', )
 
-
-class ProductCard(IdentifierMixin):
+    @property
+    def wildberries_access(self):
+        """
+            Словарь с данными для авторизации в API Wildberries,
+            как его принимают функции wildberries.api.
+        """
+        return {
+            "CONTENT_API_AUTHORIZATION_TOKEN": self.wildberries_content_api_token,
+            "SUPPLIER_ID": self.wildberries_supplier_id,
+            "STATISTICS_API_KEY": self.wildberries_statistics_api_key,
+            "ORDERS_API_TOKEN": self.wildberries_orders_api_token,
+        }
+
+
+class ProductCard(ArchivedPayloadMixin, IdentifierMixin):
     PROCESSING = 'processing'
     MODERATING = 'moderating'
     PROCESSED = 'processed'
@@ -107,17 +301,24 @@ class ProductCard(IdentifierMixin):
     store = models.ForeignKey('Store', on_delete=models.SET_NULL,
                                 related_name='product_cards', null=True)
 
-    raw_data = JSONField(default=raw_data_default)
+    raw_data_checksum = models.CharField(max_length=32, default='', blank=True,
+                                         editable=False, db_index=True)
+    raw_data = ArchivedPayload('raw_data_checksum')
 
-    @property
-    def product_data_checksum(self):
-        return hashlib.md5(json.dumps(self.raw_data, sort_keys=True).encode('utf-8')).hexdigest()
+    class Meta(object):
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'wildberries_character_id'],
+                                    name='wildberries_productcard_store_chrt_id_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['store', 'created_at']),
+        ]
 
     def __str__(self):
         return self.sku
 
 
-class Order(IdentifierMixin):
+class Order(ArchivedPayloadMixin, IdentifierMixin):
     OZON_FBO = 'ozon_fbo'
     OZON_FBS = 'ozon_fbs'
     WILDBERRIES_FBS = 'wildberries_fbs'
@@ -188,17 +389,47 @@ class Order(IdentifierMixin):
     store = models.ForeignKey('Store', on_delete=models.SET_NULL,
                               related_name='orders', null=True)
 
-    raw_data = JSONField(default=raw_data_default)
+    raw_data_checksum = models.CharField(max_length=32, default='', blank=True,
+                                         editable=False, db_index=True)
+    raw_data = ArchivedPayload('raw_data_checksum')
 
-    @property
-    def order_data_checksum(self):
-        return hashlib.md5(json.dumps(self.raw_data, sort_keys=True).encode('utf-8')).hexdigest()
+    class Meta(object):
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'number'],
+                                    name='wildberries_order_store_number_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['store', 'created_at']),
+        ]
+
+    # Статус позиции сборочного задания Wildberries -> статус заказа
+    WILDBERRIES_STATUSES = {
+        '0': AWAITING_APPROVE,
+        '1': AWAITING_PACKAGING,
+        '2': AWAITING_DELIVER,
+        '3': CANCELLED,
+        '5': DELIVERING,
+        '6': DELIVERED,
+        '7': NOT_ACCEPTED,
+    }
+
+    @classmethod
+    def parse_status(cls, status, marketplace):
+        """
+            Статус заказа по статусу из API маркетплейса.
+            Для Wildberries status - строка из статуса позиции и статуса
+            сборочного задания (см. joins), статус заказа определяется
+            по статусу позиции.
+        """
+        if marketplace == 'wildberries':
+            return cls.WILDBERRIES_STATUSES.get(str(status)[:1], cls.NO_INFORMATION)
+        return cls.NO_INFORMATION
 
     def __str__(self):
         return self.number
 
 
-class OrderItem(models.Model):
+class OrderItem(ArchivedPayloadMixin, models.Model):
     updated_at = models.DateTimeField(
         verbose_name='дата и время обновления',
         null=True)
@@ -242,12 +473,53 @@ class OrderItem(models.Model):
         verbose_name="chrt_id", blank=True, default=0
     )
 
-    raw_product_data = JSONField(default=raw_data_default)
-    raw_financial_data = JSONField(default=raw_data_default)
+    raw_product_data_checksum = models.CharField(max_length=32, default='', blank=True,
+                                                 editable=False, db_index=True)
+    raw_product_data = ArchivedPayload('raw_product_data_checksum')
+    raw_financial_data_checksum = models.CharField(max_length=32, default='', blank=True,
+                                                   editable=False)
+    raw_financial_data = ArchivedPayload('raw_financial_data_checksum')
 
-    @property
-    def product_data_checksum(self):
-        return hashlib.md5(json.dumps(self.raw_product_data, sort_keys=True).encode('utf-8')).hexdigest()
+    class Meta(object):
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'wildberries_character_id'],
+                                    name='wildberries_orderitem_order_chrt_id_uniq'),
+        ]
+
+    def __str__(self):
+        return self.order.number
+
+
+class SyncCheckpoint(models.Model):
+    """
+        Место, до которого сохранена прерванная синхронизация магазина:
+        количество карточек товаров или конец последнего окна заказов.
+        Удаляется после успешного завершения синхронизации.
+    """
+    PRODUCTS = 'products'
+    ORDERS = 'orders'
+
+    SYNC_TYPE_CHOICES = [
+        (PRODUCTS, 'карточки товаров'),
+        (ORDERS, 'заказы'),
+    ]
+
+    store = models.ForeignKey('Store', on_delete=models.CASCADE,
+                              related_name='sync_checkpoints')
+    sync_type = models.CharField('тип синхронизации', max_length=32,
+                                 choices=SYNC_TYPE_CHOICES)
+    offset = models.PositiveIntegerField('сохранено записей', default=0)
+    position = models.DateTimeField('загружено по', null=True, blank=True)
+    started_at = models.DateTimeField('начало синхронизации')
+    updated_at = models.DateTimeField('обновлено', auto_now=True)
+
+    class Meta(object):
+        verbose_name = 'точка продолжения синхронизации'
+        verbose_name_plural = 'точки продолжения синхронизации'
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'sync_type'],
+                                    name='wildberries_synccheckpoint_store_type_uniq'),
+        ]
 
     def __str__(self):
-        return self.order.number
\ No newline at end of file
+        return '{} {}'.format(self.store_id, self.sync_type)
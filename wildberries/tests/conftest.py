@@ -0,0 +1,88 @@
+"""
+    Общие фикстуры тестов.
+"""
+import os
+
+import django
+import pytest
+
+from wildberries import api, transport
+from wildberries.tests.fake_api import BASE_API_SETTINGS, FakeWildberriesAPI
+
+
+# Настройки подключения по умолчанию, как в .env.
+# Для импорта моделей база не нужна.
+DEFAULT_ENVIRON = {
+    'DJANGO_SETTINGS_MODULE': 'config.settings',
+    'DB_NAME': 'test_wb',
+    'DB_USER': 'wb_admin',
+    'DB_PASSWORD': 'admin',
+    'DB_HOST': 'localhost',
+    'DB_PORT': '5432',
+}
+
+
+def pytest_configure(config):
+    for name, value in DEFAULT_ENVIRON.items():
+        os.environ.setdefault(name, value)
+    django.setup()
+
+
+@pytest.fixture
+def access():
+    """
+        Данные для авторизации: стенд их не проверяет.
+    """
+    return {
+        "CONTENT_API_AUTHORIZATION_TOKEN": "content-token",
+        "SUPPLIER_ID": "supplier-id",
+        "STATISTICS_API_KEY": "statistics-key",
+        "ORDERS_API_TOKEN": "orders-token"
+    }
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    """
+        Локальный стенд API вместо настоящих эндпоинтов Wildberries.
+        Запросы к стенду не ограничиваются по частоте и не кэшируются,
+        повторы после 429 идут без заметной задержки.
+    """
+    monkeypatch.setattr(transport, 'BACKOFF_FACTOR', 0.01)
+    monkeypatch.setattr(transport, '_cache', None)
+    monkeypatch.setattr(transport, '_cache_configured', True)
+    with FakeWildberriesAPI(cards=120, order_items=300) as server:
+        for name in BASE_API_SETTINGS:
+            monkeypatch.setattr(api, name, server.url)
+        transport.set_rate_limit(server.url, None)
+        yield server
+
+
+@pytest.fixture(scope='session')
+def django_db_setup():
+    """
+        Тестовая база test_<DB_NAME> на время сессии.
+        Если PostgreSQL недоступен, тесты с базой пропускаются.
+    """
+    from django.db import OperationalError
+    from django.test.utils import setup_databases, teardown_databases
+
+    try:
+        old_config = setup_databases(verbosity=0, interactive=False)
+    except OperationalError as e:
+        pytest.skip('PostgreSQL недоступен: {}'.format(e))
+    yield
+    teardown_databases(old_config, verbosity=0)
+
+
+@pytest.fixture
+def db(django_db_setup):
+    """
+        Доступ к тестовой базе: каждый тест выполняется в транзакции,
+        которая откатывается после теста.
+    """
+    from django.db import transaction
+
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
@@ -0,0 +1,241 @@
+"""
+    Генераторы синтетических ответов API Wildberries для тестов и бенчмарков.
+    Структура данных повторяет ответы /api/v1/orders,
+    /api/public/v1/supply_tasks/status и /api/v1/supplier/reportDetailByPeriod.
+"""
+import datetime
+import random
+
+from wildberries import joins
+
+
+SALES_EXTRA_COLUMNS = [
+    'realizationreport_id',
+    'suppliercontract_code',
+    'rrd_id',
+    'gi_id',
+    'subject_name',
+    'brand_name',
+    'sa_name',
+    'barcode',
+    'doc_type_name',
+    'supplier_oper_name',
+    'order_dt', 'sale_dt', 'rr_dt',
+    'shk_id',
+    'office_name',
+    'gi_box_type_name',
+]
+
+
+def iter_order_payloads(order_items_count, seed=0,
+                        from_datetime=datetime.datetime(2021, 4, 1),
+                        days=30, chrt_ids=None):
+    """
+        Генератор "сырых" данных по заказам: на каждый заказ возвращает
+        кортеж (order, sales, status), всего примерно order_items_count позиций.
+        Часть позиций не имеет продаж, часть имеет несколько строк отчета,
+        у части заказов нет статуса сборочного задания (status = None).
+        chrt_ids - характеристики товаров, из которых выбираются позиции,
+        например chrtId карточек из make_product_card_payload().
+    """
+    rnd = random.Random(seed)
+    if chrt_ids is None:
+        chrt_ids = [rnd.randint(10 ** 7, 10 ** 8) for _ in range(max(10, order_items_count // 50))]
+
+    rid = 10 ** 9
+    order_id = 10 ** 7
+    items_count = 0
+    while items_count < order_items_count:
+        order_id += rnd.randint(1, 3)
+        date_created = from_datetime + datetime.timedelta(
+            seconds=rnd.randint(0, days * 24 * 60 * 60 - 1))
+        items = []
+        sales = []
+        for _ in range(rnd.choice([1, 1, 1, 2, 3])):
+            rid += 1
+            chrt_id = rnd.choice(chrt_ids)
+            items.append({
+                'rid': str(rid),
+                'chrt_id': chrt_id,
+                'status': rnd.choice([0, 1, 1, 2, 3]),
+                'total_price': rnd.randint(100, 50000) * 100,
+            })
+            for _ in range(rnd.choice([0, 1, 1, 1, 2])):
+                sale = {
+                    'rid': rid,
+                    'nm_id': chrt_id // 10,
+                    'ts_name': rnd.choice(['S', 'M', 'L', None]),
+                    'quantity': rnd.choice([1, 1, 0]),
+                }
+                for column in joins.ORDER_ITEM_FINANCIAL_COLUMNS:
+                    sale[column] = rnd.choice([0, 0, rnd.randint(1, 5000), round(rnd.uniform(0, 5000), 2)])
+                for column in SALES_EXTRA_COLUMNS:
+                    sale[column] = '-'
+                sales.append(sale)
+        items_count += len(items)
+        order = {
+            'order_id': str(order_id),
+            'date_created': date_created.strftime('%Y-%m-%dT%H:%M:%S.%f') + '+03:00',
+            'wb_wh_id': rnd.choice([100, 200, 300]),
+            'items': items,
+        }
+
+        status = None
+        if rnd.random() < 0.8:
+            history = []
+            for _ in range(rnd.randint(1, 4)):
+                history.append({
+                    'status': rnd.randint(0, 9),
+                    'date': (date_created + datetime.timedelta(
+                        minutes=rnd.randint(0, 7 * 24 * 60))).isoformat() + 'Z',
+                })
+            status = {'order_id': str(order_id), 'items': history}
+
+        yield order, sales, status
+
+
+def make_order_payloads(order_items_count, seed=0,
+                        from_datetime=datetime.datetime(2021, 4, 1),
+                        days=30, chrt_ids=None):
+    """
+        Возвращает кортеж (orders, sales, statuses) с "сырыми" ответами API
+        примерно на order_items_count позиций заказов.
+    """
+    orders = []
+    sales = []
+    statuses = []
+    for order, order_sales, status in iter_order_payloads(
+            order_items_count, seed=seed, from_datetime=from_datetime,
+            days=days, chrt_ids=chrt_ids):
+        orders.append(order)
+        sales.extend(order_sales)
+        if status is not None:
+            statuses.append(status)
+    return orders, sales, statuses
+
+
+PRODUCT_CARDS_UPDATED_AT = datetime.datetime(2021, 5, 1)
+
+
+def product_card_chrt_id(index, nomenclature_index=0):
+    return 10 ** 7 + index * 4 + nomenclature_index
+
+
+def make_product_card_payload(index, seed=0):
+    """
+        Карточка товара в формате ответа /card/list Content API.
+        Карточка зависит только от index и seed, поэтому любую страницу
+        каталога можно получить, не создавая предыдущие.
+        updatedAt убывает с ростом index: каталог уже отсортирован
+        от новых карточек к старым.
+    """
+    rnd = random.Random(seed * 10 ** 9 + index)
+    updated_at = PRODUCT_CARDS_UPDATED_AT - datetime.timedelta(minutes=index)
+    nomenclatures = []
+    for nomenclature_index in range(rnd.choice([1, 1, 2, 3])):
+        chrt_id = product_card_chrt_id(index, nomenclature_index)
+        nomenclatures.append({
+            'id': 'nm-{}'.format(chrt_id),
+            'nmId': 2 * 10 ** 7 + chrt_id,
+            'vendorCode': '-{}'.format(nomenclature_index),
+            'variations': [{
+                'id': 'var-{}'.format(chrt_id),
+                'chrtId': chrt_id,
+                'barcode': str(2 * 10 ** 12 + chrt_id),
+                'addin': [{
+                    'type': 'Розничная цена',
+                    'params': [{'count': rnd.randint(100, 50000)}],
+                }],
+                'errors': None,
+            }],
+            'addin': [{
+                'type': 'Фото',
+                'params': [
+                    {'value': 'https://images.wbstatic.net/big/new/{}-{}.jpg'.format(chrt_id, i)}
+                    for i in range(rnd.randint(0, 5))
+                ],
+            }],
+        })
+    return {
+        'id': 'card-{}'.format(index),
+        'imtId': 10 ** 7 + index,
+        'supplierVendorCode': 'SKU{}'.format(index),
+        'object': rnd.choice(['Джинсы', 'Платья', 'Футболки']),
+        'addin': [
+            {'type': 'Наименование', 'params': [{'value': 'Товар {}'.format(index)}]},
+            {'type': 'Описание', 'params': [{'value': 'Описание товара {}'.format(index)}]},
+            {'type': 'Бренд', 'params': [{'value': rnd.choice(['ЛОГОС', 'ТЕСТ'])}]},
+        ],
+        'nomenclatures': nomenclatures,
+        'createdAt': (updated_at - datetime.timedelta(days=30)).isoformat() + 'Z',
+        'updatedAt': updated_at.isoformat() + 'Z',
+    }
+
+
+def legacy_join_order_items(order_items, sales_df, orders_statuses):
+    """
+        Исходная построчная реализация сопоставления заказов,
+        эталон для проверки эквивалентности и бенчмарка.
+    """
+    import pandas as pd
+    import simplejson
+
+    orders_statuses_df = pd.DataFrame.from_records(
+        data=orders_statuses,
+        columns=['order_id', 'status'],
+    )
+
+    order_items_df = pd.DataFrame.from_records(order_items, index='rid') \
+        .merge(sales_df, on='rid', how='left') \
+        .merge(orders_statuses_df, on='order_id', how='left')
+    order_items_df['total_price'] = order_items_df['total_price'].apply(lambda x: x / 100)
+    order_items_df['status_x'] = order_items_df['status_x'].fillna(0)
+    order_items_df['status_y'] = order_items_df['status_y'].fillna(0)
+    order_items_df['status'] = order_items_df \
+        .apply(lambda x: '%s%s' % (int(x['status_x']), int(x['status_y'])), axis=1)
+    order_items_df = order_items_df.drop(columns=[
+        'status_x', 'status_y',
+    ])
+
+    for order, order_items in order_items_df.groupby(by=joins.ORDER_GROUP_COLUMNS):
+        order_items = order_items.drop(columns=joins.ORDER_GROUP_COLUMNS)
+
+        order_items = order_items \
+            .groupby(by=joins.ORDER_ITEM_GROUP_COLUMNS, dropna=False) \
+            .agg({c: 'sum' for c in joins.ORDER_ITEM_FINANCIAL_COLUMNS}) \
+            .reset_index()
+
+        yield simplejson.loads(simplejson.dumps({
+            'order_id': int(order[0]),
+            'date_created': order[1],
+            'status': order[2],
+            'items': order_items.to_dict(orient='records')
+        } , ignore_nan=True))
+
+
+def make_join_input(order_items_count, seed=0):
+    """
+        Готовит входные данные стадии сопоставления так же,
+        как это делает fbs_order_list: позиции заказов,
+        колоночный буфер продаж и последние статусы.
+    """
+    orders, sales, statuses = make_order_payloads(order_items_count, seed=seed)
+    order_items = [
+        {
+            'date_created': order['date_created'],
+            'order_id': int(order['order_id']),
+            'wb_wh_id': order['wb_wh_id'],
+            'chrt_id': order_item['chrt_id'],
+            'status': order_item['status'],
+            'rid': int(order_item['rid']),
+            'total_price': order_item['total_price'],
+        }
+        for order in orders
+        for order_item in order['items']
+    ]
+    sales = {c: [sale.get(c) for sale in sales] for c in joins.SALES_COLUMNS}
+    orders_statuses = [
+        {'order_id': int(order['order_id']), 'status': order['items'][-1]['status']}
+        for order in statuses
+    ]
+    return order_items, sales, orders_statuses
@@ -0,0 +1,354 @@
+"""
+    Локальный стенд API Wildberries для офлайн-тестов и нагрузочных прогонов.
+
+    Отвечает на /card/list, /api/v1/orders, /api/public/v1/supply_tasks/status
+    и /api/v1/supplier/reportDetailByPeriod синтетическими данными из factories
+    любого объема, умеет добавлять задержку ответа и отвечать 429.
+
+    Запуск из корня проекта:
+        python -m wildberries.tests.fake_api --cards 100000 --order-items 100000
+
+    Команда печатает переменные окружения WB_*_BASE_API, которые
+    направляют wildberries.api на стенд.
+"""
+import argparse
+import bisect
+import contextlib
+import datetime
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import dateutil.parser
+
+from wildberries.tests.factories import (
+    iter_order_payloads, make_product_card_payload, product_card_chrt_id
+)
+
+
+# Константы wildberries.api, которые можно направить на стенд
+BASE_API_SETTINGS = (
+    'CONTENT_BASE_API',
+    'FBS_ORDERS_BASE_API',
+    'FBS_ORDERS_STATUSES_BASE_API',
+    'STATISTICS_BASE_API',
+)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Клиент может закрыть соединение, не дочитав ответ
+        # (проверка подключения с deadline), это не ошибка стенда
+        pass
+
+
+def _parse_datetime(value):
+    value = dateutil.parser.isoparse(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+class FakeWildberriesAPI(object):
+    """
+        Стенд API Wildberries в отдельном потоке.
+            Аргументы:
+                cards (int): Количество карточек товаров в каталоге.
+                order_items (int): Примерное количество позиций заказов.
+                seed (int): Зерно генератора данных.
+                from_datetime (datetime): Начало периода заказов.
+                days (int): Длина периода заказов в днях.
+                latency (float): Задержка каждого ответа в секундах.
+                throttle_rate (float): Доля запросов, на которые
+                                       стенд отвечает 429.
+    """
+
+    def __init__(self, cards=1000, order_items=1000, seed=0,
+                 from_datetime=datetime.datetime(2021, 4, 1), days=30,
+                 latency=0, throttle_rate=0, host='127.0.0.1', port=0):
+        self.cards = cards
+        self.order_items = order_items
+        self.seed = seed
+        self.from_datetime = from_datetime
+        self.days = days
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.host = host
+        self.port = port
+
+        # Ответы /card/list с ошибкой: offset -> (код ответа, тело в JSON)
+        self.page_errors = {}
+
+        self.requests_count = 0
+        self.throttled_count = 0
+        # Сколько запросов обрабатывалось одновременно: сейчас и максимум
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._server = None
+        self._orders = None
+        self._orders_created_at = None
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self._server.server_address[:2])
+
+    def environ(self):
+        """
+            Переменные окружения, которые направляют wildberries.api на стенд.
+        """
+        return {'WB_' + name: self.url for name in BASE_API_SETTINGS}
+
+    def point_api(self):
+        """
+            Направляет константы wildberries.api на стенд в текущем процессе.
+            Возвращает прежние значения для восстановления.
+        """
+        from wildberries import api
+
+        previous = {name: getattr(api, name) for name in BASE_API_SETTINGS}
+        for name in BASE_API_SETTINGS:
+            setattr(api, name, self.url)
+        return previous
+
+    def _iter_order_payloads(self):
+        return iter_order_payloads(
+            self.order_items, seed=self.seed, from_datetime=self.from_datetime,
+            days=self.days,
+            chrt_ids=[product_card_chrt_id(index) for index in range(max(1, self.cards))])
+
+    def _build_orders(self):
+        """
+            Заказы и статусы хранятся сериализованными и отсортированными
+            по дате создания, чтобы быстро отдавать любое окно периода.
+            Продажи не хранятся, а генерируются заново при каждом запросе.
+        """
+        orders = []
+        for order, _, status in self._iter_order_payloads():
+            orders.append((
+                _parse_datetime(order['date_created']),
+                json.dumps(order).encode('utf-8'),
+                json.dumps(status).encode('utf-8') if status is not None else None,
+            ))
+        orders.sort(key=lambda order: order[0])
+        self._orders = orders
+        self._orders_created_at = [order[0] for order in orders]
+
+    def start(self):
+        self._build_orders()
+        self._server = _Server((self.host, self.port), _make_handler(self))
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @contextlib.contextmanager
+    def track_request(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def should_throttle(self):
+        with self._lock:
+            self.requests_count += 1
+            if self.throttle_rate and self._random.random() < self.throttle_rate:
+                self.throttled_count += 1
+                return True
+        return False
+
+    def product_page(self, offset, limit, order=None):
+        indexes = range(offset, min(offset + limit, self.cards))
+        if order and order.get('column') == 'updatedAt' and order.get('order') == 'asc':
+            # Каталог хранится от новых карточек к старым
+            indexes = [self.cards - 1 - index for index in indexes]
+        return {
+            'cards': [make_product_card_payload(index, seed=self.seed) for index in indexes],
+            'cursor': {'offset': offset, 'limit': limit, 'total': self.cards},
+        }
+
+    def _window(self, date_start, date_end):
+        start = bisect.bisect_left(self._orders_created_at, date_start)
+        end = bisect.bisect_right(self._orders_created_at, date_end)
+        return self._orders[start:end]
+
+    def orders(self, date_start, date_end):
+        return [order for _, order, _ in self._window(date_start, date_end)]
+
+    def statuses(self, date_start, date_end):
+        return [status for _, _, status in self._window(date_start, date_end)
+                if status is not None]
+
+    def sales(self, date_from, date_to):
+        """
+            Строки отчета о продажах по заказам, созданным в периоде.
+        """
+        if not self._orders or date_from > self._orders_created_at[-1] \
+                or date_to < self._orders_created_at[0]:
+            return
+        for order, order_sales, _ in self._iter_order_payloads():
+            if date_from <= _parse_datetime(order['date_created']) <= date_to:
+                for sale in order_sales:
+                    yield json.dumps(sale).encode('utf-8')
+
+
+def _make_handler(fake_api):
+
+    class Handler(BaseHTTPRequestHandler):
+        # keep-alive, как у настоящего API
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json_array(self, items):
+            body = b'[' + b','.join(items) + b']'
+            self._send_body(body)
+
+        def _send_body(self, body, status=200):
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_chunked_json_array(self, items):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+
+            buffer = [b'[']
+            size = 0
+            separator = b''
+            for item in items:
+                buffer.append(separator)
+                buffer.append(item)
+                separator = b','
+                size += len(item) + 1
+                if size >= CHUNK_SIZE:
+                    self._write_chunk(b''.join(buffer))
+                    buffer = []
+                    size = 0
+            buffer.append(b']')
+            self._write_chunk(b''.join(buffer))
+            self.wfile.write(b'0\r\n\r\n')
+
+        def _write_chunk(self, data):
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+        def _prepare(self):
+            """
+                Задержка и ответ 429. Возвращает False, если ответ уже отправлен.
+            """
+            if fake_api.latency:
+                time.sleep(fake_api.latency)
+            if fake_api.should_throttle():
+                self.send_response(429)
+                self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return False
+            return True
+
+        def do_POST(self):
+            with fake_api.track_request():
+                self._do_POST()
+
+        def do_GET(self):
+            with fake_api.track_request():
+                self._do_GET()
+
+        def _do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if not self._prepare():
+                return
+            if urlsplit(self.path).path != '/card/list':
+                return self._send_body(b'{"error": "not found"}', status=404)
+
+            request_data = json.loads(body)
+            params = request_data['params']
+            offset = params['query']['offset']
+            if offset in fake_api.page_errors:
+                status, error = fake_api.page_errors[offset]
+                return self._send_body(json.dumps(error).encode('utf-8'), status=status)
+
+            result = fake_api.product_page(
+                offset, params['query']['limit'],
+                order=params.get('filter', {}).get('order'))
+            self._send_body(json.dumps({
+                'id': request_data.get('id'), 'jsonrpc': '2.0', 'result': result,
+            }).encode('utf-8'))
+
+        def _do_GET(self):
+            if not self._prepare():
+                return
+            url = urlsplit(self.path)
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+            if url.path == '/api/v1/orders':
+                self._send_json_array(fake_api.orders(
+                    _parse_datetime(query['date_start']), _parse_datetime(query['date_end'])))
+            elif url.path == '/api/public/v1/supply_tasks/status':
+                self._send_json_array(fake_api.statuses(
+                    _parse_datetime(query['date_start']), _parse_datetime(query['date_end'])))
+            elif url.path == '/api/v1/supplier/reportDetailByPeriod':
+                self._send_chunked_json_array(fake_api.sales(
+                    _parse_datetime(query['dateFrom']), _parse_datetime(query['dateTo'])))
+            else:
+                self._send_body(b'{"error": "not found"}', status=404)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cards', type=int, default=1000,
+                        help='Количество карточек товаров')
+    parser.add_argument('--order-items', type=int, default=1000,
+                        help='Примерное количество позиций заказов')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Задержка каждого ответа в секундах')
+    parser.add_argument('--throttle-rate', type=float, default=0,
+                        help='Доля запросов, на которые отвечать 429')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+
+    fake_api = FakeWildberriesAPI(
+        cards=args.cards, order_items=args.order_items, seed=args.seed,
+        latency=args.latency, throttle_rate=args.throttle_rate,
+        host=args.host, port=args.port)
+    with fake_api:
+        for name, value in sorted(fake_api.environ().items()):
+            print('export {}={}'.format(name, value))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
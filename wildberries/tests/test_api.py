@@ -1,42 +1,120 @@
 import datetime
+import time
 
+import pytest
 from pytz import timezone
 
-from wildberries.consts import (
-    CONTENT_API_AUTHORIZATION_TOKEN, SUPPLIER_ID,
-    STATISTICS_API_KEY, ORDERS_API_TOKEN
+from wildberries import api
+from wildberries.api import (
+    ProductPageError, check_connection, fbs_order_list, probe_connection, product_list
 )
-from wildberries.api import check_connection, product_list, fbs_order_list
+from wildberries.tests.factories import PRODUCT_CARDS_UPDATED_AT, make_product_card_payload
 
 
-ACCESS = {
-    "CONTENT_API_AUTHORIZATION_TOKEN": CONTENT_API_AUTHORIZATION_TOKEN,
-    "SUPPLIER_ID": SUPPLIER_ID,
-    "STATISTICS_API_KEY": STATISTICS_API_KEY,
-    "ORDERS_API_TOKEN": ORDERS_API_TOKEN
-}
+def test_check_connection(fake_api, access):
+    assert check_connection(access=access), "проверка подключения должна возвращать True"
 
-def test_check_connection():
-    assert check_connection(access=ACCESS), "проверка подключения должна возвращать True"
 
+def test_get_products_list_returns_cards(fake_api, access):
+    products = list(product_list(access=access))
+    assert len(products) == 120, "функция должна вернуть все карточки каталога"
 
-def test_get_products_list_returns_cards():
-    products = product_list(access=ACCESS)
-    assert list(products), "функция должна вернуть не пустой список товаров"
+
+def test_order_list(fake_api, access):
+    tz = timezone('UTC')
+    from_datetime = tz.localize(datetime.datetime(year=2021, month=4, day=1))
+    to_datetime = tz.localize(datetime.datetime(year=2021, month=5, day=1))
+    orders = list(fbs_order_list(access, from_datetime, to_datetime))
+    assert orders, "функция должна вернуть не пустой список заказов"
+    # Заказ с позициями в разных статусах возвращается по разу на каждый статус
+    assert len({order['order_id'] for order in orders}) == len(
+        fake_api.orders(from_datetime, to_datetime))
+
+
+def test_product_list_survives_throttling(fake_api, access):
+    fake_api.throttle_rate = 0.3
+    products = list(product_list(access=access, page_size=10, max_workers=4))
+    assert len(products) == 120
+    assert fake_api.throttled_count, "стенд должен был ответить 429"
 
 
-def test_order_list():
+def test_probe_connection_reports_each_endpoint(fake_api, access):
+    report = probe_connection(access=access)
+    assert [result['name'] for result in report] == [
+        'content', 'fbs_orders', 'fbs_orders_statuses', 'statistics']
+    for result in report:
+        assert result['ok'] and result['status_code'] == 200 and result['error'] is None
+        assert result['latency'] >= 0
+
+
+def test_probe_connection_respects_deadline(fake_api, access):
+    fake_api.latency = 1
+    started_at = time.monotonic()
+    report = probe_connection(access=access, deadline=0.2)
+    assert time.monotonic() - started_at < 0.9, "проверка должна укладываться в deadline"
+    assert not any(result['ok'] for result in report)
+    assert all(result['error'] for result in report)
+    assert not check_connection(access=access, deadline=0.2)
+
+
+def test_windowed_order_list_matches_single_request(fake_api, access):
     tz = timezone('UTC')
     from_datetime = tz.localize(datetime.datetime(year=2021, month=4, day=1))
-    to_datetime = tz.localize(datetime.datetime(year=2021, month=4, day=30))
-    orders = fbs_order_list(ACCESS, from_datetime, to_datetime)
-    assert list(orders), "функция должна вернуть не пустой список заказов"
+    to_datetime = tz.localize(datetime.datetime(year=2021, month=5, day=1))
+    single = list(fbs_order_list(access, from_datetime, to_datetime))
+    windowed = list(fbs_order_list(
+        access, from_datetime, to_datetime,
+        window=datetime.timedelta(days=3), max_workers=3))
+    assert windowed == single
+
+
+def make_order(order_id, status):
+    return {'order_id': order_id, 'date_created': '2021-04-0{}'.format(order_id),
+            'status': status, 'items': []}
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_order_on_window_boundary_is_taken_from_later_window(monkeypatch, access, ordered):
+    # Заказ 3 попал в оба окна, во втором окне у него другой статус
+    # и две записи по статусам позиций
+    windows = [
+        [make_order(1, '10'), make_order(3, '10')],
+        [make_order(2, '10'), make_order(3, '50'), make_order(3, '52')],
+    ]
+    monkeypatch.setattr(api, 'fbs_order_windows', lambda *args, **kwargs: (
+        (None, None, orders) for orders in windows))
+
+    orders = list(fbs_order_list(access, None, None, window=datetime.timedelta(days=1),
+                                 ordered=ordered))
+
+    assert orders == [make_order(1, '10'), make_order(2, '10'),
+                      make_order(3, '50'), make_order(3, '52')]
+
+
+def test_updated_product_list_returns_only_newer_cards(fake_api, access):
+    # Карточки с индексом 0..9 изменены позже отметки, 10-я - ровно в нее
+    updated_since = timezone('UTC').localize(
+        PRODUCT_CARDS_UPDATED_AT - datetime.timedelta(minutes=10))
+    products = list(product_list(access=access, page_size=4, updated_since=updated_since))
+    assert products == [make_product_card_payload(index) for index in range(10)]
+
+
+def test_failed_product_page_raises_product_page_error(fake_api, access):
+    fake_api.page_errors[50] = (500, {'error': 'internal error'})
+    with pytest.raises(ProductPageError) as excinfo:
+        list(product_list(access=access, page_size=50))
+    assert excinfo.value.offset == 50
+
 
+def test_product_page_without_result_raises_product_page_error(fake_api, access):
+    fake_api.page_errors[0] = (200, {'id': 1, 'jsonrpc': '2.0', 'error': {'message': 'bad'}})
+    with pytest.raises(ProductPageError):
+        list(product_list(access=access, page_size=50))
 
-tz = timezone('UTC')
-from_datetime = tz.localize(datetime.datetime(year=2021, month=4, day=1))
-to_datetime = tz.localize(datetime.datetime(year=2021, month=5, day=1))
-orders = list(fbs_order_list(ACCESS, from_datetime, to_datetime))
-# products = list(product_list(ACCESS))
 
-print()
\ No newline at end of file
+def test_concurrent_product_list_keeps_offset_order(fake_api, access):
+    fake_api.latency = 0.01
+    sequential = list(product_list(access=access, page_size=10))
+    concurrent = list(product_list(access=access, page_size=10, max_workers=4))
+    assert concurrent == sequential
+    assert fake_api.max_in_flight > 1, "страницы должны загружаться параллельно"
@@ -0,0 +1,77 @@
+import asyncio
+import datetime
+
+from pytz import timezone
+
+from wildberries import api, async_api
+
+
+async def collect(async_iterable):
+    return [item async for item in async_iterable]
+
+
+def test_async_check_connection(fake_api, access):
+    async def check():
+        async with async_api.AsyncClient() as client:
+            return await async_api.check_connection(client, access)
+
+    assert asyncio.run(check())
+
+
+def test_async_product_list_matches_sync(fake_api, access):
+    fake_api.throttle_rate = 0.1
+
+    async def load():
+        async with async_api.AsyncClient(max_concurrency=4) as client:
+            return await collect(async_api.product_list(
+                client, access, page_size=10, concurrency=4))
+
+    assert asyncio.run(load()) == list(api.product_list(access, page_size=10))
+
+
+def test_async_fbs_order_list_matches_sync(fake_api, access):
+    tz = timezone('UTC')
+    from_datetime = tz.localize(datetime.datetime(year=2021, month=4, day=1))
+    to_datetime = tz.localize(datetime.datetime(year=2021, month=5, day=1))
+    window = datetime.timedelta(days=7)
+    fake_api.throttle_rate = 0.1
+
+    async def load():
+        async with async_api.AsyncClient() as client:
+            return await collect(async_api.fbs_order_list(
+                client, access, from_datetime, to_datetime,
+                window=window, concurrency=3, join_backend='python'))
+
+    assert asyncio.run(load()) == list(api.fbs_order_list(
+        access, from_datetime, to_datetime, join_backend='python'))
+
+
+def test_async_product_list_bounds_concurrency(fake_api, access):
+    fake_api.latency = 0.05
+
+    async def load():
+        async with async_api.AsyncClient(max_concurrency=16) as client:
+            return await collect(async_api.product_list(
+                client, access, page_size=10, concurrency=2))
+
+    assert len(asyncio.run(load())) == 120
+    assert fake_api.max_in_flight <= 2, "страниц загружается больше, чем concurrency"
+
+
+def test_async_client_holds_concurrency_slot_until_body_is_read(fake_api, access):
+    _, method, base_url, path, kwargs = api._get_check_connection_requests(access)[0]
+
+    async def load():
+        async with async_api.AsyncClient(max_concurrency=1) as client:
+            async def request():
+                async with client.request(method, base_url, path, **kwargs) as response:
+                    await response.read()
+
+            async with client.request(method, base_url, path, **kwargs):
+                other = asyncio.ensure_future(request())
+                await asyncio.sleep(0.1)
+                requests_count = fake_api.requests_count
+            await other
+            return requests_count
+
+    assert asyncio.run(load()) == 1, "второй запрос не должен начинаться до чтения первого"
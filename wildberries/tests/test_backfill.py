@@ -0,0 +1,48 @@
+import datetime
+
+import pytest
+from pytz import timezone
+
+from wildberries import api, backfill, utils
+from wildberries.models import OrderItem, Store
+
+
+@pytest.fixture
+def fbs_orders(fake_api, access):
+    tz = timezone('UTC')
+    return list(api.fbs_order_list(
+        access, tz.localize(datetime.datetime(2021, 4, 1)), tz.localize(datetime.datetime(2021, 5, 1))))
+
+
+def snapshot(store):
+    orders = set(store.orders.values_list(
+        'number', 'created_at', 'status', 'posting_type', 'raw_data_checksum'))
+    items = set(OrderItem.objects.filter(order__store=store).values_list(
+        'order__number', 'wildberries_character_id', 'quantity', 'price', 'commission',
+        'delivery_cost', 'raw_product_data_checksum', 'product_card__wildberries_character_id'))
+    return orders, items
+
+
+def test_backfill_matches_batch_ingestion(db, fbs_orders):
+    ingested = Store.objects.create(name='ingested')
+    utils.make_fbs_orders(ingested, fbs_orders)
+    backfilled = Store.objects.create(name='backfilled')
+    result = backfill.backfill_orders(backfilled, iter(fbs_orders))
+
+    assert result['staged'] == len(fbs_orders)
+    assert snapshot(backfilled) == snapshot(ingested)
+    assert backfilled.product_cards.count() == ingested.product_cards.count()
+
+
+def test_backfill_is_idempotent(db, fbs_orders):
+    store = Store.objects.create(name='test')
+    progress = []
+    backfill.backfill_orders(store, fbs_orders)
+    before = snapshot(store)
+
+    result = backfill.backfill_orders(
+        store, fbs_orders, progress=lambda *args: progress.append(args))
+    assert result['orders'] == result['order_items'] == result['product_cards'] == 0
+    assert result['payloads'] == 0
+    assert snapshot(store) == before
+    assert [step for step, _, _ in progress] == ['copy', 'payloads', 'orders', 'product_cards', 'order_items']
@@ -0,0 +1,202 @@
+import datetime
+import json
+
+import psycopg2
+import pytest
+from django.core.management import CommandError, call_command
+from django.db import connection
+from pytz import timezone
+
+from wildberries.api import ProductPageError
+from wildberries import api, utils
+from wildberries.management.commands.sync_stores import get_enabled_stores, sync_store
+from wildberries.models import ProductCard, Store, SyncCheckpoint
+from wildberries.tests.factories import PRODUCT_CARDS_UPDATED_AT
+
+
+@pytest.fixture
+def store(db):
+    return Store.objects.create(name='test', wildberries_supplier_id='supplier-id',
+                                opening_date=datetime.date(2021, 4, 1))
+
+
+def test_incremental_make_products_loads_cards_newer_than_watermark(fake_api, store):
+    watermark = timezone('UTC').localize(
+        PRODUCT_CARDS_UPDATED_AT - datetime.timedelta(minutes=10))
+    store.last_download_products = watermark
+    store.save()
+
+    call_command('make_products', store=store.id, incremental=True)
+
+    # Каждая номенклатура карточки API - отдельная ProductCard
+    loaded = set(ProductCard.objects.filter(store=store)
+                 .values_list('wildberries_product_id', flat=True))
+    assert loaded == {'card-{}'.format(index) for index in range(10)}
+    store.refresh_from_db()
+    assert store.last_download_products > watermark, "отметка должна сдвинуться вперед"
+
+
+def test_make_products_keeps_watermark_after_page_error(fake_api, store):
+    watermark = timezone('UTC').localize(
+        PRODUCT_CARDS_UPDATED_AT - datetime.timedelta(minutes=10))
+    store.last_download_products = watermark
+    store.save()
+    fake_api.page_errors[0] = (500, {'error': 'internal error'})
+
+    with pytest.raises(ProductPageError):
+        call_command('make_products', store=store.id, incremental=True)
+
+    store.refresh_from_db()
+    assert store.last_download_products == watermark, "отметка не должна сдвигаться"
+
+
+def test_make_orders_loads_orders_from_api(fake_api, store):
+    call_command('make_orders', store=store.id, batch_size=50)
+
+    tz = timezone('UTC')
+    orders = fake_api.orders(tz.localize(datetime.datetime(2021, 4, 1)),
+                             tz.localize(datetime.datetime(2021, 5, 1)))
+    assert set(store.orders.values_list('number', flat=True)) == {
+        json.loads(order)['order_id'] for order in orders}
+    store.refresh_from_db()
+    assert store.last_download_wildberries_fbs_orders is not None
+
+
+def test_make_orders_loads_date_range(fake_api, store):
+    tz = timezone('UTC')
+    date_from = tz.localize(datetime.datetime(2021, 4, 10))
+    date_to = tz.localize(datetime.datetime(2021, 4, 20))
+
+    call_command('make_orders', store=store.id, date_from=date_from, date_to=date_to)
+
+    orders = fake_api.orders(date_from, date_to)
+    assert set(store.orders.values_list('number', flat=True)) == {
+        str(json.loads(order)['order_id']) for order in orders}
+    # Период не продолжает загруженный, отметка не сдвигается
+    store.refresh_from_db()
+    assert store.last_download_wildberries_fbs_orders is None
+
+
+def test_make_orders_starts_before_last_download(fake_api, store):
+    tz = timezone('UTC')
+    store.last_download_wildberries_fbs_orders = tz.localize(datetime.datetime(2021, 5, 1))
+    store.save()
+    date_to = tz.localize(datetime.datetime(2021, 5, 2))
+
+    call_command('make_orders', store=store.id, date_to=date_to)
+
+    orders = fake_api.orders(store.last_download_wildberries_fbs_orders - api.CLOSED_WINDOW_DELAY,
+                             date_to)
+    assert store.orders.count() == len({json.loads(order)['order_id'] for order in orders})
+    store.refresh_from_db()
+    assert store.last_download_wildberries_fbs_orders == date_to
+
+
+def test_make_orders_requires_date_from_for_new_store(fake_api, store):
+    store.opening_date = None
+    store.save()
+
+    with pytest.raises(CommandError):
+        call_command('make_orders', store=store.id)
+
+
+def test_make_products_resumes_after_page_error(fake_api, store):
+    fake_api.page_errors[100] = (500, {'error': 'internal error'})
+
+    with pytest.raises(ProductPageError):
+        call_command('make_products', store=store.id, batch_size=50)
+
+    checkpoint = store.sync_checkpoints.get(sync_type=SyncCheckpoint.PRODUCTS)
+    assert checkpoint.offset == 100
+    loaded = set(ProductCard.objects.filter(store=store)
+                 .values_list('wildberries_product_id', flat=True))
+    assert loaded == {'card-{}'.format(index) for index in range(100)}
+
+    # Сохраненные страницы повторно не запрашиваются
+    fake_api.page_errors = {50: (500, {'error': 'internal error'})}
+    call_command('make_products', store=store.id, batch_size=50, resume=True)
+
+    loaded = list(ProductCard.objects.filter(store=store)
+                  .values_list('wildberries_product_id', 'wildberries_character_id'))
+    assert len(loaded) == len(set(loaded)), "карточки не должны дублироваться"
+    assert {product_id for product_id, _ in loaded} == {
+        'card-{}'.format(index) for index in range(120)}
+    store.refresh_from_db()
+    assert store.last_download_products == checkpoint.started_at
+    assert not store.sync_checkpoints.exists()
+
+
+def test_make_products_does_not_resume_incremental_sync(store):
+    with pytest.raises(CommandError):
+        call_command('make_products', store=store.id, incremental=True, resume=True)
+
+
+def test_make_orders_saves_checkpoint_after_each_window(fake_api, store, monkeypatch):
+    make_fbs_orders = utils.make_fbs_orders
+    calls = []
+
+    def fail_on_second_window(store, orders, **kwargs):
+        calls.append(len(orders))
+        if len(calls) > 1:
+            raise RuntimeError('обрыв загрузки')
+        return make_fbs_orders(store, orders, **kwargs)
+
+    monkeypatch.setattr(utils, 'make_fbs_orders', fail_on_second_window)
+    with pytest.raises(RuntimeError):
+        call_command('make_orders', store=store.id, window_days=7, batch_size=1000,
+                     date_to=timezone('UTC').localize(datetime.datetime(2021, 5, 1)))
+
+    tz = timezone('UTC')
+    checkpoint = store.sync_checkpoints.get(sync_type=SyncCheckpoint.ORDERS)
+    assert checkpoint.position == tz.localize(datetime.datetime(2021, 4, 8))
+
+
+def test_make_orders_resumes_from_checkpoint(fake_api, store):
+    tz = timezone('UTC')
+    position = tz.localize(datetime.datetime(2021, 4, 15))
+    SyncCheckpoint.objects.create(store=store, sync_type=SyncCheckpoint.ORDERS,
+                                  position=position, started_at=position)
+
+    call_command('make_orders', store=store.id, window_days=7, resume=True,
+                 date_to=tz.localize(datetime.datetime(2021, 5, 1)))
+
+    orders = fake_api.orders(position, tz.localize(datetime.datetime(2021, 5, 1)))
+    assert set(store.orders.values_list('number', flat=True)) == {
+        str(json.loads(order)['order_id']) for order in orders}
+    assert not store.sync_checkpoints.exists()
+
+
+def test_enabled_stores_skip_disabled_and_without_access(db):
+    enabled = Store.objects.create(name='enabled', wildberries_supplier_id='supplier-id')
+    Store.objects.create(name='disabled', wildberries_supplier_id='supplier-id',
+                         disabled_at=timezone('UTC').localize(datetime.datetime(2021, 4, 1)))
+    Store.objects.create(name='failed', wildberries_supplier_id='supplier-id',
+                         disabled_reason=Store.CONNECT_FAILED_OZON_API)
+    Store.objects.create(name='ozon only')
+
+    assert list(get_enabled_stores()) == [enabled]
+
+
+def test_sync_store_reports_missing_store_as_failed(db):
+    result = sync_store(0, {'incremental': False, 'resume': False, 'window_days': None})
+
+    assert result['status'] == 'failed'
+    assert result['error'].startswith('DoesNotExist')
+
+
+def test_sync_stores_skips_store_locked_by_another_session(fake_api, store):
+    other = Store.objects.create(name='other', wildberries_supplier_id='supplier-id')
+    connection_params = connection.get_connection_params()
+
+    # Блокировку держит другое соединение, как другой процесс синхронизации
+    with psycopg2.connect(**connection_params) as other_connection:
+        with other_connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s, %s)',
+                           [utils.STORE_SYNC_LOCK_NAMESPACE, other.id])
+        call_command('sync_stores', workers=1)
+    other_connection.close()
+
+    assert store.product_cards.exists()
+    assert store.orders.exists()
+    assert not other.product_cards.exists()
+    assert not other.orders.exists()
@@ -0,0 +1,88 @@
+import datetime
+
+import pytest
+from django.core.management import call_command
+from pytz import timezone
+
+from wildberries import deletion
+from wildberries.models import Order, OrderItem, ProductCard, ProductCardImage, Store
+
+
+tz = timezone('UTC')
+
+
+@pytest.fixture
+def store(db):
+    return Store.objects.create(name='test')
+
+
+def make_order(store, number, day):
+    order = Order.objects.create(store=store, number=number,
+                                 created_at=tz.localize(datetime.datetime(2021, 4, day)))
+    OrderItem.objects.create(order=order, wildberries_character_id=1)
+    OrderItem.objects.create(order=order, wildberries_character_id=2)
+    return order
+
+
+def make_card(store, chrt_id, day=1):
+    product_card = ProductCard.objects.create(
+        store=store, wildberries_character_id=chrt_id,
+        created_at=tz.localize(datetime.datetime(2021, 4, day)))
+    product_card.image = ProductCardImage.objects.create(product_card=product_card,
+                                                         remote_file_url='a.jpg')
+    product_card.save()
+    return product_card
+
+
+def test_delete_orders_by_store_and_date(store):
+    other_store = Store.objects.create(name='other')
+    kept = [make_order(store, '1', 1), make_order(other_store, '2', 10)]
+    for index in range(5):
+        make_order(store, str(10 + index), 10 + index)
+
+    progress = []
+    result = deletion.delete_orders(
+        deletion.filter_by_store_and_date(
+            Order.objects.all(), store, tz.localize(datetime.datetime(2021, 4, 5)), None),
+        batch_size=2, progress=lambda *args: progress.append(args))
+
+    assert result == {'orders': 5, 'order_items': 10}
+    assert [deleted for deleted, _ in progress] == [2, 4, 5]
+    assert set(Order.objects.values_list('id', flat=True)) == {order.id for order in kept}
+    assert OrderItem.objects.count() == 4
+
+
+def test_delete_product_cards_unlinks_references(store):
+    deleted = make_card(store, 1)
+    kept = make_card(store, 2, day=20)
+    kept.image = deleted.image
+    kept.save()
+    order = Order.objects.create(store=store, number='1')
+    item = OrderItem.objects.create(order=order, product_card=deleted, wildberries_character_id=1)
+
+    queryset = deletion.filter_by_store_and_date(
+        ProductCard.objects.all(), store, date_to=tz.localize(datetime.datetime(2021, 4, 10)))
+    assert deletion.count_product_cards(queryset) == {
+        'product_cards': 1, 'images': 1, 'order_items': 1, 'main_images': 1}
+    result = deletion.delete_product_cards(queryset)
+
+    assert result == {'product_cards': 1, 'images': 1, 'order_items': 1, 'main_images': 1}
+    assert list(ProductCard.objects.values_list('id', flat=True)) == [kept.id]
+    item.refresh_from_db()
+    kept.refresh_from_db()
+    assert item.product_card_id is None and kept.image_id is None
+    assert kept.images.count() == 1
+
+
+def test_delete_commands_dry_run_keeps_records(store):
+    make_order(store, '1', 1)
+    make_card(store, 1)
+
+    call_command('delete_orders', store=store.id, dry_run=True)
+    call_command('delete_products', store=store.id, dry_run=True)
+    assert Order.objects.count() == 1 and ProductCard.objects.count() == 1
+
+    call_command('delete_orders', store=store.id)
+    call_command('delete_products', store=store.id)
+    assert not Order.objects.exists() and not ProductCard.objects.exists()
+    assert not OrderItem.objects.exists() and not ProductCardImage.objects.exists()
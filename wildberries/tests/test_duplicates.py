@@ -0,0 +1,71 @@
+import pytest
+from django.core.management import call_command
+from django.db import connection
+
+from wildberries import duplicates
+from wildberries.models import Order, OrderItem, ProductCard, ProductCardImage, Store
+
+
+UNIQUE_CONSTRAINT = 'wildberries_productcard_store_chrt_id_uniq'
+
+
+@pytest.fixture
+def store(db):
+    # Дубликаты можно создать только без ограничения уникальности,
+    # оно вернется при откате транзакции теста
+    with connection.cursor() as cursor:
+        cursor.execute('ALTER TABLE wildberries_productcard DROP CONSTRAINT {}'.format(
+            UNIQUE_CONSTRAINT))
+    return Store.objects.create(name='test')
+
+
+def make_card(store, chrt_id, urls=()):
+    product_card = ProductCard.objects.create(store=store, wildberries_character_id=chrt_id)
+    images = [ProductCardImage.objects.create(product_card=product_card, remote_file_url=url)
+              for url in urls]
+    if images:
+        product_card.image = images[0]
+        product_card.save()
+    return product_card
+
+
+def test_merge_duplicate_product_cards(store):
+    kept = make_card(store, 1)
+    duplicate = make_card(store, 1, ['a.jpg', 'b.jpg'])
+    later_duplicate = make_card(store, 1, ['b.jpg', 'c.jpg'])
+    other = make_card(store, 2, ['a.jpg'])
+    order = Order.objects.create(store=store, number='1')
+    item = OrderItem.objects.create(order=order, product_card=later_duplicate,
+                                    wildberries_character_id=1)
+
+    result = duplicates.merge_duplicate_product_cards()
+
+    assert result['product_cards'] == 2
+    assert result['duplicate_images'] == 1
+    assert list(store.product_cards.order_by('id').values_list('id', flat=True)) == [
+        kept.id, other.id]
+    item.refresh_from_db()
+    assert item.product_card_id == kept.id
+    kept.refresh_from_db()
+    assert sorted(kept.images.values_list('remote_file_url', flat=True)) == [
+        'a.jpg', 'b.jpg', 'c.jpg']
+    assert kept.image.remote_file_url == 'a.jpg'
+    assert other.images.count() == 1
+
+    # Ограничение уникальности снова можно добавить
+    with connection.cursor() as cursor:
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(
+            'ALTER TABLE wildberries_productcard ADD CONSTRAINT {} '
+            'UNIQUE (store_id, wildberries_character_id)'.format(UNIQUE_CONSTRAINT))
+
+
+def test_merge_duplicates_dry_run_keeps_cards(store):
+    make_card(store, 1)
+    make_card(store, 1)
+
+    call_command('merge_duplicates', dry_run=True)
+    assert store.product_cards.count() == 2
+
+    call_command('merge_duplicates')
+    assert store.product_cards.count() == 1
@@ -0,0 +1,120 @@
+"""
+    Миграции с переносом данных: схема откатывается до миграции
+    и снова накатывается в транзакции теста.
+"""
+import datetime
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.utils import timezone
+
+from wildberries.models import get_payload_checksum, pack_payload
+
+
+def migrate(target):
+    """
+        Переводит схему на миграцию target.
+            Возвращает:
+                apps: Исторические модели на момент target.
+    """
+    executor = MigrationExecutor(connection)
+    executor.migrate([('wildberries', target)])
+    executor.loader.build_graph()
+    return executor.loader.project_state([('wildberries', target)]).apps
+
+
+def test_order_duplicates_are_merged(db):
+    apps = migrate('0001_initial')
+    store = apps.get_model('wildberries', 'Store').objects.create(name='test')
+    Order = apps.get_model('wildberries', 'Order')
+    OrderItem = apps.get_model('wildberries', 'OrderItem')
+    kept = Order.objects.create(store=store, number='1')
+    duplicate = Order.objects.create(store=store, number='1')
+    now = timezone.now()
+    stale_item = OrderItem.objects.create(order=kept, wildberries_character_id=1, quantity=1,
+                                          updated_at=now - datetime.timedelta(days=1))
+    fresh_item = OrderItem.objects.create(order=duplicate, wildberries_character_id=1,
+                                          quantity=2, updated_at=now)
+    moved_item = OrderItem.objects.create(order=duplicate, wildberries_character_id=2)
+
+    apps = migrate('0002_order_unique_keys')
+    Order = apps.get_model('wildberries', 'Order')
+    OrderItem = apps.get_model('wildberries', 'OrderItem')
+    assert list(Order.objects.values_list('id', flat=True)) == [kept.id]
+    items = OrderItem.objects.order_by('wildberries_character_id')
+    assert [(item.id, item.order_id, item.quantity) for item in items] == [
+        (fresh_item.id, kept.id, 2), (moved_item.id, kept.id, 0)]
+    assert not OrderItem.objects.filter(pk=stale_item.pk).exists()
+
+
+def test_payload_checksums(db):
+    apps = migrate('0002_order_unique_keys')
+    store = apps.get_model('wildberries', 'Store').objects.create(name='test')
+    raw_data = {'id': 1, 'status': 'new', 'items': [{'chrtId': 2}]}
+    order = apps.get_model('wildberries', 'Order').objects.create(
+        store=store, number='1', raw_data=raw_data)
+
+    apps = migrate('0003_payload_checksums')
+    Order = apps.get_model('wildberries', 'Order')
+    assert Order.objects.get(pk=order.pk).raw_data_checksum == get_payload_checksum(raw_data)
+
+
+def test_legacy_access_is_copied_to_first_store(db, monkeypatch):
+    apps = migrate('0005_sync_checkpoint')
+    Store = apps.get_model('wildberries', 'Store')
+    # Последовательность id не откатывается вместе с транзакцией
+    store = Store.objects.create(pk=1, name='test')
+    monkeypatch.setenv('WB_SUPPLIER_ID', 'supplier-id')
+    monkeypatch.setenv('WB_ORDERS_API_TOKEN', 'orders-token')
+
+    apps = migrate('0006_store_wildberries_access')
+    store = apps.get_model('wildberries', 'Store').objects.get(pk=store.pk)
+    assert store.wildberries_supplier_id == 'supplier-id'
+    assert store.wildberries_orders_api_token == 'orders-token'
+
+
+def test_legacy_access_without_first_store(db):
+    apps = migrate('0005_sync_checkpoint')
+    apps.get_model('wildberries', 'Store').objects.filter(pk=1).delete()
+
+    apps = migrate('0006_store_wildberries_access')
+    assert not apps.get_model('wildberries', 'Store').objects.filter(pk=1).exists()
+
+
+def test_raw_payload_archive(db):
+    apps = migrate('0006_store_wildberries_access')
+    store = apps.get_model('wildberries', 'Store').objects.create(name='test')
+    ProductCard = apps.get_model('wildberries', 'ProductCard')
+    raw_data = {'chrtId': 1, 'price': 10}
+    product_card = ProductCard.objects.create(store=store, raw_data=raw_data)
+    empty_product_card = ProductCard.objects.create(store=store, raw_data={})
+
+    apps = migrate('0007_raw_payload_archive')
+    RawPayload = apps.get_model('wildberries', 'RawPayload')
+    ProductCard = apps.get_model('wildberries', 'ProductCard')
+    checksum, data, size = pack_payload(raw_data)
+    assert ProductCard.objects.get(pk=product_card.pk).raw_data_checksum == checksum
+    assert ProductCard.objects.get(pk=empty_product_card.pk).raw_data_checksum == ''
+    payload = RawPayload.objects.get()
+    assert (payload.checksum, bytes(payload.data), payload.size) == (checksum, data, size)
+
+    apps = migrate('0006_store_wildberries_access')
+    ProductCard = apps.get_model('wildberries', 'ProductCard')
+    assert ProductCard.objects.get(pk=product_card.pk).raw_data == raw_data
+
+
+def test_product_card_duplicates_are_merged(db):
+    apps = migrate('0007_raw_payload_archive')
+    store = apps.get_model('wildberries', 'Store').objects.create(name='test')
+    ProductCard = apps.get_model('wildberries', 'ProductCard')
+    kept = ProductCard.objects.create(store=store, wildberries_character_id=1)
+    duplicate = ProductCard.objects.create(store=store, wildberries_character_id=1)
+    order = apps.get_model('wildberries', 'Order').objects.create(store=store, number='1')
+    item = apps.get_model('wildberries', 'OrderItem').objects.create(
+        order=order, product_card=duplicate, wildberries_character_id=1)
+
+    apps = migrate('0008_product_card_unique_keys')
+    ProductCard = apps.get_model('wildberries', 'ProductCard')
+    assert list(ProductCard.objects.values_list('id', flat=True)) == [kept.id]
+    OrderItem = apps.get_model('wildberries', 'OrderItem')
+    assert OrderItem.objects.get(pk=item.pk).product_card_id == kept.id
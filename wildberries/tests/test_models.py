@@ -0,0 +1,54 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from wildberries.models import ProductCard, RawPayload, RawPayloadVersion, Store
+
+
+@pytest.fixture
+def store(db):
+    return Store.objects.create(name='test')
+
+
+def make_product_card(store, chrt_id, raw_data):
+    product_card = ProductCard(store=store, wildberries_character_id=chrt_id,
+                               sku='sku', name='name', price=0)
+    product_card.raw_data = raw_data
+    product_card.save()
+    return product_card
+
+
+def test_archived_payload_is_loaded_lazily(store):
+    raw_data = {'chrtId': 1, 'addin': [{'type': 'Наименование', 'value': 'x' * 1000}]}
+    product_card_id = make_product_card(store, 1, raw_data).id
+
+    product_card = ProductCard.objects.get(pk=product_card_id)
+    with CaptureQueriesContext(connection) as queries:
+        assert product_card.raw_data == raw_data
+        assert product_card.raw_data == raw_data
+    assert len(queries) == 1
+    payload = RawPayload.objects.get(checksum=product_card.raw_data_checksum)
+    assert len(payload.data) < payload.size
+
+
+def test_same_payload_is_archived_once(store):
+    raw_data = {'chrtId': 1}
+    make_product_card(store, 1, raw_data)
+    make_product_card(store, 2, raw_data)
+
+    assert RawPayload.objects.count() == 1
+    assert RawPayloadVersion.objects.filter(model='productcard').count() == 2
+
+
+def test_previous_payload_versions_are_kept(store):
+    product_card = make_product_card(store, 1, {'chrtId': 1, 'price': 10})
+    old_checksum = product_card.raw_data_checksum
+    product_card.raw_data = {'chrtId': 1, 'price': 20}
+    product_card.save()
+    product_card.save()
+
+    versions = RawPayloadVersion.objects.filter(
+        model='productcard', object_id=product_card.id, field='raw_data')
+    assert list(versions.order_by('id').values_list('payload', flat=True)) == [
+        old_checksum, product_card.raw_data_checksum]
+    assert RawPayload.objects.get(checksum=old_checksum).payload == {'chrtId': 1, 'price': 10}
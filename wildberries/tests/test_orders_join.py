@@ -0,0 +1,38 @@
+import json
+
+from wildberries import joins
+from wildberries.tests.factories import legacy_join_order_items, make_join_input
+
+
+def run_join(backend, order_items, sales, orders_statuses):
+    make_sales_index, join = joins.JOIN_BACKENDS[backend]
+    return list(join(order_items, make_sales_index(sales), orders_statuses))
+
+
+def test_pandas_join_matches_legacy_implementation():
+    for seed in range(2):
+        order_items, sales, orders_statuses = make_join_input(1000, seed=seed)
+        expected = list(legacy_join_order_items(
+            order_items, joins.pandas_sales_index(sales), orders_statuses))
+        result = run_join('pandas', order_items, sales, orders_statuses)
+        # Сравнение через JSON проверяет и типы значений (1 и 1.0)
+        assert json.dumps(result) == json.dumps(expected)
+
+
+def test_python_join_matches_pandas_join():
+    for seed in range(3):
+        order_items, sales, orders_statuses = make_join_input(5000, seed=seed)
+        expected = run_join('pandas', order_items, sales, orders_statuses)
+        result = run_join('python', order_items, sales, orders_statuses)
+        assert json.dumps(result) == json.dumps(expected)
+
+
+def test_joins_replace_nan_with_none():
+    order_items, sales, orders_statuses = make_join_input(500)
+    no_sales = {column: [] for column in joins.SALES_COLUMNS}
+    for backend in joins.JOIN_BACKENDS:
+        for order in run_join(backend, order_items, no_sales, []):
+            assert order['status'].endswith('0')
+            for order_item in order['items']:
+                assert order_item['nm_id'] is None
+                assert order_item['for_pay'] == 0
@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Тяжелые зависимости, которые должны загружаться только там, где нужны
+HEAVY_MODULES = ['pandas', 'numpy', 'requests']
+
+# Бюджет времени импорта wildberries.api в микросекундах (python -X importtime)
+API_IMPORT_BUDGET_US = 100000
+
+
+def run_python(code):
+    env = dict(
+        os.environ,
+        DJANGO_SETTINGS_MODULE='config.settings',
+        DB_NAME='test_wb', DB_USER='wb_admin', DB_PASSWORD='',
+        DB_HOST='localhost', DB_PORT='5432',
+    )
+    return subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=PROJECT_DIR, env=env, check=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+    )
+
+
+def cumulative_import_time(importtime_output, module):
+    for line in importtime_output.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1])
+    raise AssertionError('%s не найден в выводе -X importtime' % module)
+
+
+def test_api_import_fits_startup_budget():
+    result = run_python('import wildberries.api')
+    assert cumulative_import_time(result.stderr, 'wildberries.api') < API_IMPORT_BUDGET_US
+
+
+def test_management_commands_do_not_import_heavy_modules():
+    result = run_python(
+        'import sys, django; django.setup(); '
+        'from wildberries.management.commands import '
+        'make_products, make_orders, delete_orders, delete_products; '
+        'print(",".join(m for m in %r if m in sys.modules))' % HEAVY_MODULES
+    )
+    assert result.stdout.strip() == '', "тяжелые модули загружены при старте команд"
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from wildberries.api import _iter_json_array, resolve_order_statuses
+
+
+class ChunkedResponse(object):
+    """
+        Ответ, который отдает тело блоками заданного размера.
+    """
+
+    def __init__(self, body, chunk_size):
+        self.body = body
+        self.chunk_size = chunk_size
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), self.chunk_size):
+            yield self.body[i:i + self.chunk_size]
+
+
+def test_iter_json_array_survives_any_chunk_boundary():
+    rows = [
+        {'rid': i, 'ts_name': 'Размер "М" [%s]' % i, 'for_pay': i * 1.5}
+        for i in range(50)
+    ] + [123456789, None]
+    body = json.dumps(rows, ensure_ascii=False, indent=2).encode('utf-8')
+    for chunk_size in (1, 2, 7, 64, len(body)):
+        assert list(_iter_json_array(ChunkedResponse(body, chunk_size))) == rows
+
+
+def test_iter_json_array_treats_null_as_empty():
+    assert list(_iter_json_array(ChunkedResponse(b'null', 2))) == []
+
+
+def test_iter_json_array_rejects_truncated_body():
+    with pytest.raises(ValueError):
+        list(_iter_json_array(ChunkedResponse(b'[{"rid": 1}, {"rid"', 4)))
+
+
+def test_resolve_order_statuses_picks_latest_status():
+    orders = [{
+        'order_id': '42',
+        'items': [
+            {'status': 1, 'date': '2021-04-02T10:00:00Z'},
+            {'status': 3, 'date': '2021-04-02T12:00:00.123456789Z'},
+            {'status': 2, 'date': '2021-04-01T23:59:59+03:00'},
+            {'status': 4, 'date': '2021-04-02T12:00:00.123456Z'},
+        ],
+    }]
+    order_statuses = resolve_order_statuses(orders, with_history=True)
+    assert order_statuses == [{
+        'order_id': 42,
+        'status': 3,
+        'history': [
+            ('2021-04-01T23:59:59+03:00', 2),
+            ('2021-04-02T10:00:00Z', 1),
+            ('2021-04-02T12:00:00.123456789Z', 3),
+            ('2021-04-02T12:00:00.123456Z', 4),
+        ],
+    }]
@@ -0,0 +1,105 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from wildberries import cache, transport
+
+
+def _serve(responses):
+    """
+        Поднимает локальный HTTP-сервер, который отвечает
+        кодами из списка responses по очереди.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            code = responses.pop(0) if responses else 200
+            self.send_response(code)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'[]')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:%s' % server.server_port
+
+
+def test_token_bucket_limits_rate():
+    bucket = transport.TokenBucket(rate=50, capacity=1)
+    started_at = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    assert time.monotonic() - started_at >= 0.09, "bucket должен ограничивать частоту"
+
+
+def test_request_retries_throttled_responses(monkeypatch):
+    monkeypatch.setattr(transport, 'BACKOFF_FACTOR', 0.01)
+    server, base_url = _serve([429, 503])
+    try:
+        response = transport.get(base_url, '/api/v1/orders')
+    finally:
+        server.shutdown()
+    assert response.status_code == 200, "429 и 5xx должны повторяться"
+
+
+def test_request_returns_last_response_after_retries(monkeypatch):
+    monkeypatch.setattr(transport, 'BACKOFF_FACTOR', 0.01)
+    monkeypatch.setattr(transport, 'MAX_RETRIES', 1)
+    server, base_url = _serve([500, 500, 500])
+    try:
+        response = transport.get(base_url, '/api/v1/orders')
+    finally:
+        server.shutdown()
+    assert response.status_code == 500
+
+
+def _use_cache(monkeypatch, response_cache):
+    monkeypatch.setattr(transport, '_cache', response_cache)
+    monkeypatch.setattr(transport, '_cache_configured', True)
+
+
+def test_request_records_and_replays_responses(monkeypatch, tmp_path):
+    _use_cache(monkeypatch, cache.ResponseCache(str(tmp_path)))
+    server, base_url = _serve([])
+    try:
+        recorded = transport.get(base_url, '/api/v1/orders', params={'date_start': '1'})
+    finally:
+        server.shutdown()
+    assert recorded.json() == []
+
+    # Сервер остановлен: ответ может прийти только из кэша
+    _use_cache(monkeypatch, cache.ResponseCache(str(tmp_path), replay_only=True))
+    replayed = transport.get(base_url, '/api/v1/orders', params={'date_start': '1'})
+    assert replayed.status_code == 200
+    assert list(replayed.iter_content(1)) == [b'[', b']']
+
+    # В режиме replay_only промах кэша - ошибка, а не запрос в сеть
+    with pytest.raises(cache.CacheMissError):
+        transport.get(base_url, '/api/v1/orders', params={'date_start': '2'})
+
+
+def test_cache_evicts_least_recently_used_entries(tmp_path):
+    response_cache = cache.ResponseCache(str(tmp_path), max_size=400)
+    for key in ('a', 'b'):
+        response_cache.put(key, 200, {}, [b'x' * 100])
+        time.sleep(0.01)
+    assert response_cache.get('a') is not None
+    response_cache.put('c', 200, {}, [b'x' * 100])
+
+    assert response_cache.get('b') is None
+    assert response_cache.get('a') is not None
+    assert response_cache.get('c') is not None
+
+
+def test_cache_keeps_closed_windows_forever(monkeypatch, tmp_path):
+    response_cache = cache.ResponseCache(str(tmp_path), default_ttl=60)
+    response_cache.put('closed', 200, {}, [b'[]'], ttl=cache.FOREVER)
+    response_cache.put('open', 200, {}, [b'[]'])
+
+    monkeypatch.setattr(time, 'time', lambda: 4102444800)
+    assert response_cache.get('closed') is not None
+    assert response_cache.get('open') is None
@@ -0,0 +1,253 @@
+import copy
+import datetime
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from pytz import timezone
+
+from wildberries import api, utils
+from wildberries.models import Order, OrderItem, ProductCard, Store, get_payload_checksum
+from wildberries.tests.factories import make_product_card_payload
+
+
+@pytest.fixture
+def store(db):
+    return Store.objects.create(name='test')
+
+
+def chrt_ids(cards):
+    return {
+        nomenclature['variations'][0]['chrtId']
+        for card in cards for nomenclature in card['nomenclatures']
+    }
+
+
+def test_make_product_cards_creates_cards_with_images(store):
+    cards = [make_product_card_payload(index) for index in range(20)]
+    result = utils.make_product_cards(store, cards)
+
+    assert len(result['created']) == len(chrt_ids(cards))
+    assert not result['updated'] and not result['unchanged']
+    for product_card in store.product_cards.all():
+        nomenclature = next(
+            nomenclature
+            for card in cards for nomenclature in card['nomenclatures']
+            if nomenclature['variations'][0]['chrtId'] == product_card.wildberries_character_id)
+        urls = utils.get_product_images(nomenclature['addin'])
+        assert sorted(product_card.images.values_list('remote_file_url', flat=True)) == sorted(urls)
+        assert (product_card.image.remote_file_url if product_card.image else None) == \
+            (urls[0] if urls else None)
+
+
+@pytest.mark.parametrize('cards_count', [10, 100])
+def test_make_product_cards_skips_unchanged_cards_in_constant_queries(store, cards_count):
+    cards = [make_product_card_payload(index) for index in range(cards_count)]
+    utils.make_product_cards(store, cards)
+
+    with CaptureQueriesContext(connection) as queries:
+        result = utils.make_product_cards(store, cards)
+    assert len(result['unchanged']) == len(chrt_ids(cards))
+    # Выборка контрольных сумм и обновление updated_at,
+    # архив "сырых" данных не читается
+    assert len(queries) <= 4
+    assert not any('wildberries_rawpayload' in query['sql'] for query in queries)
+
+
+def test_make_product_cards_stores_payload_checksum(store):
+    card = make_product_card_payload(0)
+    utils.make_product_cards(store, [card])
+    assert set(store.product_cards.values_list('raw_data_checksum', flat=True)) == {
+        get_payload_checksum(card)}
+
+
+def test_make_product_cards_updates_changed_cards(store):
+    cards = [make_product_card_payload(index) for index in range(5)]
+    utils.make_product_cards(store, cards)
+
+    changed = copy.deepcopy(cards)
+    changed[2]['addin'][0]['params'][0]['value'] = 'Новое имя'
+    result = utils.make_product_cards(store, changed)
+
+    changed_ids = set(store.product_cards
+                      .filter(wildberries_character_id__in=chrt_ids([changed[2]]))
+                      .values_list('id', flat=True))
+    assert set(result['updated']) == changed_ids
+    assert not result['created']
+    assert set(ProductCard.objects.filter(id__in=changed_ids)
+               .values_list('name', flat=True)) == {'Новое имя'}
+
+
+@pytest.fixture
+def fbs_orders(fake_api, access):
+    tz = timezone('UTC')
+    return list(api.fbs_order_list(
+        access, tz.localize(datetime.datetime(2021, 4, 1)), tz.localize(datetime.datetime(2021, 5, 1))))
+
+
+def test_make_fbs_orders_creates_orders_items_and_product_cards(store, fbs_orders):
+    result = utils.make_fbs_orders(store, fbs_orders)
+
+    numbers = {str(order['order_id']) for order in fbs_orders}
+    assert set(store.orders.values_list('number', flat=True)) == numbers
+    assert len(result['created']) == len(numbers) and not result['updated']
+    item_keys = {(str(order['order_id']), item['chrt_id'])
+                 for order in fbs_orders for item in order['items']}
+    assert set(OrderItem.objects.filter(order__store=store)
+               .values_list('order__number', 'wildberries_character_id')) == item_keys
+    assert len(result['created_items']) == len(item_keys)
+    # Карточки-заглушки создаются по одной на chrt_id
+    assert not OrderItem.objects.filter(order__store=store, product_card__isnull=True).exists()
+    assert store.product_cards.count() == len({chrt_id for _, chrt_id in item_keys})
+
+
+def test_make_fbs_orders_skips_unchanged_orders(store, fbs_orders):
+    utils.make_fbs_orders(store, fbs_orders)
+
+    with CaptureQueriesContext(connection) as queries:
+        result = utils.make_fbs_orders(store, fbs_orders)
+    assert not result['created'] and not result['created_items']
+    assert len(result['unchanged']) == len({order['order_id'] for order in fbs_orders})
+    assert not result['updated'] and not result['updated_items'], \
+        "заказы и позиции без изменений не перезаписываются"
+    assert len(queries) <= 10
+
+
+def test_make_fbs_orders_updates_changed_items(store, fbs_orders):
+    utils.make_fbs_orders(store, fbs_orders)
+
+    changed = copy.deepcopy(fbs_orders[0])
+    changed['items'][0]['quantity'] = 5
+    result = utils.make_fbs_orders(store, [changed])
+
+    order = store.orders.get(number=str(changed['order_id']))
+    assert result['updated'] == [order.id]
+    order_item = order.items.get(wildberries_character_id=changed['items'][0]['chrt_id'])
+    assert result['updated_items'] == [order_item.id]
+    assert order_item.quantity == 5
+    assert order_item.raw_product_data_checksum == get_payload_checksum(changed['items'][0])
+    assert order.raw_data_checksum == get_payload_checksum(changed)
+    assert store.orders.count() == len({order['order_id'] for order in fbs_orders})
+
+
+def test_make_product_cards_reconciles_images(store):
+    card = make_product_card_payload(0)
+    card['nomenclatures'][0]['addin'][0]['params'] = [{'value': 'a.jpg'}, {'value': 'b.jpg'}]
+    utils.make_product_cards(store, [card])
+    product_card = store.product_cards.get(
+        wildberries_character_id=card['nomenclatures'][0]['variations'][0]['chrtId'])
+    kept_image_id = product_card.images.get(remote_file_url='b.jpg').id
+
+    card = copy.deepcopy(card)
+    card['nomenclatures'][0]['addin'][0]['params'] = [{'value': 'b.jpg'}, {'value': 'c.jpg'}]
+    utils.make_product_cards(store, [card])
+
+    product_card.refresh_from_db()
+    assert sorted(product_card.images.values_list('remote_file_url', flat=True)) == ['b.jpg', 'c.jpg']
+    assert product_card.image_id == kept_image_id, "существующее изображение не пересоздается"
+
+
+@pytest.mark.parametrize('cards_count', [10, 100])
+def test_make_product_cards_updates_changed_cards_in_constant_queries(store, cards_count):
+    cards = [make_product_card_payload(index) for index in range(cards_count)]
+    utils.make_product_cards(store, cards)
+
+    changed = copy.deepcopy(cards)
+    for card in changed:
+        card['addin'][0]['params'][0]['value'] += ' (новое имя)'
+        for nomenclature in card['nomenclatures']:
+            nomenclature['addin'][0]['params'] = nomenclature['addin'][0]['params'][1:]
+    with CaptureQueriesContext(connection) as queries:
+        result = utils.make_product_cards(store, changed)
+    assert len(result['updated']) == len(chrt_ids(cards))
+    # Карточки с одинаковым набором изменившихся полей
+    # обновляются одним запросом
+    assert len(queries) <= 16
+
+
+def test_make_fbs_orders_reuses_product_card_map(store, fbs_orders):
+    product_card_map = utils.ProductCardMap(store)
+    utils.make_fbs_orders(store, fbs_orders, product_card_map=product_card_map)
+    store.orders.all().delete()
+
+    with CaptureQueriesContext(connection) as queries:
+        utils.make_fbs_orders(store, fbs_orders, product_card_map=product_card_map)
+    assert not any('FROM "wildberries_productcard"' in query['sql'] for query in queries), \
+        "карточки из карты повторно не загружаются"
+    assert not OrderItem.objects.filter(order__store=store, product_card__isnull=True).exists()
+
+
+def test_make_fbs_orders_relinks_items_of_deleted_map_cards(store, fbs_orders):
+    product_card_map = utils.ProductCardMap(store)
+    utils.make_fbs_orders(store, fbs_orders, product_card_map=product_card_map)
+    store.orders.all().delete()
+    deleted = store.product_cards.order_by('id').first()
+    deleted.delete()
+
+    utils.make_fbs_orders(store, fbs_orders, product_card_map=product_card_map)
+    assert not OrderItem.objects.filter(order__store=store, product_card__isnull=True).exists()
+    product_card = store.product_cards.get(
+        wildberries_character_id=deleted.wildberries_character_id)
+    assert product_card_map.get_many([deleted.wildberries_character_id]) == {
+        deleted.wildberries_character_id: product_card.id}
+
+
+def test_product_card_map_evicts_least_recently_used(store):
+    product_cards = [ProductCard.objects.create(store=store, wildberries_character_id=chrt_id)
+                     for chrt_id in (1, 2, 3)]
+    product_card_map = utils.ProductCardMap(store, max_size=2)
+    product_card_map.add(product_cards[:2])
+    product_card_map.get_many([1])
+    product_card_map.add(product_cards[2:])
+
+    assert len(product_card_map) == 2
+    assert 2 not in product_card_map and 1 in product_card_map and 3 in product_card_map
+    assert product_card_map.get_many([2]) == {2: product_cards[1].id}
+
+
+def test_placeholder_cards_keep_card_created_concurrently(store, fbs_orders, monkeypatch):
+    chrt_id = fbs_orders[0]['items'][0]['chrt_id']
+    product_card = ProductCard.objects.create(
+        store=store, wildberries_character_id=chrt_id, name='Карточка из Content API')
+    # Карточка появилась после поиска по карте
+    monkeypatch.setattr(utils.ProductCardMap, 'get_many', lambda self, chrt_ids: {})
+
+    utils.make_fbs_orders(store, fbs_orders[:1])
+
+    product_card.refresh_from_db()
+    assert product_card.name == 'Карточка из Content API'
+    assert OrderItem.objects.get(
+        order__store=store, wildberries_character_id=chrt_id).product_card_id == product_card.id
+
+
+def test_make_product_cards_updates_only_changed_fields(store):
+    card = make_product_card_payload(0)
+    utils.make_product_cards(store, [card])
+
+    changed = copy.deepcopy(card)
+    changed['addin'][0]['params'][0]['value'] += ' (новое имя)'
+    with CaptureQueriesContext(connection) as queries:
+        result = utils.make_product_cards(store, [changed])
+
+    assert result['changed_fields'] == {
+        'name': len(chrt_ids([card])), 'raw_data_checksum': len(chrt_ids([card])),
+    }
+    updates = [query['sql'] for query in queries
+               if query['sql'].startswith('UPDATE "wildberries_productcard"')]
+    assert updates and not any('"description"' in sql or '"price"' in sql for sql in updates)
+
+
+def test_make_fbs_orders_updates_only_changed_order_fields(store, fbs_orders):
+    utils.make_fbs_orders(store, fbs_orders)
+
+    numbers = [str(order['order_id']) for order in fbs_orders]
+    single = next(order for order in fbs_orders if numbers.count(str(order['order_id'])) == 1)
+    changed = copy.deepcopy(single)
+    changed['status'] = '6'
+    result = utils.make_fbs_orders(store, [changed])
+
+    order = store.orders.get(number=str(changed['order_id']))
+    assert result['updated'] == [order.id]
+    assert order.status == Order.DELIVERED
+    assert result['changed_fields'] == {'status': 1, 'raw_data_checksum': 1}
+    assert not result['updated_items'] and not result['changed_item_fields']
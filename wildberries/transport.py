@@ -0,0 +1,303 @@
+"""
+    Общий HTTP-транспорт для всех API Wildberries.
+
+    Для каждого хоста держится одна сессия requests с пулом соединений
+    (keep-alive), у каждого запроса есть таймауты на соединение и чтение,
+    ответы 429 и 5xx повторяются с экспоненциальной задержкой со случайным
+    разбросом, а частота запросов к хосту ограничивается token bucket.
+
+    Успешные ответы могут сохраняться в дисковый кэш (см. cache.py),
+    кэш задается через set_cache() или переменные окружения WB_API_CACHE_*.
+
+    requests импортируется при первом запросе, чтобы команды,
+    которые не обращаются к API, не тратили время на его импорт.
+"""
+import random
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+from . import cache
+
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 60
+
+MAX_RETRIES = 5
+BACKOFF_FACTOR = 0.5
+BACKOFF_MAX = 30
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+POOL_SIZE = 16
+
+CACHE_CHUNK_SIZE = 64 * 1024
+
+# Заголовки и параметры с учетными данными, по ним ответы
+# разных аккаунтов попадают в разные записи кэша
+ACCOUNT_HEADERS = ('Authorization', 'X-Auth-Token')
+ACCOUNT_PARAMS = ('key',)
+
+# Ограничение частоты запросов к хосту по умолчанию:
+# (запросов в секунду, максимальная пачка запросов подряд).
+DEFAULT_RATE_LIMIT = (10, 10)
+
+# Ограничения для отдельных хостов, ключ - netloc, например
+# {'suppliers-stats.wildberries.ru': (1, 1)}.
+# Изменять через set_rate_limit(), чтобы сбросить уже созданный bucket.
+RATE_LIMITS = {}
+
+
+class TokenBucket(object):
+    """
+        Потокобезопасный token bucket.
+        acquire() блокирует поток, пока не появится свободный токен.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_lock = threading.Lock()
+_sessions = {}
+_buckets = {}
+_cache = None
+_cache_configured = False
+
+
+def _host(base_url):
+    return urlsplit(base_url).netloc
+
+
+def set_rate_limit(base_url, rate, capacity=None):
+    """
+        Задает ограничение частоты запросов к хосту base_url.
+            Аргументы:
+                base_url (str): Базовый адрес API.
+                rate (float): Запросов в секунду, None - без ограничения.
+                capacity (int): Сколько запросов можно отправить подряд.
+    """
+    host = _host(base_url)
+    with _lock:
+        if rate is None:
+            RATE_LIMITS[host] = None
+        else:
+            RATE_LIMITS[host] = (rate, capacity or max(1, int(rate)))
+        _buckets.pop(host, None)
+
+
+def get_session(base_url):
+    """
+        Возвращает общую сессию с пулом соединений для хоста base_url.
+    """
+    import requests
+
+    host = _host(base_url)
+    with _lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[host] = session
+        return session
+
+
+def set_cache(response_cache):
+    """
+        Задает дисковый кэш ответов, None - выключает кэш.
+            Аргументы:
+                response_cache (cache.ResponseCache): Кэш ответов.
+    """
+    global _cache, _cache_configured
+    with _lock:
+        _cache = response_cache
+        _cache_configured = True
+
+
+def get_cache():
+    """
+        Возвращает текущий кэш ответов. Если кэш не задан через set_cache(),
+        он создается по переменным окружения (cache.from_env()).
+    """
+    global _cache, _cache_configured
+    with _lock:
+        if not _cache_configured:
+            _cache = cache.from_env()
+            _cache_configured = True
+        return _cache
+
+
+def _get_bucket(host):
+    with _lock:
+        if host not in _buckets:
+            rate_limit = RATE_LIMITS.get(host, DEFAULT_RATE_LIMIT)
+            _buckets[host] = TokenBucket(*rate_limit) if rate_limit else None
+        return _buckets[host]
+
+
+def reset():
+    """
+        Закрывает все сессии и сбрасывает состояние ограничителей.
+        Нужно вызывать в дочернем процессе после fork.
+    """
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _buckets.clear()
+
+
+def _get_retry_delay(response, attempt):
+    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_FACTOR * 2 ** attempt))
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, min(BACKOFF_MAX, int(retry_after)))
+    return delay
+
+
+def _send(method, base_url, url, timeout, max_retries=None, **kwargs):
+    """
+        Отправляет запрос, повторяя ответы 429 и 5xx,
+        ошибки соединения и таймауты до max_retries раз.
+    """
+    import requests
+
+    session = get_session(base_url)
+    bucket = _get_bucket(_host(base_url))
+    if max_retries is None:
+        max_retries = MAX_RETRIES
+
+    attempt = 0
+    while True:
+        if bucket is not None:
+            bucket.acquire()
+
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt >= max_retries:
+                raise
+            time.sleep(_get_retry_delay(None, attempt))
+            attempt += 1
+            continue
+
+        if response.status_code not in RETRY_STATUS_CODES or attempt >= max_retries:
+            return response
+
+        response.close()
+        time.sleep(_get_retry_delay(response, attempt))
+        attempt += 1
+
+
+def _get_cache_key(method, url, cache_params, kwargs):
+    headers = kwargs.get('headers') or {}
+    params = kwargs.get('params') or {}
+    account = (
+        [headers.get(name) for name in ACCOUNT_HEADERS]
+        + [params.get(name) for name in ACCOUNT_PARAMS]
+    )
+    if cache_params is None:
+        cache_params = [kwargs.get('params'), kwargs.get('json')]
+    return cache.make_key(method, url, cache_params, account=account)
+
+
+def _open_cached_response(meta, body_path, url):
+    """
+        Ответ requests.Response, тело которого читается из файла кэша.
+        Работает и с response.json(), и с потоковым iter_content().
+    """
+    import requests
+
+    response = requests.Response()
+    response.raw = open(body_path, 'rb')
+    response.status_code = meta['status_code']
+    response.headers = requests.structures.CaseInsensitiveDict(meta['headers'])
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response.url = url
+    return response
+
+
+def request(method, base_url, path, timeout=None, cache_ttl=None, cache_params=None,
+            **kwargs):
+    """
+        Выполняет HTTP-запрос к API Wildberries.
+        Ответы 429 и 5xx, ошибки соединения и таймауты
+        повторяются до max_retries раз.
+        Если задан кэш ответов, ответ сначала ищется в кэше,
+        а успешный ответ из сети сохраняется в кэш.
+            Аргументы:
+                method (str): HTTP-метод.
+                base_url (str): Базовый адрес API.
+                path (str): Путь эндпоинта.
+                timeout (tuple): Таймауты (соединение, чтение).
+                max_retries (int): Сколько раз повторять запрос,
+                                   по умолчанию MAX_RETRIES.
+                cache_ttl (float): Срок годности ответа в кэше в секундах:
+                                   None - срок кэша по умолчанию,
+                                   cache.FOREVER - без срока годности,
+                                   0 - не использовать кэш.
+                cache_params: Параметры для ключа кэша вместо params и json,
+                              если в запросе есть меняющиеся поля.
+                **kwargs: Параметры requests.Session.request
+                          (params, json, headers, stream).
+            Возвращает:
+                response (requests.Response): Последний полученный ответ.
+    """
+    url = urljoin(base_url, path)
+    timeout = timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+    response_cache = get_cache() if cache_ttl != 0 else None
+    if response_cache is None:
+        return _send(method, base_url, url, timeout, **kwargs)
+
+    key = _get_cache_key(method, url, cache_params, kwargs)
+    cached = response_cache.get(key)
+    if cached is not None:
+        try:
+            return _open_cached_response(*cached, url=url)
+        except FileNotFoundError:
+            # Запись вытеснена между проверкой и чтением
+            pass
+    if response_cache.replay_only:
+        raise cache.CacheMissError('{} {}: ответа нет в кэше'.format(method, url))
+
+    response = _send(method, base_url, url, timeout, **kwargs)
+    if response.status_code != 200:
+        return response
+
+    # Тело пишется в кэш по мере загрузки и читается уже из файла,
+    # поэтому потоковые ответы не загружаются в память целиком
+    with response:
+        meta, body_path = response_cache.put(
+            key, response.status_code, response.headers,
+            response.iter_content(CACHE_CHUNK_SIZE), ttl=cache_ttl)
+    return _open_cached_response(meta, body_path, url)
+
+
+def get(base_url, path, **kwargs):
+    return request('GET', base_url, path, **kwargs)
+
+
+def post(base_url, path, **kwargs):
+    return request('POST', base_url, path, **kwargs)
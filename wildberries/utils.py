@@ -1,13 +1,34 @@
+import collections
+import contextlib
 import decimal
-import hashlib
-import json
+import itertools
 
 import dateutil.parser
-import numpy as np
-from django.db import transaction
+from django.db import connection, transaction
 from django.utils import timezone
 
-from ..models import Order, OrderItem, ProductCard
+from .models import (
+    Order, OrderItem, ProductCard, ProductCardImage, SyncCheckpoint,
+    archive_payloads, get_payload_checksum
+)
+
+
+# Размер одного INSERT/UPDATE при массовой записи
+BULK_BATCH_SIZE = 500
+
+# Первый ключ рекомендательных блокировок PostgreSQL на синхронизацию
+# магазина, второй ключ - id магазина
+STORE_SYNC_LOCK_NAMESPACE = 1001
+
+# Сколько chrt_id держать в карте карточек товаров одной загрузки
+PRODUCT_CARD_MAP_SIZE = 100000
+
+# Поля карточки товара, которые перезаписываются, если карточку
+# одновременно создала загрузка заказов
+PRODUCT_CARD_UPSERT_FIELDS = [
+    'updated_at', 'name', 'price', 'description', 'status', 'sku',
+    'wildberries_fbs_sku', 'wildberries_product_id', 'raw_data_checksum',
+]
 
 
 def get_product_price(variations):
@@ -39,195 +60,704 @@ def get_product_description(addin):
     return ''
 
 
-def make_product_card(store, raw_data):
-    _product_data = raw_data
-    if not _product_data:
-        return None
-
-    product_card = None
-    with transaction.atomic():
-        now = timezone.localtime(timezone.now())
+def iter_chunks(iterable, size):
+    """
+        Разбивает итератор на списки не длиннее size.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def get_sync_checkpoint(store, sync_type, resume=False):
+    """
+        Точка продолжения синхронизации магазина.
+            Аргументы:
+                store (Store): Магазин.
+                sync_type (str): SyncCheckpoint.PRODUCTS или SyncCheckpoint.ORDERS.
+                resume (bool): Вернуть сохраненную точку прерванной
+                               синхронизации, если она есть. Иначе
+                               синхронизация начинается заново.
+            Возвращает:
+                SyncCheckpoint: Сохраненная или новая точка.
+    """
+    checkpoints = store.sync_checkpoints.filter(sync_type=sync_type)
+    if resume:
+        checkpoint = checkpoints.first()
+        if checkpoint is not None:
+            return checkpoint
+    checkpoints.delete()
+    return SyncCheckpoint.objects.create(store=store, sync_type=sync_type,
+                                         started_at=timezone.now())
+
+
+@contextlib.contextmanager
+def store_sync_lock(store):
+    """
+        Рекомендательная блокировка PostgreSQL на синхронизацию магазина
+        на уровне сессии: держится до выхода из блока или до закрытия
+        соединения, если процесс упал.
+            Возвращает:
+                bool: Удалось ли взять блокировку. Если нет,
+                      магазин уже синхронизирует другой процесс.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s, %s)',
+                       [STORE_SYNC_LOCK_NAMESPACE, store.id])
+        locked = cursor.fetchone()[0]
+    try:
+        yield locked
+    finally:
+        if locked:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s, %s)',
+                               [STORE_SYNC_LOCK_NAMESPACE, store.id])
+
+
+def get_changed_fields(instance, values):
+    """
+        Задает полям записи новые значения и возвращает имена полей,
+        значения которых изменились. Значения сравниваются в том виде,
+        в котором они записываются в базу.
+            Аргументы:
+                instance (Model): Запись, поля values должны быть загружены.
+                values (dict): {имя поля: новое значение}.
+            Возвращает:
+                list: Имена изменившихся полей.
+    """
+    changed = []
+    for name, value in values.items():
+        field = instance._meta.get_field(name)
+        if field.get_db_prep_save(getattr(instance, field.attname), connection) \
+                != field.get_db_prep_save(value, connection):
+            changed.append(name)
+        setattr(instance, field.attname, value)
+    return changed
+
+
+def _bulk_update_changes(model, changes, now):
+    """
+        Записывает изменения пачки записей: записи с одинаковым набором
+        изменившихся полей обновляются через bulk_update только по этим
+        полям и updated_at. Записи без изменений не обновляются.
+            Аргументы:
+                changes (list): [(запись, имена изменившихся полей)].
+            Возвращает:
+                collections.Counter: Сколько записей изменилось по каждому полю.
+    """
+    changed_fields = collections.Counter()
+    groups = collections.defaultdict(list)
+    for instance, fields in changes:
+        if not fields:
+            continue
+        changed_fields.update(fields)
+        instance.updated_at = now
+        groups[tuple(sorted(fields))].append(instance)
+    for fields, instances in groups.items():
+        model.objects.bulk_update(instances, list(fields) + ['updated_at'],
+                                  batch_size=BULK_BATCH_SIZE)
+    return changed_fields
+
+
+def format_changed_fields(changed_fields):
+    """
+        Строка со счетчиками изменившихся полей для вывода команд.
+    """
+    return ', '.join('{}: {}'.format(name, count)
+                     for name, count in sorted(changed_fields.items())) or 'нет'
+
+
+def _sync_product_card_images(product_cards, image_urls):
+    """
+        Приводит изображения пачки карточек к спискам адресов
+        и устанавливает основное изображение карточек (без сохранения).
+        Одним запросом загружаются существующие пары (карточка, адрес),
+        новые адреса добавляются одним bulk_create, лишние изображения
+        и дубликаты удаляются одним delete().
+            Аргументы:
+                product_cards (list): Сохраненные ProductCard.
+                image_urls (dict): {id карточки: список адресов изображений}.
+    """
+    wanted = {
+        product_card.id: set(image_urls[product_card.id])
+        for product_card in product_cards
+    }
+    if not wanted:
+        return
+
+    image_ids = {}
+    deleted_ids = []
+    for image_id, product_card_id, remote_file_url in ProductCardImage.objects \
+            .filter(product_card_id__in=list(wanted)) \
+            .order_by('id') \
+            .values_list('id', 'product_card_id', 'remote_file_url'):
+        key = (product_card_id, remote_file_url)
+        if remote_file_url in wanted[product_card_id] and key not in image_ids:
+            image_ids[key] = image_id
+        else:
+            deleted_ids.append(image_id)
+
+    new_images = {}
+    for product_card in product_cards:
+        for remote_file_url in image_urls[product_card.id]:
+            key = (product_card.id, remote_file_url)
+            if key not in image_ids and key not in new_images:
+                new_images[key] = ProductCardImage(product_card_id=product_card.id,
+                                                   remote_file_url=remote_file_url)
+    ProductCardImage.objects.bulk_create(new_images.values(), batch_size=BULK_BATCH_SIZE)
+    for key, image in new_images.items():
+        image_ids[key] = image.id
+
+    # Удаляем неиспользуемые изображения
+    if deleted_ids:
+        ProductCardImage.objects.filter(id__in=deleted_ids).delete()
+
+    # Устанавливаем основное изображение
+    # карточки товара
+    for product_card in product_cards:
+        urls = image_urls[product_card.id]
+        product_card.image_id = image_ids[product_card.id, urls[0]] if urls else None
+
+
+def make_product_cards(store, cards, product_card_map=None):
+    """
+        Сохраняет пачку карточек товаров Content API.
+        Каждая номенклатура карточки - отдельная ProductCard,
+        ключ - wildberries_character_id (chrtId первой вариации).
+        Существующие карточки пачки загружаются одним запросом
+        и делятся на неизменные, измененные и новые. Новые карточки
+        записываются через INSERT ... ON CONFLICT по (store,
+        wildberries_character_id), у измененных обновляются только
+        изменившиеся поля.
+            Аргументы:
+                store (Store): Магазин.
+                cards (list): "Сырые" карточки товаров из product_list.
+                product_card_map (ProductCardMap): Карта карточек загрузки,
+                                                   в нее добавляются новые
+                                                   карточки.
+            Возвращает:
+                dict: Идентификаторы ProductCard по спискам
+                      created, updated и unchanged и счетчик
+                      изменившихся полей (changed_fields).
+    """
+    result = {
+        'created': [], 'updated': [], 'unchanged': [],
+        'changed_fields': collections.Counter(),
+    }
+
+    # Номенклатуры пачки по chrt_id, при повторе побеждает последняя,
+    # как при построчной загрузке
+    nomenclatures = {}
+    for _product_data in cards:
+        if not _product_data:
+            continue
+        product_data_checksum = get_payload_checksum(_product_data)
         for _nomenclature in _product_data['nomenclatures']:
-            product_card_sku = '{}{}'.format(
-                _product_data['supplierVendorCode'], _nomenclature['vendorCode']
-            )
-
-            try:
-                product_card, _ = store.product_cards.get_or_create(
-                    wildberries_character_id=_nomenclature['variations'][0]['chrtId'],
-                    defaults={
-                        'created_at': dateutil.parser.parse(_product_data['createdAt']),
-                        'updated_at': now,
-                        'sku': product_card_sku,
-                        'wildberries_product_id': _product_data['id'],
-                        'wildberries_character_id': _nomenclature['variations'][0]['chrtId']
-                    }
-                )
-            except ProductCard.MultipleObjectsReturned:
-                # В случае обнаружения дубликатов ProductCard
-                # удаляем их
-
-                product_card_qs = store.product_cards \
-                    .filter(sku=product_card_sku) \
-                    .order_by('id')
-                product_card = product_card_qs.first()
-
-                # Удаляем дубликаты
-                product_card_qs \
-                    .exclude(id=product_card.id) \
-                    .delete()
-
-            # проверка карточки товара на изменения
-            product_data_checksum = hashlib.md5(
-                json.dumps(_product_data, sort_keys=True).encode('utf-8')).hexdigest()
-            if product_card.product_data_checksum == product_data_checksum:
-                ProductCard.objects \
-                    .filter(id=product_card.id) \
-                    .update(updated_at=now)
-                return product_card
+            chrt_id = _nomenclature['variations'][0]['chrtId']
+            nomenclatures[chrt_id] = (_product_data, _nomenclature, product_data_checksum)
+    if not nomenclatures:
+        return result
 
+    now = timezone.localtime(timezone.now())
+    with transaction.atomic():
+        # Карточки пачки сравниваются по сохраненным контрольным суммам,
+        # "сырые" данные из базы не загружаются
+        existing = {
+            chrt_id: (product_card_id, raw_data_checksum)
+            for product_card_id, chrt_id, raw_data_checksum in store.product_cards
+            .filter(wildberries_character_id__in=list(nomenclatures))
+            .values_list('id', 'wildberries_character_id', 'raw_data_checksum')
+        }
+
+        new_cards = []
+        changed_ids = []
+        unchanged_ids = []
+        for chrt_id, (_, _, product_data_checksum) in nomenclatures.items():
+            if chrt_id not in existing:
+                continue
+            product_card_id, raw_data_checksum = existing[chrt_id]
+            if raw_data_checksum == product_data_checksum:
+                unchanged_ids.append(product_card_id)
+            else:
+                changed_ids.append(product_card_id)
+        changed_cards = list(ProductCard.objects
+                             .filter(id__in=changed_ids)) if changed_ids else []
+
+        for chrt_id, (_product_data, _, _) in nomenclatures.items():
+            if chrt_id not in existing:
+                new_cards.append(ProductCard(
+                    store=store,
+                    created_at=dateutil.parser.parse(_product_data['createdAt']),
+                    wildberries_product_id=_product_data['id'],
+                    wildberries_character_id=chrt_id,
+                ))
+
+        # Поля карточек сравниваются с сохраненными, записываются
+        # только изменившиеся
+        changes = {}
+        for product_card in new_cards + changed_cards:
+            _product_data, _nomenclature, product_data_checksum = \
+                nomenclatures[product_card.wildberries_character_id]
             product_card.updated_at = now
-            product_card.name = get_product_name(_product_data['addin'])
-            product_card.price = get_product_price(_nomenclature['variations'])
-            product_card.description = get_product_description(_product_data['addin'])
-            product_card.status = ProductCard.PROCESSED
-            product_card.raw_data = _product_data
-            product_card.sku = product_card_sku
+            fields = get_changed_fields(product_card, {
+                'name': get_product_name(_product_data['addin']),
+                'price': get_product_price(_nomenclature['variations']),
+                'description': get_product_description(_product_data['addin']),
+                'status': ProductCard.PROCESSED,
+                'sku': '{}{}'.format(
+                    _product_data['supplierVendorCode'], _nomenclature['vendorCode']),
+                'wildberries_fbs_sku': _nomenclature['nmId'],
+                'raw_data_checksum': product_data_checksum,
+            })
+            if 'raw_data_checksum' in fields:
+                product_card.raw_data = _product_data
+            if product_card.id is not None:
+                changes[product_card.id] = fields
+
+        if unchanged_ids:
+            ProductCard.objects \
+                .filter(id__in=unchanged_ids) \
+                .update(updated_at=now)
+
+        # Карточку с тем же chrt_id могла одновременно создать загрузка
+        # заказов, тогда она перезаписывается данными Content API
+        upserted_cards = _upsert(
+            ProductCard, new_cards,
+            unique_fields=['store', 'wildberries_character_id'],
+            update_fields=PRODUCT_CARD_UPSERT_FIELDS)
+        for product_card in new_cards:
+            product_card.id, created = upserted_cards[
+                store.id, product_card.wildberries_character_id]
+            result['created' if created else 'updated'].append(product_card.id)
+        if product_card_map is not None:
+            product_card_map.add(new_cards)
+
+        # добавление изображений к карточкам товаров
+        image_ids = {product_card.id: product_card.image_id for product_card in changed_cards}
+        _sync_product_card_images(new_cards + changed_cards, {
+            product_card.id: get_product_images(
+                nomenclatures[product_card.wildberries_character_id][1]['addin'])
+            for product_card in new_cards + changed_cards
+        })
+        for product_card in changed_cards:
+            if product_card.image_id != image_ids[product_card.id]:
+                changes[product_card.id].append('image')
+
+        # Новые карточки уже записаны целиком, им нужно только
+        # основное изображение
+        ProductCard.objects.bulk_update(
+            [product_card for product_card in new_cards if product_card.image_id],
+            ['image'], batch_size=BULK_BATCH_SIZE)
+        result['changed_fields'] = _bulk_update_changes(
+            ProductCard,
+            [(product_card, changes[product_card.id]) for product_card in changed_cards],
+            now)
+        archive_payloads(new_cards + changed_cards)
+
+    result['updated'].extend(product_card.id for product_card in changed_cards)
+    result['unchanged'] = unchanged_ids
+    return result
 
-            product_card.wildberries_fbs_sku = _nomenclature['nmId']
 
-            # добавление изображений к карточке товара
-            image_ids = []
-            for _image in get_product_images(_nomenclature['addin']):
-                image, _ = product_card.images.get_or_create(
-                    remote_file_url=_image
-                )
-                image_ids.append(image.id)
-
-            # Удаляем неиспользуемые изображения
-            product_card.images \
-                .exclude(id__in=image_ids) \
-                .delete()
+def make_product_card(store, raw_data):
+    """
+        Сохраняет одну карточку товара, см. make_product_cards.
+        Возвращает ProductCard последней номенклатуры карточки.
+    """
+    if not raw_data:
+        return None
 
-            # Устанавливаем основное изображение
-            # карточки товара
-            if image_ids:
-                product_card.image_id = image_ids[0]
+    make_product_cards(store, [raw_data])
+    return store.product_cards.get(
+        wildberries_character_id=raw_data['nomenclatures'][-1]['variations'][0]['chrtId'])
+
+
+class ProductCardMap(object):
+    """
+        Карта chrt_id -> id карточки товара магазина на время одной
+        загрузки. Карточки, которых нет в карте, загружаются одним
+        запросом на пачку. Размер карты ограничен max_size, при
+        переполнении вытесняются давно не использованные записи.
+        Удаленные карточки нужно убирать из карты через discard().
+    """
+
+    def __init__(self, store, max_size=PRODUCT_CARD_MAP_SIZE):
+        self.store = store
+        self.max_size = max_size
+        self._ids = collections.OrderedDict()
+        self._chrt_ids = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, chrt_id):
+        return chrt_id in self._ids
+
+    def _put(self, chrt_id, product_card_id):
+        previous_id = self._ids.pop(chrt_id, None)
+        if previous_id is not None:
+            self._chrt_ids.pop(previous_id, None)
+        self._ids[chrt_id] = product_card_id
+        self._chrt_ids[product_card_id] = chrt_id
+        while len(self._ids) > self.max_size:
+            _, evicted_id = self._ids.popitem(last=False)
+            self._chrt_ids.pop(evicted_id, None)
+
+    def add(self, product_cards):
+        """
+            Добавляет в карту сохраненные карточки товаров.
+        """
+        for product_card in product_cards:
+            self._put(product_card.wildberries_character_id, product_card.id)
+
+    def get_many(self, chrt_ids):
+        """
+            id карточек товаров по chrt_id. Недостающие в карте
+            загружаются одним запросом.
+                Возвращает:
+                    dict: {chrt_id: id карточки} только для chrt_id,
+                          карточки которых есть в базе.
+        """
+        result = {}
+        missing = set()
+        for chrt_id in chrt_ids:
+            product_card_id = self._ids.get(chrt_id)
+            if product_card_id is None:
+                missing.add(chrt_id)
             else:
-                product_card.image_id = None
+                self._ids.move_to_end(chrt_id)
+                result[chrt_id] = product_card_id
+        if not missing:
+            return result
+
+        loaded = {
+            chrt_id: product_card_id
+            for product_card_id, chrt_id in self.store.product_cards
+            .filter(wildberries_character_id__in=missing)
+            .values_list('id', 'wildberries_character_id')
+        }
+        for chrt_id, product_card_id in loaded.items():
+            self._put(chrt_id, product_card_id)
+        result.update(loaded)
+        return result
+
+    def discard(self, product_card_ids):
+        """
+            Убирает из карты удаленные или объединенные карточки.
+        """
+        for product_card_id in product_card_ids:
+            chrt_id = self._chrt_ids.pop(product_card_id, None)
+            if chrt_id is not None:
+                del self._ids[chrt_id]
+
+    def clear(self):
+        self._ids.clear()
+        self._chrt_ids.clear()
+
+
+def _upsert(model, objs, unique_fields, update_fields):
+    """
+        INSERT ... ON CONFLICT (unique_fields) DO UPDATE SET update_fields
+        для пачки объектов модели, несколько строк на запрос. Без
+        update_fields существующие строки не меняются, но их id
+        тоже возвращаются.
+            Возвращает:
+                dict: {значения unique_fields: (id, создана ли строка)}.
+    """
+    from psycopg2.extras import execute_values
+
+    if not objs:
+        return {}
+
+    meta = model._meta
+    qn = connection.ops.quote_name
+    fields = [field for field in meta.concrete_fields if not field.primary_key]
+    unique_columns = ', '.join(qn(meta.get_field(name).column) for name in unique_fields)
+    if update_fields:
+        updates = ', '.join(
+            '{0} = EXCLUDED.{0}'.format(qn(meta.get_field(name).column))
+            for name in update_fields)
+    else:
+        # DO NOTHING не возвращает существующие строки
+        updates = '{0} = {1}.{0}'.format(
+            qn(meta.get_field(unique_fields[0]).column), qn(meta.db_table))
+    sql = (
+        'INSERT INTO {table} ({columns}) VALUES %s '
+        'ON CONFLICT ({unique_columns}) DO UPDATE SET {updates} '
+        'RETURNING {unique_columns}, {table}.id, {table}.xmax = 0'
+    ).format(
+        table=qn(meta.db_table),
+        columns=', '.join(qn(field.column) for field in fields),
+        unique_columns=unique_columns,
+        updates=updates,
+    )
+    rows = [
+        tuple(field.get_db_prep_save(getattr(obj, field.attname), connection)
+              for field in fields)
+        for obj in objs
+    ]
+    with connection.cursor() as cursor:
+        returned = execute_values(cursor, sql, rows, page_size=BULK_BATCH_SIZE, fetch=True)
+    return {tuple(row[:-2]): (row[-2], row[-1]) for row in returned}
+
+
+def _link_order_items_to_product_cards(store, order_items, now, product_card_map):
+    """
+        Привязывает позиции заказов без карточки товара к карточкам
+        магазина по chrt_id. Недостающие карточки создаются заглушками.
+            Аргументы:
+                order_items (dict): {id позиции: (chrt_id, позиция из API,
+                                    дата создания заказа)}.
+                product_card_map (ProductCardMap): Карта карточек загрузки.
+    """
+    from psycopg2.extras import execute_values
+
+    # Вторая попытка нужна, только если в карте были удаленные карточки
+    for _ in range(2):
+        if not order_items:
+            return
+        product_card_ids = product_card_map.get_many({
+            chrt_id for chrt_id, _, _ in order_items.values()})
+
+        new_cards = {}
+        for chrt_id, _product_data, date_created in order_items.values():
+            if chrt_id in product_card_ids or chrt_id in new_cards:
+                continue
+            product_card = ProductCard(
+                store=store,
+                created_at=dateutil.parser.parse(date_created),
+                updated_at=now,
+                sku='#####',
+                name='#####',
+                price=_product_data['total_price'],
+                wildberries_fbs_sku=_product_data['nm_id'] or 0,
+                wildberries_character_id=chrt_id,
+            )
+            product_card.raw_data = _product_data
+            new_cards[chrt_id] = product_card
+        # Карточку могла одновременно создать загрузка карточек товаров,
+        # ее данные заглушкой не перезаписываются
+        upserted_cards = _upsert(ProductCard, list(new_cards.values()),
+                                 unique_fields=['store', 'wildberries_character_id'],
+                                 update_fields=[])
+        created_cards = []
+        for chrt_id, product_card in new_cards.items():
+            product_card.id, created = upserted_cards[store.id, chrt_id]
+            if created:
+                created_cards.append(product_card)
+        archive_payloads(created_cards)
+        product_card_map.add(new_cards.values())
+        for chrt_id, product_card in new_cards.items():
+            product_card_ids[chrt_id] = product_card.id
+
+        # Карточка из карты могла быть удалена после загрузки в карту
+        # (или ее создание откатилось вместе с прошлой пачкой): такие
+        # позиции не привязываются, а карточки убираются из карты
+        with connection.cursor() as cursor:
+            linked = execute_values(
+                cursor,
+                'UPDATE wildberries_orderitem SET product_card_id = link.product_card_id '
+                'FROM (VALUES %s) AS link (id, product_card_id) '
+                'JOIN wildberries_productcard AS card ON card.id = link.product_card_id '
+                'WHERE wildberries_orderitem.id = link.id '
+                'RETURNING wildberries_orderitem.id',
+                [(order_item_id, product_card_ids[chrt_id])
+                 for order_item_id, (chrt_id, _, _) in order_items.items()],
+                page_size=BULK_BATCH_SIZE, fetch=True)
+        linked_ids = {order_item_id for order_item_id, in linked}
+        order_items = {
+            order_item_id: order_item for order_item_id, order_item in order_items.items()
+            if order_item_id not in linked_ids
+        }
+        product_card_map.discard({
+            product_card_ids[chrt_id] for chrt_id, _, _ in order_items.values()})
+
+
+def make_fbs_orders(store, orders, rebuild=False, product_card_map=None):
+    """
+        Сохраняет пачку заказов из fbs_order_list несколькими запросами.
+        Новые заказы и позиции записываются через INSERT ... ON CONFLICT
+        по (store, number) и (order, wildberries_character_id),
+        недостающие карточки товаров создаются одним bulk_create.
+        Заказы, "сырые" данные которых не изменились, пропускаются,
+        у существующих заказов и позиций обновляются только
+        изменившиеся поля.
+            Аргументы:
+                store (Store): Магазин.
+                orders (list): Заказы из fbs_order_list. Один заказ
+                               может встречаться несколько раз
+                               (по разу на каждый статус позиций).
+                rebuild (bool): Перезаписать заказы и позиции без
+                                проверки изменений.
+                product_card_map (ProductCardMap): Карта карточек товаров,
+                                                   общая для пачек одной
+                                                   загрузки. По умолчанию
+                                                   создается на пачку.
+            Возвращает:
+                dict: Идентификаторы Order по спискам created, updated
+                      и unchanged, идентификаторы OrderItem по спискам
+                      created_items и updated_items, счетчики
+                      изменившихся полей заказов (changed_fields)
+                      и позиций (changed_item_fields).
+    """
+    result = {
+        'created': [], 'updated': [], 'unchanged': [],
+        'created_items': [], 'updated_items': [],
+        'changed_fields': collections.Counter(),
+        'changed_item_fields': collections.Counter(),
+    }
+    orders = [_order for _order in orders if _order]
+    if not orders:
+        return result
 
-            product_card.save()
-    return product_card
+    now = timezone.localtime(timezone.now())
+    with transaction.atomic():
+        existing = {
+            order.number: order
+            for order in store.orders
+            .filter(number__in={str(_order['order_id']) for _order in orders})
+            .only('id', 'store', 'number', 'status', 'raw_data_checksum')
+        }
+
+        # Заказ мог измениться, если изменилась хотя бы одна его запись.
+        # Для таких заказов собираются позиции всех записей
+        # по chrt_id (при повторе побеждает последняя) и последняя
+        # запись, которая сохраняется в raw_data.
+        changed = {}
+        for _order in orders:
+            number = str(_order['order_id'])
+            if rebuild or number not in existing \
+                    or existing[number].raw_data_checksum != get_payload_checksum(_order):
+                changed[number] = [None, {}]
+        for _order in orders:
+            number = str(_order['order_id'])
+            if number in changed:
+                changed[number][0] = _order
+                for _product_data in _order['items']:
+                    changed[number][1][_product_data['chrt_id']] = _product_data
+
+        new_orders = []
+        order_changes = []
+        for number, (_order, _) in changed.items():
+            status = Order.parse_status(_order['status'], 'wildberries')
+            order = existing.get(number)
+            if order is None:
+                order = Order(
+                    store=store,
+                    number=number,
+                    created_at=timezone.localtime(dateutil.parser.parse(_order['date_created'])),
+                    updated_at=now,
+                    in_process_at=timezone.localtime(
+                        dateutil.parser.parse(_order['date_created'])),
+                    posting_type=Order.WILDBERRIES_FBS,
+                    status=status,
+                )
+                order.raw_data = _order
+                new_orders.append(order)
+                continue
+            values = {'status': status, 'raw_data_checksum': get_payload_checksum(_order)}
+            fields = get_changed_fields(order, values)
+            if rebuild:
+                fields = list(values)
+            if 'raw_data_checksum' in fields:
+                order.raw_data = _order
+            order_changes.append((order, fields))
+
+        upserted_orders = _upsert(
+            Order, new_orders,
+            unique_fields=['store', 'number'],
+            update_fields=['updated_at', 'status', 'raw_data_checksum'])
+        for order in new_orders:
+            order.id, created = upserted_orders[store.id, order.number]
+            result['created' if created else 'updated'].append(order.id)
+        order_ids = {order.number: order.id for order in new_orders}
+        result['changed_fields'] = _bulk_update_changes(Order, order_changes, now)
+        archive_payloads(new_orders + [order for order, _ in order_changes])
+        for order, fields in order_changes:
+            order_ids[order.number] = order.id
+            result['updated' if fields else 'unchanged'].append(order.id)
+        result['unchanged'].extend(
+            order.id for number, order in existing.items() if number not in changed)
+        result['unchanged'].sort()
+
+        existing_items = {
+            (order_item.order_id, order_item.wildberries_character_id): order_item
+            for order_item in OrderItem.objects
+            .filter(order_id__in=[order.id for order, _ in order_changes])
+            .only('id', 'order_id', 'wildberries_character_id', 'quantity',
+                  'raw_product_data_checksum', 'product_card_id')
+        } if order_changes else {}
+
+        new_items = []
+        item_changes = []
+        unlinked = {}
+        for number, (_order, items) in changed.items():
+            order_id = order_ids[number]
+            for chrt_id, _product_data in items.items():
+                quantity = _product_data['quantity'] or 1
+                order_item = existing_items.get((order_id, chrt_id))
+                if order_item is None:
+                    order_item = OrderItem(
+                        order_id=order_id,
+                        updated_at=now,
+                        wildberries_character_id=chrt_id,
+                        quantity=quantity,
+                        price=_product_data['total_price'],
+                        commission=_product_data['retail_commission'],
+                        delivery_cost=_product_data['delivery_rub'],
+                    )
+                    order_item.raw_product_data = _product_data
+                    new_items.append(order_item)
+                    continue
+                values = {
+                    'quantity': quantity,
+                    'raw_product_data_checksum': get_payload_checksum(_product_data),
+                }
+                fields = get_changed_fields(order_item, values)
+                if rebuild:
+                    fields = list(values)
+                if 'raw_product_data_checksum' in fields:
+                    order_item.raw_product_data = _product_data
+                item_changes.append((order_item, fields))
+                if fields:
+                    result['updated_items'].append(order_item.id)
+                if order_item.product_card_id is None:
+                    unlinked[order_item.id] = (chrt_id, _product_data, _order['date_created'])
+
+        upserted_items = _upsert(
+            OrderItem, new_items,
+            unique_fields=['order', 'wildberries_character_id'],
+            update_fields=['updated_at', 'quantity', 'raw_product_data_checksum'])
+        result['changed_item_fields'] = _bulk_update_changes(OrderItem, item_changes, now)
+
+        date_created_by_order_id = {
+            order_ids[number]: _order['date_created'] for number, (_order, _) in changed.items()
+        }
+        for order_item in new_items:
+            order_item.id, created = upserted_items[
+                order_item.order_id, order_item.wildberries_character_id]
+            result['created_items' if created else 'updated_items'].append(order_item.id)
+            unlinked[order_item.id] = (
+                order_item.wildberries_character_id, order_item.raw_product_data,
+                date_created_by_order_id[order_item.order_id])
+        archive_payloads(new_items + [order_item for order_item, _ in item_changes])
+        if unlinked:
+            if product_card_map is None:
+                product_card_map = ProductCardMap(store)
+            _link_order_items_to_product_cards(store, unlinked, now, product_card_map)
+
+    return result
 
 
 def make_fbs_order(store, raw_data, rebuild=False):
-    _order = raw_data
-    if not _order:
+    """
+        Сохраняет один заказ, см. make_fbs_orders.
+    """
+    if not raw_data:
         return None
 
-    now = timezone.localtime(timezone.now())
-
-    order = None
-    with transaction.atomic():
-        try:
-            order, _ = store.orders.get_or_create(
-                number=_order['order_id'],
-                defaults={
-                    'created_at': timezone.localtime(dateutil.parser.parse(_order['date_created'])),
-                    'updated_at': now,
-                    'in_process_at': timezone.localtime(dateutil.parser.parse(_order['date_created'])),
-                    'number': _order['order_id'],
-                    'posting_type': Order.WILDBERRIES_FBS,
-                    'status': Order.parse_status(_order['status'], 'wildberries')
-                }
-            )
-        except Order.MultipleObjectsReturned:
-            # В случае обнаружения дубликатов Order
-            # удаляем их
-
-            order_qs = store.orders \
-                .filter(number=_order['order_id']) \
-                .order_by('id')
-            order = order_qs.first()
-
-            # Удаляем дубликаты
-            order_qs \
-                .exclude(id=order.id) \
-                .delete()
-
-        order_data_checksum = hashlib.md5(json.dumps(_order, sort_keys=True).encode('utf-8')).hexdigest()
-        if not rebuild and order.order_data_checksum == order_data_checksum:
-            return order
-
-        for _product_data in _order['items']:
-            order_item_changed = False
-
-            try:
-                order_item, _ = order.items.get_or_create(
-                    wildberries_character_id=_product_data['chrt_id'],
-                    defaults={
-                        'quantity': _product_data['quantity'] or 1,
-                        'price': _product_data['total_price'],
-                        'commission': _product_data['retail_commission'],
-                        'delivery_cost': _product_data['delivery_rub'],
-                    }
-                )
-            except OrderItem.MultipleObjectsReturned:
-                # В случае обнаружения дубликатов OrderItem
-                # удаляем их
-
-                order_item_qs = order.items \
-                    .filter(wildberries_character_id=_product_data['chrt_id']) \
-                    .order_by('id')
-                order_item = order_item_qs.first()
-
-                # Удаляем дубликаты
-                order_item_qs \
-                    .exclude(id=order_item.id) \
-                    .delete()
-
-            product_data_checksum = hashlib.md5(json.dumps(_product_data, sort_keys=True).encode('utf-8')).hexdigest()
-            if rebuild or not order_item.product_data_checksum == product_data_checksum:
-                order_item_changed = True
-
-                order_item.raw_product_data = _product_data
-
-                order_item.quantity = _product_data['quantity'] or 1
-
-                if not order_item.product_card_id:
-                    try:
-                        product_card, _ = store.product_cards.get_or_create(
-                            wildberries_character_id=_product_data['chrt_id'],
-                            defaults={
-                                'created_at': dateutil.parser.parse(_order['date_created']),
-                                'updated_at': now,
-                                'sku': '#####',
-                                'name': '#####',
-                                'price': _product_data['total_price'],
-                                'wildberries_fbs_sku': _product_data['nm_id'] or 0,
-                                'raw_data': _product_data
-                            })
-                    except ProductCard.MultipleObjectsReturned:
-                        # В случае обнаружения дубликатов ProductCard
-                        # удаляем их
-
-                        product_card_qs = store.product_cards \
-                            .filter(sku=_product_data['sa_name']) \
-                            .order_by('id')
-                        product_card = product_card_qs.first()
-
-                        # Удаляем дубликаты
-                        product_card_qs \
-                            .exclude(id=product_card.id) \
-                            .delete()
-                    order_item.product_card = product_card
-
-            if order_item_changed:
-                order_item.updated_at = now
-                order_item.save()
-
-        order.updated_at = now
-        order.raw_data = _order
-        order.save()
-
-    return order
+    make_fbs_orders(store, [raw_data], rebuild=rebuild)
+    return store.orders.get(number=str(raw_data['order_id']))